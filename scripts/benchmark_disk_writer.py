@@ -0,0 +1,79 @@
+"""Benchmarks the native disk writer against the dd path used by the alpine container
+
+Usage: python scripts/benchmark_disk_writer.py [TARGET] [--size-mib N] [--direct]
+
+TARGET defaults to a temporary file. Pointing it at a loop device or a scratch USB stick
+gives numbers representative of flashing real disks, but will destroy its contents.
+"""
+
+from pathlib import Path
+import subprocess
+import tempfile
+import time
+from typing import Annotated, Optional
+
+import typer
+
+from node_deployer.disk_writer import write_image
+
+
+BLOCK_SIZES = (64 * 1024, 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024)
+
+
+def dd(image: Path, target: Path) -> float:
+    """Writes the image as the alpine container does (dd's default 512 byte blocks)
+
+    Args:
+        image (Path): The image to write
+        target (Path): The disk or file to write to
+
+    Returns:
+        float: The number of seconds the write took, including a final fsync
+    """
+    start = time.monotonic()
+    subprocess.run(
+        ["dd", f"if={image}", f"of={target}", "conv=fsync"],
+        check=True,
+        capture_output=True,
+    )
+    return time.monotonic() - start
+
+
+def random_mib() -> bytes:
+    """Returns a MiB of random bytes, so the image can't be compressed or deduplicated
+
+    Returns:
+        bytes: The random bytes
+    """
+    with open("/dev/urandom", "rb") as f:
+        return f.read(2**20)
+
+
+def main(
+    target: Annotated[Optional[Path], typer.Argument()] = None,
+    size_mib: Annotated[int, typer.Option("--size-mib", min=1)] = 256,
+    direct: Annotated[bool, typer.Option("--direct")] = False,
+) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        image = Path(tmp) / "ignition.img"
+        with open(image, "wb") as f:
+            for _ in range(size_mib):
+                f.write(random_mib())
+        target = Path(tmp) / "target.img" if target is None else target
+        size = image.stat().st_size
+        seconds = dd(image, target)
+        typer.echo(f"{'dd bs=512':>24}: {size / seconds / 2**20:8.1f} MiB/s")
+        for block_size in BLOCK_SIZES:
+            stats = write_image(
+                image,
+                target,
+                block_size=block_size,
+                direct=direct,
+                regular_file=not target.is_block_device(),
+            )
+            label = f"native bs={block_size // 1024}KiB{' direct' if direct else ''}"
+            typer.echo(f"{label:>24}: {stats.rate / 2**20:8.1f} MiB/s")
+
+
+if __name__ == "__main__":
+    typer.run(main)
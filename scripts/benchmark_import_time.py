@@ -0,0 +1,28 @@
+"""Breaks down the time the CLI spends importing modules before running a command
+
+Usage: python scripts/benchmark_import_time.py [ARGS]... [--top N]
+
+ARGS are passed to the CLI and default to --help, e.g. to see what running a command
+imports: python scripts/benchmark_import_time.py -- create-img --help
+"""
+
+from typing import Annotated, List, Optional
+
+from importtime import import_times
+import typer
+
+
+def main(
+    args: Annotated[Optional[List[str]], typer.Argument()] = None,
+    top: Annotated[int, typer.Option("--top", min=1)] = 20,
+) -> None:
+    times = import_times(args or ["--help"])
+    # Only top level modules are summed, as a package's time includes its submodules
+    total = sum(t for module, t in times.items() if "." not in module)
+    typer.echo(f"{'total':>48}: {total / 1000:8.1f} ms")
+    for module, t in sorted(times.items(), key=lambda mt: mt[1], reverse=True)[:top]:
+        typer.echo(f"{module:>48}: {t / 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,35 @@
+"""Measures what the CLI imports, for the import time benchmark and the test suite"""
+
+import os
+from pathlib import Path
+import subprocess
+import sys
+from typing import Dict, Sequence
+
+
+# The CLI must import the copy of the package in this checkout
+SRC_DIR = Path(__file__).resolve().parent.parent / "src"
+
+
+def import_times(args: Sequence[str]) -> Dict[str, int]:
+    """Runs the CLI with -X importtime
+
+    Args:
+        args (Sequence[str]): The arguments to run the CLI with
+
+    Returns:
+        Dict[str, int]: The cumulative import time of each module, in microseconds
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "node_deployer", *args],
+        capture_output=True,
+        text=True,
+        env={**os.environ, "PYTHONPATH": os.pathsep.join((str(SRC_DIR), *sys.path))},
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, module = line.removeprefix("import time:").split("|")
+            if cumulative.strip().isdigit():
+                times[module.strip()] = int(cumulative)
+    return times
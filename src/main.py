@@ -1,10 +1,7 @@
-import flet as ft
 import typer
 from typing import Dict, Any
 
 from node_deployer.config import config
-from node_deployer import app as _cli_app
-from node_deployer_gui import main as gui_main
 
 
 cmd_params: Dict[Any, Any] = config.typer
@@ -17,13 +14,22 @@ app = typer.Typer(
 
 @app.command(name="gui", help="The GUI interface for the node deployer", **cmd_params)
 @app.callback(invoke_without_command=True)
-def gui_app():
+def gui_app(ctx: typer.Context):
+    # As the callback, this also runs before any subcommand, which should run on its own
+    if ctx.invoked_subcommand is not None:
+        return
+    # flet and the GUI are only imported here, so the CLI doesn't pay for importing them
+    import flet as ft
+    from node_deployer_gui import main as gui_main
+
     ft.app(target=gui_main)
 
 
 @app.command(name="cli", help="The CLI interface for the node deployer", **cmd_params)
 def cli_app():
     config.update_config("cli")
+    from node_deployer import app as _cli_app
+
     _cli_app()
 
 
@@ -1,11 +1,6 @@
-from . import (
-    config,
-    autoignition,
-    create_img,
-    create_disk,
-)
+from importlib import import_module
+from typing import Any
 
-from .node_deployer import app
 
 __all__ = [
     "config",
@@ -14,3 +9,13 @@ __all__ = [
     "create_disk",
     "app",
 ]
+
+
+def __getattr__(name: str) -> Any:
+    # Submodules are imported on first access, so importing the package (e.g. to run a
+    # single command) doesn't import every command's dependencies
+    if name == "app":
+        return import_module(".node_deployer", __name__).app
+    if name in __all__:
+        return import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,66 +1,180 @@
+from contextlib import contextmanager
 from fnmatch import fnmatch
+from hashlib import sha256
 import io
 from pathlib import Path
+import re
 import tarfile
 import time
-from typing import Annotated
+from typing import Annotated, Dict, Iterable, Iterator, List, Optional, Tuple
 
 import docker
-import git
 from selenium import webdriver
 from selenium.webdriver.common.by import By
+from selenium.webdriver.remote.webelement import WebElement
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import WebDriverWait  # type: ignore
 import typer
 
+from . import progress
 from .cli import cli_spinner
 from .config import config
 from .debug import debug_guard
-from .utils import ensure_build_dir, next_free_tcp_port
+from .fuelignition_source import update_source
+from .readiness import wait_for_log
+from .timings import timed_command
+from .utils import (
+    ChunkReader,
+    docker_engine_version,
+    ensure_build_dir,
+    file_size,
+    next_free_tcp_port,
+    release_tcp_port,
+)
 
 
-def create_driver(port: int) -> webdriver.Remote:
+DOWNLOADS_DIR: str = "/home/seluser/Downloads"
+FUELIGNITION_IMAGE: str = "fuel-ignition"
+CHUNK_SIZE: int = 1024 * 1024
+BUILD_STEP = re.compile(r"^Step (\d+)/(\d+)")
+
+
+def download_dir(session: int) -> str:
+    """Returns the download directory used by a browser session in the selenium container
+
+    Args:
+        session (int): The index of the browser session
+
+    Returns:
+        str: The download directory for the session
+    """
+    # Session directories are siblings so that no session ever sees another's downloads
+    return DOWNLOADS_DIR if session == 0 else f"{DOWNLOADS_DIR}-{session}"
+
+
+def create_driver(port: int, downloads: str = DOWNLOADS_DIR) -> webdriver.Remote:
     """Creates a selenium webdriver instance
 
     Args:
         port (int): The port to connect to
+        downloads (str, optional): The directory the browser downloads to.
+            Defaults to DOWNLOADS_DIR.
 
     Returns:
         webdriver.Remote: The created webdriver instance
     """
+    options = webdriver.FirefoxOptions()
+    options.set_preference("browser.download.folderList", 2)
+    options.set_preference("browser.download.useDownloadDir", True)
+    options.set_preference("browser.download.dir", downloads)
     driver = webdriver.Remote(
         f"http://127.0.0.1:{port}",
-        options=webdriver.FirefoxOptions(),
+        options=options,
     )
     driver.implicitly_wait(10)
     return driver
 
 
-def convert_json_via_fuelignition(
+def container_path(path: Path) -> Path:
+    """Maps a path on the host to the same path inside a container with the CWD_MOUNT
+
+    Args:
+        path (Path): The host path, absolute or relative to the project root
+
+    Returns:
+        Path: The corresponding path inside the container
+    """
+    return config.CWD_MOUNTDIR / (config.PROJECT_ROOT / path).relative_to(config.PROJECT_ROOT)
+
+
+def downloaded_file(
+    container: docker.models.containers.Container,  # type: ignore
+    downloads: str,
+) -> Optional[str]:
+    """Returns the name of the completed download in a download directory, if there is one
+
+    Args:
+        container (docker.models.containers.Container): The selenium container
+        downloads (str): The download directory to check
+
+    Returns:
+        Optional[str]: The name of the downloaded file, or None if no download has completed
+    """
+    result = container.exec_run(["ls", downloads])
+    if result.exit_code != 0:
+        return None
+    files = result.output.decode().split()
+    # Firefox keeps a ".part" file alongside the download until it is complete
+    if not files or any(f.endswith(".part") for f in files):
+        return None
+    return files[0]
+
+
+def extract_archive(
+    chunks: Iterable[bytes], dest: Path, update: Optional[progress.Update] = None
+) -> str:
+    """Streams the first file in a tar archive to a destination, hashing it on the way
+
+    Only CHUNK_SIZE bytes of the file are held in memory at a time, and the destination
+    is only replaced once the whole file has been written.
+
+    Args:
+        chunks (Iterable[bytes]): The tar archive, as a stream of chunks
+        dest (Path): The path to write the file to
+        update (Optional[progress.Update], optional): Called with the bytes written so far
+            and the size of the file. Defaults to None.
+
+    Raises:
+        Exception: If the archive does not contain a file
+
+    Returns:
+        str: The sha256 digest of the file
+    """
+    partial = dest.with_name(f".{dest.name}.part")
+    digest = sha256()
+    with tarfile.open(fileobj=io.BufferedReader(ChunkReader(chunks)), mode="r|") as tar:
+        for member in tar:
+            source = tar.extractfile(member) if member.isfile() else None
+            if source is None:
+                continue
+            with open(partial, "wb") as f:
+                while chunk := source.read(CHUNK_SIZE):
+                    digest.update(chunk)
+                    f.write(chunk)
+                    if update is not None:
+                        update(f.tell(), member.size)
+            partial.replace(dest)
+            return digest.hexdigest()
+    raise Exception("Failed to extract image from tarfile")
+
+
+def convert_in_browser(
     container: docker.models.containers.Container,  # type: ignore
     driver: webdriver.Remote,
     fuelignition_json: Path,
-    img_path: Path,
-) -> None:
-    """Converts a fuel-ignition json file to an ignition disk image file
+    downloads: str,
+) -> WebElement:
+    """Uploads a fuel-ignition json file to the loaded fuel-ignition page and converts it
 
     Args:
         container (docker.models.containers.Container): The selenium container
         driver (webdriver.Remote): The selenium webdriver instance
         fuelignition_json (Path): The path to the fuel-ignition json file
-        img_path (Path): The path to the output ignition disk image file
+        downloads (str): The directory the driver's browser downloads to
+
+    Returns:
+        WebElement: The "Load Settings from" input the json was uploaded with
     """
-    driver.get(config.FUELIGNITION_URL)
     # Navigate to "Load Settings from" and upload the json
     load_from = driver.find_element(By.NAME, "load_from")
-    load_from.send_keys(str(config.CWD_MOUNTDIR / fuelignition_json))
+    load_from.send_keys(str(container_path(fuelignition_json)))
     # Walk through page structure to find, scroll to and click "Convert and Download"
     export = driver.find_element(By.ID, "export")
     export_divs = export.find_elements(By.TAG_NAME, "div")
     convert_div = export_divs[9]
     convert_button = convert_div.find_element(By.TAG_NAME, "button")
-    # Ensure "Downloads" is empty if it exists
-    container.exec_run("[ -d /home/seluser/Downloads/* ] && rm /home/seluser/Downloads/*")
+    # Ensure the download directory exists and is empty
+    container.exec_run(["sh", "-c", f"mkdir -p {downloads} && rm -f {downloads}/*"])
     # A hacky way of scrolling to the element, but is only way i can find right now
     convert_button.location_once_scrolled_into_view
     time.sleep(1)
@@ -68,80 +182,388 @@ def convert_json_via_fuelignition(
     w.until_not(EC.invisibility_of_element(convert_button))
     w.until(EC.element_to_be_clickable(convert_button))
     convert_button.click()
+    return load_from
+
+
+def convert_json_via_fuelignition(
+    container: docker.models.containers.Container,  # type: ignore
+    driver: webdriver.Remote,
+    fuelignition_json: Path,
+    img_path: Path,
+    downloads: str = DOWNLOADS_DIR,
+) -> str:
+    """Converts a fuel-ignition json file to an ignition disk image file
+
+    Args:
+        container (docker.models.containers.Container): The selenium container
+        driver (webdriver.Remote): The selenium webdriver instance
+        fuelignition_json (Path): The path to the fuel-ignition json file
+        img_path (Path): The path to the output ignition disk image file
+        downloads (str, optional): The directory the driver's browser downloads to.
+            Defaults to DOWNLOADS_DIR.
+
+    Returns:
+        str: The sha256 digest of the ignition disk image
+    """
+    # A warm pool's driver will already have the page loaded
+    with progress.task("Loading fuel-ignition"):
+        if driver.current_url != config.FUELIGNITION_URL:
+            driver.get(config.FUELIGNITION_URL)
+    with progress.task("Converting in browser"):
+        load_from = convert_in_browser(container, driver, fuelignition_json, downloads)
+    # Clear the upload so the next conversion on this page triggers a fresh load
+    driver.execute_script("arguments[0].value = '';", load_from)
     # Now, wait for the file to be downloaded
-    while container.exec_run("ls /home/seluser/Downloads/").exit_code != 0:
-        time.sleep(0.1)
-    while ".img.part" in container.exec_run("ls /home/seluser/Downloads/").output.decode():
-        time.sleep(0.1)
-    image_file = container.exec_run("ls /home/seluser/Downloads/").output.decode().split()[0]
-    # Finally, fetch the image file from the container
-    client_image_path = f"/home/seluser/Downloads/{image_file}"
-    host_image_path = config.PROJECT_ROOT / img_path
-    if host_image_path.exists():
-        host_image_path.unlink()
-    filestream = container.get_archive(client_image_path)[0]
-    # unpack the tarfile in memory
-    bytestream = io.BytesIO(b"".join(chunk for chunk in filestream))
-    bytestream.seek(0)
-    tar = tarfile.open(fileobj=bytestream)
-    container_image = tar.extractfile(tar.getmembers()[0].name)
-    if container_image is None:
-        raise Exception("Failed to extract image from tarfile")
-    with open(host_image_path, "wb+") as f:
-        f.write(container_image.read())
+    with progress.task("Waiting for download"):
+        while (image_file := downloaded_file(container, downloads)) is None:
+            progress.check_cancelled()
+            time.sleep(0.1)
+    # Finally, stream the image file out of the container
+    with progress.task("Transferring image") as update:
+        filestream, _ = container.get_archive(f"{downloads}/{image_file}", chunk_size=CHUNK_SIZE)
+        return extract_archive(filestream, config.PROJECT_ROOT / img_path, update)
 
 
-def build_fuelignition() -> docker.models.images.Image:  # type: ignore
-    """Builds the fuel-ignition docker image
+def fuelignition_dockerfile() -> Path:
+    """Returns the Dockerfile to build fuel-ignition with on this docker engine
 
     Returns:
-        docker.models.images.Image: The built docker image
+        Path: The Dockerfile to build fuel-ignition with
     """
-    # Make sure the local fuel-ignition repo is up to date
-    if (not config.FUELIGNITION_BUILD_DIR.exists()) or (
-        len(tuple(config.FUELIGNITION_BUILD_DIR.iterdir())) == 0
-    ):
-        repo = git.Repo.clone_from(
-            "https://github.com/openSUSE/fuel-ignition.git",
-            config.FUELIGNITION_BUILD_DIR,
-            branch="main",
-        )
-    else:
-        repo = git.Repo(config.FUELIGNITION_BUILD_DIR)
-    repo.remotes.origin.update()
-    repo.remotes.origin.pull()
-    # Then, build the docker image using the Dockerfile in the repo
     # * For the container to build, we need to use a patched Dockerfile
     # * The patch manually creates a "fuelignition" usergroup
     # * From reading up, this change to how docker creates usergroups
     # * appears to have been introduced in engine version 9.3.0 and above?
     # * For now, we're applying the patch @>=9.3.0 and can change later if needed
-    engine_version = tuple(
-        map(
-            int,
-            next(
-                filter(lambda x: x.get("Name") == "Engine", config.CLIENT.version()["Components"])
-            )["Version"].split("."),
+    if docker_engine_version() >= (9, 3):
+        return config.DOCKERFILE_DIR / "fuel-ignition.dockerfile"
+    return config.FUELIGNITION_BUILD_DIR / "Dockerfile"
+
+
+def fuelignition_image_tag(revision: str, dockerfile: Path) -> str:
+    """Returns the tag identifying a fuel-ignition image by its source revision and Dockerfile
+
+    Args:
+        revision (str): The fuel-ignition commit SHA
+        dockerfile (Path): The Dockerfile the image is built with
+
+    Returns:
+        str: The image tag
+    """
+    dockerfile_hash = sha256(dockerfile.read_bytes()).hexdigest()
+    return f"{FUELIGNITION_IMAGE}:{revision[:12]}-{dockerfile_hash[:12]}"
+
+
+def remove_stale_fuelignition_images(current_tag: str) -> None:
+    """Removes fuel-ignition images built from older revisions or Dockerfiles
+
+    Args:
+        current_tag (str): The tag of the current fuel-ignition image
+    """
+    for image in config.CLIENT.images.list(name=FUELIGNITION_IMAGE):
+        if current_tag in image.tags:
+            continue
+        try:
+            image.remove(force=True)
+        except docker.errors.APIError:  # type: ignore
+            pass  # Most likely still in use by a running pool, so leave it for next time
+
+
+def build_image(
+    update: progress.Update, tag: str, **kwargs
+) -> docker.models.images.Image:  # type: ignore
+    """Builds a docker image, reporting how many of its build steps are complete
+
+    Args:
+        update (progress.Update): Called with the steps completed and the total steps
+        tag (str): The tag to give the image
+        **kwargs: Additional keyword arguments for the docker build API
+
+    Raises:
+        docker.errors.BuildError: If the build fails
+
+    Returns:
+        docker.models.images.Image: The built image
+    """
+    for chunk in config.CLIENT.api.build(tag=tag, decode=True, **kwargs):
+        if "error" in chunk:
+            raise docker.errors.BuildError(chunk["error"], [chunk])  # type: ignore
+        step = BUILD_STEP.match(chunk.get("stream", ""))
+        if step is not None:
+            # Steps are logged as they start, so only the steps before this one are done
+            update(int(step[1]) - 1, int(step[2]))
+    return config.CLIENT.images.get(tag)
+
+
+def build_fuelignition() -> docker.models.images.Image:  # type: ignore
+    """Builds the fuel-ignition docker image, reusing a previous build where possible
+
+    Returns:
+        docker.models.images.Image: The built docker image
+    """
+    # Make sure the local fuel-ignition checkout is at the configured revision
+    with progress.task("Updating fuel-ignition source"):
+        revision = update_source()
+    # Then, reuse the image built from this revision and Dockerfile if we already have one
+    with progress.task("Building fuel-ignition image", unit="steps") as update:
+        dockerfile = fuelignition_dockerfile()
+        tag = fuelignition_image_tag(revision, dockerfile)
+        try:
+            return config.CLIENT.images.get(tag)
+        except docker.errors.ImageNotFound:  # type: ignore
+            pass
+        image = build_image(
+            update,
+            path=str(config.FUELIGNITION_BUILD_DIR),
+            dockerfile=str(dockerfile),
+            tag=tag,
+            network_mode="host",
+            buildargs={"CONTAINER_USERID": "1000"},
+            pull=True,
+            rm=config.CLEANUP_IMAGES,
         )
-    )
-    root_container = (engine_version[0] > 9) or (engine_version[0] == 9 and engine_version[1] >= 3)
-    dockerfile = "Dockerfile"
-    if root_container:
-        dockerfile = config.DOCKERFILE_DIR / "fuel-ignition.dockerfile"
-    image, _ = config.CLIENT.images.build(
-        path=str(config.FUELIGNITION_BUILD_DIR),
-        dockerfile=str(dockerfile),
-        tag="fuel-ignition",
-        network_mode="host",
-        buildargs={"CONTAINER_USERID": "1000"},
-        pull=True,
-        quiet=True,
-        rm=config.CLEANUP_IMAGES,
-    )
-    return image
+        remove_stale_fuelignition_images(tag)
+        return image
+
+
+def run_selenium(
+    driver_port: int,
+    environment: Optional[Dict[str, str]] = None,
+) -> docker.models.containers.Container:  # type: ignore
+    """Starts a selenium container and waits for it to be ready
+
+    Args:
+        driver_port (int): The host port to expose the webdriver on
+        environment (Optional[Dict[str, str]], optional):
+            Additional environment variables for the container.
+            Defaults to None.
+
+    Returns:
+        docker.models.containers.Container: The running selenium container
+    """
+    with progress.task("Starting selenium"):
+        selenium_container = config.CLIENT.containers.run(
+            "selenium/standalone-firefox:latest",
+            detach=True,
+            remove=True,
+            network_mode="bridge",
+            ports={4444: driver_port},
+            mounts=[
+                config.CWD_MOUNT,
+            ],
+            environment=environment,
+        )
+        try:
+            wait_for_log(
+                selenium_container,
+                lambda line: config.SELENIUM_INIT_MESSAGE in line,
+                config.SELENIUM_READY_TIMEOUT,
+            )
+        except (RuntimeError, TimeoutError):
+            # The caller never gets hold of the container, so we have to clean it up here
+            selenium_container.kill()
+            raise
+    return selenium_container
+
+
+def run_fuelignition(
+    selenium_container: docker.models.containers.Container,  # type: ignore
+) -> Tuple[docker.models.containers.Container, docker.models.images.Image]:  # type: ignore
+    """Builds and starts a fuel-ignition container sharing the selenium container's network
+
+    Args:
+        selenium_container (docker.models.containers.Container): The selenium container
+
+    Returns:
+        Tuple[docker.models.containers.Container, docker.models.images.Image]:
+            The running fuel-ignition container and the image it was started from
+    """
+    fuelignition_image = build_fuelignition()
+    with progress.task("Starting fuel-ignition"):
+        fuelignition_container = config.CLIENT.containers.run(
+            fuelignition_image,
+            detach=True,
+            remove=True,
+            network_mode=f"container:{selenium_container.id}",
+        )
+        # Wait for the container to finish starting up
+        try:
+            wait_for_log(
+                fuelignition_container,
+                lambda line: fnmatch(line.strip(), config.FUELIGNITION_INIT_MESSAGE),
+                config.FUELIGNITION_READY_TIMEOUT,
+            )
+        except (RuntimeError, TimeoutError):
+            fuelignition_container.kill()
+            raise
+    return fuelignition_container, fuelignition_image
+
+
+def stop_containers(
+    selenium_container: Optional[docker.models.containers.Container],  # type: ignore
+    fuelignition_container: Optional[docker.models.containers.Container],  # type: ignore
+    fuelignition_image: Optional[docker.models.images.Image],  # type: ignore
+) -> None:
+    """Stops the conversion containers and, if configured, removes their images
+
+    Args:
+        selenium_container (Optional[docker.models.containers.Container]):
+            The selenium container, if started
+        fuelignition_container (Optional[docker.models.containers.Container]):
+            The fuel-ignition container, if started
+        fuelignition_image (Optional[docker.models.images.Image]):
+            The fuel-ignition image, if built
+    """
+    if selenium_container is not None:
+        selenium_image = selenium_container.image
+        selenium_container.kill()
+        if config.CLEANUP_IMAGES:
+            selenium_image.remove(force=True)
+    if fuelignition_container is not None:
+        fuelignition_container.kill()
+    if fuelignition_image is not None:
+        # Keeping the image lets later runs skip the build if fuel-ignition has not changed
+        if config.CLEANUP_IMAGES and not config.KEEP_FUELIGNITION_IMAGE:
+            fuelignition_image.remove(force=True)
+
+
+def selenium_environment(sessions: int) -> Dict[str, str]:
+    """Returns the selenium container environment allowing the given number of browser sessions
+
+    Args:
+        sessions (int): The number of concurrent browser sessions to allow
+
+    Returns:
+        Dict[str, str]: The environment variables for the selenium container
+    """
+    return {
+        "SE_NODE_MAX_SESSIONS": str(sessions),
+        "SE_NODE_OVERRIDE_MAX_SESSIONS": "true",
+    }
+
+
+@contextmanager
+def conversion_sessions(count: int = 1) -> Iterator[
+    Tuple[docker.models.containers.Container, List[Tuple[webdriver.Remote, str]]]  # type: ignore
+]:
+    """Provides a selenium container with browser sessions ready to convert fuel-ignition json
+
+    If a warm pool is running and not in use by another invocation, its containers are used.
+    Otherwise, containers are started for the duration of the session and stopped when it ends.
+
+    Args:
+        count (int, optional): The number of concurrent browser sessions to provide.
+            Capped at MAX_CONVERSION_SESSIONS (or the warm pool's session limit).
+            Defaults to 1.
+
+    Yields:
+        Iterator[Tuple[docker.models.containers.Container, List[Tuple[webdriver.Remote, str]]]]:
+            The selenium container and a webdriver and download directory per session
+    """
+    from . import pool
+
+    count = max(1, min(count, config.MAX_CONVERSION_SESSIONS))
+    with pool.attach() as attached:
+        if attached is not None:
+            # A warm pool is running, so we can skip container startup entirely. Its lease is
+            # held until we're done, so no one else uses its session or download directories
+            selenium_container, driver, state = attached
+            count = min(count, state.get("max_sessions", 1))
+            extra_drivers = [
+                (create_driver(state["driver_port"], download_dir(i)), download_dir(i))
+                for i in range(1, count)
+            ]
+            try:
+                yield selenium_container, [(driver, download_dir(0)), *extra_drivers]
+            finally:
+                for extra_driver, _ in extra_drivers:
+                    extra_driver.quit()
+            return
+    selenium_container = None
+    fuelignition_container = None
+    fuelignition_image = None
+    drivers: List[Tuple[webdriver.Remote, str]] = []
+    driver_port: Optional[int] = None
+    try:
+        driver_port = next_free_tcp_port(4444)
+        # Initialise containers
+        selenium_container = run_selenium(driver_port, selenium_environment(count))
+        fuelignition_container, fuelignition_image = run_fuelignition(selenium_container)
+        # Now, create the webdrivers for the caller to convert with
+        for i in range(count):
+            drivers.append((create_driver(driver_port, download_dir(i)), download_dir(i)))
+        yield selenium_container, drivers
+    finally:
+        for driver, _ in drivers:
+            driver.quit()
+        stop_containers(selenium_container, fuelignition_container, fuelignition_image)
+        if driver_port is not None:
+            release_tcp_port(driver_port)
+
+
+@contextmanager
+def conversion_session() -> Iterator[
+    Tuple[docker.models.containers.Container, webdriver.Remote]  # type: ignore
+]:
+    """Provides a selenium container and webdriver ready to convert fuel-ignition json files
+
+    Yields:
+        Iterator[Tuple[docker.models.containers.Container, webdriver.Remote]]:
+            The selenium container and a webdriver connected to it
+    """
+    with conversion_sessions(1) as (selenium_container, drivers):
+        yield selenium_container, drivers[0][0]
+
+
+def convert_json(
+    json_path: Path,
+    img_path: Path,
+    session: Optional[
+        Tuple[docker.models.containers.Container, webdriver.Remote, str]  # type: ignore
+    ] = None,
+) -> None:
+    """Converts a fuel-ignition json file to an ignition disk image file with the configured
+    conversion engine, reusing a cached image of the same configuration if there is one
+
+    Args:
+        json_path (Path): The path to the fuel-ignition json file
+        img_path (Path): The path to the output ignition disk image file
+        session (Optional[Tuple[docker.models.containers.Container, webdriver.Remote, str]],
+            optional): The selenium container, webdriver and download directory of a browser
+            session to convert with. Defaults to starting a session for the conversion.
+    """
+    from . import cache
+
+    # Identical configurations always produce identical images, so check the cache first
+    with progress.task("Checking image cache") as update:
+        key = cache.key_for(json_path)
+        if key is not None and cache.fetch(key, config.PROJECT_ROOT / img_path):
+            update(file_size(img_path))
+            return
+    # The fuel-ignition engine hashes the image as it streams it out of the container, so
+    # the cache doesn't need to read it again
+    digest: Optional[str] = None
+    if config.CONVERSION_ENGINE == "native":
+        from . import native
+
+        with progress.task("Converting natively") as update:
+            native.json_to_img(json_path, img_path)
+            update(file_size(img_path))
+    elif session is not None:
+        selenium_container, driver, downloads = session
+        digest = convert_json_via_fuelignition(
+            selenium_container, driver, json_path, img_path, downloads
+        )
+    else:
+        with conversion_session() as (selenium_container, driver):
+            digest = convert_json_via_fuelignition(selenium_container, driver, json_path, img_path)
+    if key is not None:
+        with progress.task("Caching image"):
+            cache.store(key, config.PROJECT_ROOT / img_path, digest)
 
 
 @debug_guard
+@timed_command
 @cli_spinner(description="Converting json to img", total=None)
 @ensure_build_dir
 def json_to_img(
@@ -168,6 +590,21 @@ def json_to_img(
             readable=False,
         ),
     ] = Path("ignition.img"),
+    timings: Annotated[
+        bool,
+        typer.Option(
+            "--timings",
+            help="Print how long each stage took once finished",
+        ),
+    ] = False,
+    timings_json: Annotated[
+        Optional[Path],
+        typer.Option(
+            "--timings-json",
+            help="File to write how long each stage took to, as JSON",
+            dir_okay=False,
+        ),
+    ] = None,
     debug: Annotated[
         bool,
         typer.Option(
@@ -190,61 +627,17 @@ def json_to_img(
         img_path (Annotated[ Path, typer.Option, optional):
             The path to the output ignition disk image file.
             Defaults to Path("ignition.img").
+        timings (Annotated[ bool, typer.Option, optional):
+            Print how long each stage took once finished.
+            Defaults to False.
+        timings_json (Annotated[ Optional[Path], typer.Option, optional):
+            The file to write how long each stage took to, as JSON.
+            Defaults to None.
         debug (Annotated[ bool, typer.Option, optional):
             Enable debug mode.
             Defaults to False.
-
-    Raises:
-        e: Any exception raised during execution
     """
-    selenium_container = None
-    fuelignition_container = None
-    fuelignition_image = None
-    try:
-        driver_port = next_free_tcp_port(4444)
-        # Initialise containers
-        selenium_container = config.CLIENT.containers.run(
-            "selenium/standalone-firefox:latest",
-            detach=True,
-            remove=True,
-            network_mode="bridge",
-            ports={4444: driver_port},
-            mounts=[
-                config.CWD_MOUNT,
-            ],
-        )
-        while config.SELENIUM_INIT_MESSAGE not in selenium_container.logs().decode():
-            time.sleep(0.1)
-        fuelignition_image = build_fuelignition()
-        fuelignition_container = config.CLIENT.containers.run(
-            fuelignition_image,
-            detach=True,
-            remove=True,
-            network_mode=f"container:{selenium_container.id}",
-        )
-        # Wait for the container to finish starting up
-        while not fnmatch(
-            fuelignition_container.logs().decode().strip().split("\n")[-1].strip(),
-            config.FUELIGNITION_INIT_MESSAGE,
-        ):
-            time.sleep(0.1)
-        # Now, create the webdriver and convert the json to an img
-        driver = create_driver(driver_port)
-        convert_json_via_fuelignition(selenium_container, driver, json_path, img_path)
-        driver.quit()
-    except Exception as e:
-        raise e
-    finally:
-        if selenium_container is not None:
-            selenium_image = selenium_container.image
-            selenium_container.kill()
-            if config.CLEANUP_IMAGES:
-                selenium_image.remove(force=True)
-        if fuelignition_container is not None:
-            fuelignition_container.kill()
-        if fuelignition_image is not None:
-            if config.CLEANUP_IMAGES:
-                fuelignition_image.remove(force=True)
+    convert_json(json_path, img_path)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,398 @@
+from concurrent.futures import as_completed, ThreadPoolExecutor
+import csv
+import json
+from pathlib import Path
+from queue import Queue
+import re
+from typing import Annotated, List, Optional, Tuple
+
+from selenium import webdriver
+import tomllib
+import typer
+
+from . import cache, passwords, progress
+from .autoignition import conversion_sessions, convert_json_via_fuelignition
+from .cli import cli_spinner
+from .config import config
+from .create_disk import validation_response, write_disks
+from .create_img import apply_ignition_settings, load_template, swarm_configuration
+from .debug import debug_guard
+from .ip_interface import IPAddress
+from .utils import ensure_build_dir
+
+
+NODE_FIELDS: Tuple[str, ...] = (
+    "hostname",
+    "password",
+    "switch_ip",
+    "switch_port",
+    "swarm_token",
+    "disk",
+)
+# A hostname is a single RFC 1123 label. Hostnames name the files built for their nodes, so
+# anything else (e.g. a path) is refused
+HOSTNAME_PATTERN: re.Pattern = re.compile(r"(?!-)[A-Za-z0-9-]{1,63}(?<!-)")
+
+
+def load_inventory(inventory: Path) -> List[dict]:
+    """Loads a node inventory from a TOML, CSV or JSONL file
+
+    TOML inventories list nodes in a "nodes" array of tables, CSV inventories have a
+    header row naming the fields and JSONL inventories have one json object per line.
+
+    Args:
+        inventory (Path): The inventory file to load
+
+    Raises:
+        ValueError: If the inventory format is not supported
+
+    Returns:
+        List[dict]: The nodes in the inventory
+    """
+    match inventory.suffix.lower():
+        case ".toml":
+            with open(inventory, "rb") as f:
+                return tomllib.load(f).get("nodes", [])
+        case ".csv":
+            with open(inventory, "r", newline="") as f:
+                # Empty CSV cells are treated as missing so they fall back to the defaults
+                return [{k: v for k, v in row.items() if v} for row in csv.DictReader(f)]
+        case ".jsonl":
+            with open(inventory, "r") as f:
+                return [json.loads(line) for line in f if line.strip()]
+        case _:
+            raise ValueError(f"Unsupported inventory format: {inventory.suffix}")
+
+
+def resolve_nodes(nodes: List[dict], defaults: dict) -> List[dict]:
+    """Fills in missing node fields from the defaults and validates the result
+
+    Args:
+        nodes (List[dict]): The nodes from the inventory
+        defaults (dict): The default values of fields missing from a node
+
+    Raises:
+        ValueError: If a node has unknown fields, no hostname, an invalid hostname, or a
+            duplicate hostname or disk
+
+    Returns:
+        List[dict]: The resolved nodes
+    """
+    resolved = []
+    hostnames = set()
+    disks = set()
+    for i, node in enumerate(nodes):
+        unknown = set(node) - set(NODE_FIELDS)
+        if unknown:
+            raise ValueError(f"Node {i} has unknown fields: {', '.join(sorted(unknown))}")
+        node = {**defaults, **node}
+        if not node.get("hostname"):
+            raise ValueError(f"Node {i} has no hostname")
+        if not isinstance(node["hostname"], str) or not HOSTNAME_PATTERN.fullmatch(
+            node["hostname"]
+        ):
+            raise ValueError(f"Node {i} has an invalid hostname: {node['hostname']!r}")
+        if node["hostname"] in hostnames:
+            raise ValueError(f"Hostname {node['hostname']} appears more than once")
+        hostnames.add(node["hostname"])
+        if node.get("disk"):
+            if node["disk"] in disks:
+                raise ValueError(f"Disk {node['disk']} is assigned to more than one node")
+            disks.add(node["disk"])
+        if node.get("password") is None:
+            if not config.TESTING:
+                raise ValueError(f"No password specified for {node['hostname']}")
+            node["password"] = ""
+        node["switch_ip"] = IPAddress(str(node["switch_ip"])) if node.get("switch_ip") else None
+        node["switch_port"] = int(node.get("switch_port") or 4789)
+        resolved.append(node)
+    return resolved
+
+
+def hash_node_passwords(nodes: List[dict]) -> List[Optional[str]]:
+    """Hashes the passwords of every node at once on the host, if the conversion engine
+    accepts hashed passwords
+
+    Args:
+        nodes (List[dict]): The resolved nodes
+
+    Returns:
+        List[Optional[str]]: The hash of each node's password, or None where it should be
+            left to fuel-ignition
+    """
+    if config.CONVERSION_ENGINE != "native":
+        return [None] * len(nodes)
+    to_hash = [node["password"] for node in nodes if node["password"]]
+    with progress.task("Hashing passwords", total=len(to_hash), unit="passwords") as update:
+        hashed = iter(passwords.hash_passwords(to_hash))
+        update(len(to_hash))
+    return [next(hashed) if node["password"] else None for node in nodes]
+
+
+def render_node(node: dict, password_hash: Optional[str] = None) -> dict:
+    """Renders the fuel-ignition configuration for a resolved node
+
+    Args:
+        node (dict): The node to render the configuration for
+        password_hash (Optional[str], optional): The node's password already hashed.
+            Defaults to None.
+
+    Returns:
+        dict: The fuel-ignition configuration
+    """
+    return apply_ignition_settings(
+        load_template(),
+        node["hostname"],
+        node["password"],
+        swarm_configuration(node["switch_ip"], node["switch_port"], node.get("swarm_token")),
+        password_hash,
+    )
+
+
+def store(key: Optional[str], img_path: Path, digest: Optional[str] = None) -> None:
+    """Stores a converted image in the cache, if caching is enabled
+
+    Args:
+        key (Optional[str]): The cache key of the image, or None if caching is disabled
+        img_path (Path): The path of the converted image
+        digest (Optional[str], optional): The sha256 digest of the image, if already known.
+            Defaults to None.
+    """
+    if key is not None:
+        cache.store(key, config.PROJECT_ROOT / img_path, digest)
+
+
+def convert_batch(conversions: List[Tuple[Path, Path]], sessions: int = 1) -> None:
+    """Converts fuel-ignition json files to disk images, sharing a single selenium container
+
+    Args:
+        conversions (List[Tuple[Path, Path]]):
+            Pairs of fuel-ignition json and output image paths
+        sessions (int, optional): The number of browser sessions to convert with concurrently.
+            Defaults to 1.
+    """
+    # Only configurations that have not been converted before need a browser session
+    revision = cache.engine_revision() if config.CACHE_IMAGES else None
+    keys = {json_path: cache.key_for(json_path, revision) for json_path, _ in conversions}
+    conversions = [
+        (json_path, img_path)
+        for json_path, img_path in conversions
+        if keys[json_path] is None
+        or not cache.fetch(keys[json_path], config.PROJECT_ROOT / img_path)  # type: ignore
+    ]
+    if config.CONVERSION_ENGINE == "native":
+        from . import native
+
+        for json_path, img_path in conversions:
+            # Each node's json is named after its hostname, which names its job
+            with progress.job(json_path.stem):
+                native.json_to_img(json_path, img_path)
+                store(keys[json_path], img_path)
+        return
+    if not conversions:
+        return
+    with conversion_sessions(min(sessions, len(conversions))) as (selenium_container, drivers):
+        # Each worker checks a browser session out of the queue for the duration of a job
+        free_sessions: Queue[Tuple[webdriver.Remote, str]] = Queue()
+        for session in drivers:
+            free_sessions.put(session)
+
+        def convert(json_path: Path, img_path: Path) -> None:
+            driver, downloads = free_sessions.get()
+            try:
+                with progress.job(json_path.stem):
+                    digest = convert_json_via_fuelignition(
+                        selenium_container, driver, json_path, img_path, downloads
+                    )
+                    store(keys[json_path], img_path, digest)
+            finally:
+                free_sessions.put((driver, downloads))
+
+        with ThreadPoolExecutor(max_workers=len(drivers)) as executor:
+            futures = [executor.submit(convert, *c) for c in conversions]
+            for future in as_completed(futures):
+                future.result()
+
+
+@cli_spinner(description="Writing ignition images to disks", total=None)
+def write_node_disks(targets: List[Tuple[str, Path]]) -> List[str]:
+    """Validates each node's ignition image and writes it to the node's disk, all at once
+
+    Args:
+        targets (List[Tuple[str, Path]]): Pairs of disk and ignition image paths
+
+    Returns:
+        List[str]: The disks that failed to validate or write
+    """
+
+    def write(disk: str, img_path: Path) -> Optional[Exception]:
+        response = validation_response(img_path)
+        if response:
+            return ValueError(f"Invalid ignition image {img_path}:\n{response}")
+        return write_disks([disk], img_path)[disk]
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+        futures = {executor.submit(write, disk, img): disk for disk, img in targets}
+        for future in as_completed(futures):
+            disk, error = futures[future], future.result()
+            if error is None:
+                typer.echo(f"Wrote ignition image to {disk}")
+            else:
+                typer.echo(f"Failed to write ignition image to {disk}: {error}")
+                failed.append(disk)
+    return failed
+
+
+@debug_guard
+@cli_spinner(description="Creating ignition images for inventory", total=None)
+@ensure_build_dir
+def create_batch(
+    inventory: Annotated[
+        Path,
+        typer.Option(
+            "--inventory",
+            "-i",
+            help="Inventory of nodes to create images for (.toml, .csv or .jsonl)",
+            prompt=True,
+            exists=True,
+            dir_okay=False,
+        ),
+    ] = Path("inventory.toml"),
+    output_dir: Annotated[
+        Path,
+        typer.Option(
+            "--output-dir",
+            "-o",
+            help="Directory to which the ignition images should be written",
+            file_okay=False,
+        ),
+    ] = Path("images"),
+    password: Annotated[
+        Optional[str],
+        typer.Option(
+            "--password",
+            "-p",
+            help="Password for nodes that do not specify one",
+            hide_input=True,
+        ),
+    ] = None,
+    switch_ip: Annotated[
+        Optional[IPAddress],
+        typer.Option(
+            "--switch-ip",
+            "-ip",
+            help="Switch IP address for nodes that do not specify one",
+            parser=IPAddress,
+        ),
+    ] = None,
+    switch_port: Annotated[
+        int,
+        typer.Option(
+            "--switch-port",
+            "-sp",
+            help="Switch port for nodes that do not specify one",
+            min=1,
+            max=config.MAX_PORT,
+        ),
+    ] = 4789,
+    swarm_token: Annotated[
+        Optional[str],
+        typer.Option(
+            "--swarm-token",
+            "-t",
+            help="Swarm token for nodes that do not specify one",
+        ),
+    ] = None,
+    jobs: Annotated[
+        int,
+        typer.Option(
+            "--jobs",
+            "-j",
+            help="Number of browser sessions to convert with concurrently",
+            min=1,
+            max=config.MAX_CONVERSION_SESSIONS,
+        ),
+    ] = 1,
+    debug: Annotated[
+        bool,
+        typer.Option(
+            "--debug",
+            help="Enable debug mode",
+            is_eager=True,
+            is_flag=True,
+            flag_value=True,
+            hidden=not config.DEBUG,
+        ),
+    ] = False,
+) -> None:
+    """Creates ignition images for every node in an inventory in a single conversion session
+
+    Nodes with a disk in the inventory have their image written to that disk, with every
+    disk written at once.
+
+    Args:
+        inventory (Annotated[ Path, typer.Option, optional):
+            The inventory of nodes to create images for.
+            Defaults to Path("inventory.toml").
+        output_dir (Annotated[ Path, typer.Option, optional):
+            The directory to which the ignition images should be written.
+            Defaults to Path("images").
+        password (Annotated[ str, typer.Option, optional):
+            The password for nodes that do not specify one.
+            Defaults to None.
+        switch_ip (Annotated[ IPAddress, typer.Option, optional):
+            The switch IP address for nodes that do not specify one.
+            Defaults to None.
+        switch_port (Annotated[ int, typer.Option, optional):
+            The switch port for nodes that do not specify one.
+            Defaults to 4789.
+        swarm_token (Annotated[ str, typer.Option, optional):
+            The swarm token for nodes that do not specify one.
+            Defaults to None.
+        jobs (Annotated[ int, typer.Option, optional):
+            The number of browser sessions to convert with concurrently.
+            Defaults to 1.
+        debug (Annotated[ bool, typer.Option, optional):
+            Enable debug mode.
+            Defaults to False.
+
+    Raises:
+        typer.BadParameter: If the inventory is invalid
+        typer.Exit: Exit CLI if any node's disk failed to write
+    """
+    defaults = {
+        "password": password,
+        "switch_ip": switch_ip,
+        "switch_port": switch_port,
+        "swarm_token": swarm_token,
+    }
+    try:
+        nodes = resolve_nodes(load_inventory(inventory), defaults)
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+
+    # Render every node's configuration up front, then convert them all in one session
+    json_dir = config.BUILD_DIR / "batch"
+    json_dir.mkdir(exist_ok=True, parents=True)
+    (config.PROJECT_ROOT / output_dir).mkdir(exist_ok=True, parents=True)
+    conversions = []
+    for node, password_hash in zip(nodes, hash_node_passwords(nodes)):
+        json_path = json_dir / f"{node['hostname']}.json"
+        with open(json_path, "w") as f:
+            json.dump(render_node(node, password_hash), f, indent=4)
+        conversions.append((json_path, output_dir / f"{node['hostname']}.img"))
+    convert_batch(conversions, sessions=jobs)
+
+    targets = [
+        (node["disk"], config.PROJECT_ROOT / output_dir / f"{node['hostname']}.img")
+        for node in nodes
+        if node.get("disk")
+    ]
+    if targets and write_node_disks(targets):
+        raise typer.Exit(1)
+
+
+if __name__ == "__main__":
+    config.update_config("cli")
+    typer.run(create_batch)
@@ -0,0 +1,229 @@
+import os
+from pathlib import Path
+from threading import Event, Lock, Thread
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from .config import config
+
+
+SYS_BLOCK: Path = Path("/sys/block")
+MOUNTS: Path = Path("/proc/self/mounts")
+# The kernel reports the sizes of block devices in 512 byte sectors, whatever their block size
+SECTOR_SIZE: int = 512
+# Writing over a disk with any of these mounted would break the machine we're running on
+SYSTEM_MOUNTPOINTS: Set[str] = {"/", "/boot", "/boot/efi", "/usr", "/var", "/home", "[SWAP]"}
+
+
+class BlockDevice(NamedTuple):
+    """A whole disk, as described by sysfs"""
+
+    name: str
+    size: int  # In bytes
+    removable: bool
+    model: str
+    mountpoints: Tuple[str, ...] = ()
+
+    @property
+    def path(self) -> str:
+        """The device file of the disk"""
+        return f"/dev/{self.name}"
+
+    @property
+    def system(self) -> bool:
+        """Whether the disk holds a filesystem the running system depends on"""
+        return any(mountpoint in SYSTEM_MOUNTPOINTS for mountpoint in self.mountpoints)
+
+    @property
+    def label(self) -> str:
+        """A description of the disk for choosing it from a list"""
+        details = [f"{self.size / 10**9:.1f} GB"]
+        if self.model:
+            details.append(self.model)
+        if self.removable:
+            details.append("removable")
+        if self.mountpoints:
+            details.append(f"mounted at {', '.join(self.mountpoints)}")
+        return f"{self.path} ({', '.join(details)})"
+
+
+type Snapshot = Tuple[Tuple[Tuple[str, str], ...], str]
+
+
+def read_attribute(path: Path) -> str:
+    """Reads an attribute from sysfs
+
+    Args:
+        path (Path): The attribute's file
+
+    Returns:
+        str: The attribute, or an empty string if the device doesn't have it
+    """
+    try:
+        return path.read_text().strip()
+    except OSError:
+        return ""
+
+
+def snapshot(sys_block: Path = SYS_BLOCK, mounts: Path = MOUNTS) -> Snapshot:
+    """Takes a cheap snapshot of the block devices, which changes whenever a disk appears,
+    disappears, changes size (e.g. a card is put in a reader) or is mounted or unmounted
+
+    Args:
+        sys_block (Path, optional): The sysfs directory of block devices.
+            Defaults to SYS_BLOCK.
+        mounts (Path, optional): The mount table. Defaults to MOUNTS.
+
+    Returns:
+        Snapshot: The name and size of each device, and the mount table
+    """
+    try:
+        names = sorted(os.listdir(sys_block))
+    except FileNotFoundError:
+        names = []
+    sizes = tuple((name, read_attribute(sys_block / name / "size")) for name in names)
+    return sizes, read_attribute(mounts)
+
+
+def mounted_devices(mount_table: str, sys_block: Path = SYS_BLOCK) -> Dict[str, List[str]]:
+    """Finds the mountpoints of each block device, including those of the devices stacked on
+    top of it (e.g. LVM or LUKS volumes on one of its partitions)
+
+    Args:
+        mount_table (str): The contents of the mount table
+        sys_block (Path, optional): The sysfs directory of block devices.
+            Defaults to SYS_BLOCK.
+
+    Returns:
+        Dict[str, List[str]]: The mountpoints by device (or partition) name
+    """
+    mountpoints: Dict[str, List[str]] = {}
+    for line in mount_table.splitlines():
+        fields = line.split()
+        if len(fields) < 2 or not fields[0].startswith("/dev/"):
+            continue
+        # Mounts may name devices by a link, such as /dev/mapper/root or /dev/disk/by-uuid/...
+        name = Path(os.path.realpath(fields[0])).name
+        # The mount table escapes spaces in paths as octal
+        mountpoint = fields[1].replace("\\040", " ")
+        # Follow mapped devices down to the partitions they are built on
+        pending = [name]
+        while pending:
+            device = pending.pop()
+            mountpoints.setdefault(device, []).append(mountpoint)
+            slaves = sys_block / device / "slaves"
+            if slaves.is_dir():
+                pending.extend(os.listdir(slaves))
+    return mountpoints
+
+
+def read_devices(sys_block: Path = SYS_BLOCK, mounts: Path = MOUNTS) -> List[BlockDevice]:
+    """Reads the whole disks that could be written to from sysfs
+
+    Virtual devices (loop, ram, zram and device mapper devices), read only devices (e.g.
+    optical drives) and empty devices (e.g. card readers without a card) are left out.
+
+    Args:
+        sys_block (Path, optional): The sysfs directory of block devices.
+            Defaults to SYS_BLOCK.
+        mounts (Path, optional): The mount table. Defaults to MOUNTS.
+
+    Returns:
+        List[BlockDevice]: The disks, sorted by name
+    """
+    devices = []
+    mountpoints = mounted_devices(read_attribute(mounts), sys_block)
+    for name, size in snapshot(sys_block, mounts)[0]:
+        directory = sys_block / name
+        # Only devices backed by hardware have a device link
+        if not (directory / "device").exists():
+            continue
+        if read_attribute(directory / "ro") == "1" or not size.isdigit() or int(size) == 0:
+            continue
+        partitions = [p.name for p in directory.iterdir() if (p / "partition").exists()]
+        vendor = read_attribute(directory / "device" / "vendor")
+        # SD and MMC cards call their model their name
+        model = read_attribute(directory / "device" / "model") or read_attribute(
+            directory / "device" / "name"
+        )
+        devices.append(
+            BlockDevice(
+                name=name,
+                size=int(size) * SECTOR_SIZE,
+                removable=read_attribute(directory / "removable") == "1",
+                model=" ".join(filter(None, (vendor, model))),
+                mountpoints=tuple(
+                    sorted(
+                        {
+                            mountpoint
+                            for device in (name, *partitions)
+                            for mountpoint in mountpoints.get(device, [])
+                        }
+                    )
+                ),
+            )
+        )
+    return devices
+
+
+cache_lock = Lock()
+# The last snapshot taken, and the devices read for it
+cached: Dict[str, Any] = {"snapshot": None, "devices": []}
+
+
+def block_devices(include_system: bool = False) -> List[BlockDevice]:
+    """Lists the whole disks that could be written to, only rereading their details from
+    sysfs when the disks have changed since they were last listed
+
+    Args:
+        include_system (bool, optional): Whether to include the disks holding the running
+            system. Defaults to False.
+
+    Returns:
+        List[BlockDevice]: The disks, sorted by name
+    """
+    current = snapshot(SYS_BLOCK, MOUNTS)
+    with cache_lock:
+        if cached["snapshot"] != current:
+            cached["devices"] = read_devices(SYS_BLOCK, MOUNTS)
+            cached["snapshot"] = current
+        devices: List[BlockDevice] = cached["devices"]
+    return [device for device in devices if include_system or not device.system]
+
+
+def watch(
+    callback: Callable[[List[BlockDevice]], None],
+    interval: Optional[float] = None,
+    include_system: bool = False,
+) -> Callable[[], None]:
+    """Calls a function with the disks that could be written to whenever they change
+
+    Rather than depend on udev for hotplug events, the watcher polls the snapshot of the
+    block devices, which is just a directory listing and a few small reads.
+
+    Args:
+        callback (Callable[[List[BlockDevice]], None]): The function to call with the disks,
+            from the watcher's thread
+        interval (Optional[float], optional): How often to check for changes in seconds.
+            Defaults to DEVICE_POLL_INTERVAL.
+        include_system (bool, optional): Whether to include the disks holding the running
+            system. Defaults to False.
+
+    Returns:
+        Callable[[], None]: A function that stops the watcher
+    """
+    interval = config.DEVICE_POLL_INTERVAL if interval is None else interval
+    stop = Event()
+
+    def poll() -> None:
+        last = block_devices(include_system)
+        while not stop.wait(interval):
+            devices = block_devices(include_system)
+            if devices != last:
+                last = devices
+                try:
+                    callback(devices)
+                except Exception:
+                    pass  # A broken display shouldn't stop the watcher
+
+    Thread(target=poll, daemon=True, name="block-device-watcher").start()
+    return stop.set
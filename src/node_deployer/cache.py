@@ -0,0 +1,292 @@
+from hashlib import sha256
+import json
+import os
+from pathlib import Path
+import shutil
+import time
+from typing import Annotated, List, NamedTuple, Optional, Tuple
+
+import git
+import typer
+
+from .config import config
+from .fuelignition_source import update_source
+
+
+CHUNK_SIZE: int = 2**20
+
+# The modules whose source determines the native engine's output
+NATIVE_ENGINE_MODULES: Tuple[str, ...] = (
+    "fat.py",
+    "native.py",
+    "passwords.py",
+    "templates.py",
+    "translator.py",
+)
+
+
+class CacheEntry(NamedTuple):
+    key: str
+    path: Path
+    size: int
+    last_used: float
+
+
+app = typer.Typer(
+    help="Manage the cache of generated ignition images",
+    **config.typer,
+)
+
+
+def cache_dir() -> Path:
+    """Returns the directory in which cached images are stored
+
+    Returns:
+        Path: The cache directory
+    """
+    return config.BUILD_DIR / config.CACHE_DIR
+
+
+def canonical_json(fuelignition: dict) -> bytes:
+    """Serialises a fuel-ignition configuration so that equivalent configurations are identical
+
+    Args:
+        fuelignition (dict): The fuel-ignition configuration
+
+    Returns:
+        bytes: The canonical serialisation of the configuration
+    """
+    return json.dumps(fuelignition, sort_keys=True, separators=(",", ":")).encode()
+
+
+def engine_revision() -> str:
+    """Returns an identifier for the revision of the engine that converts configurations
+
+    For the fuel-ignition engine, the source is brought up to date first, so the revision
+    is the one the image will be built from.
+
+    Returns:
+        str: The engine revision
+    """
+    if config.CONVERSION_ENGINE == "native":
+        # The native engine's output only changes when its source, the templates it falls
+        # back on or the way it hashes passwords does
+        digest = sha256()
+        for module in NATIVE_ENGINE_MODULES:
+            digest.update((Path(__file__).parent / module).read_bytes())
+        for template in sorted((config.SRC_DIR / "templates").iterdir()):
+            digest.update(template.read_bytes())
+        digest.update(f"{config.PASSWORD_HASH_COST}:{config.PASSWORD_SALT_POLICY}".encode())
+        return f"native-{digest.hexdigest()}"
+    try:
+        return f"fuelignition-{update_source()}"
+    except (git.exc.GitError, RuntimeError, ValueError):
+        return "fuelignition-unknown"
+
+
+def cache_key(fuelignition: dict, revision: str) -> str:
+    """Computes the cache key of the image generated from a fuel-ignition configuration
+
+    Args:
+        fuelignition (dict): The fuel-ignition configuration
+        revision (str): The revision of the engine converting the configuration
+
+    Returns:
+        str: The cache key
+    """
+    return sha256(canonical_json(fuelignition) + b"\0" + revision.encode()).hexdigest()
+
+
+def key_for(json_path: Path, revision: Optional[str] = None) -> Optional[str]:
+    """Computes the cache key for a fuel-ignition json file, if caching is enabled
+
+    Args:
+        json_path (Path): The path to the fuel-ignition json file
+        revision (Optional[str], optional): The revision of the engine converting the
+            configuration. Defaults to the current engine_revision().
+
+    Returns:
+        Optional[str]: The cache key, or None if caching is disabled
+    """
+    if not config.CACHE_IMAGES:
+        return None
+    with open(json_path, "r") as f:
+        fuelignition = json.load(f)
+    return cache_key(fuelignition, engine_revision() if revision is None else revision)
+
+
+def file_digest(path: Path) -> str:
+    """Computes the sha256 digest of a file
+
+    Args:
+        path (Path): The file
+
+    Returns:
+        str: The digest
+    """
+    digest = sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def evict(cached: Path) -> None:
+    """Removes an image and its digest from the cache
+
+    Args:
+        cached (Path): The cached image
+    """
+    cached.unlink(missing_ok=True)
+    cached.with_suffix(".sha256").unlink(missing_ok=True)
+
+
+def fetch(key: str, img_path: Path) -> bool:
+    """Copies a cached image to the specified path, if it is in the cache and intact
+
+    Args:
+        key (str): The cache key of the image
+        img_path (Path): The path to copy the image to
+
+    Returns:
+        bool: Whether an intact image was found in the cache
+    """
+    cached = cache_dir() / f"{key}.img"
+    try:
+        expected = cached.with_suffix(".sha256").read_text().strip()
+        partial = img_path.with_name(f".{img_path.name}.part")
+        digest = sha256()
+        with open(cached, "rb") as source, open(partial, "wb") as dest:
+            while chunk := source.read(CHUNK_SIZE):
+                digest.update(chunk)
+                dest.write(chunk)
+    except FileNotFoundError:
+        return False
+    if digest.hexdigest() != expected:
+        # A corrupt image is evicted, so that it is converted and cached again
+        partial.unlink(missing_ok=True)
+        evict(cached)
+        return False
+    partial.replace(img_path)
+    # The modification time doubles as the last use time for LRU eviction
+    os.utime(cached)
+    return True
+
+
+def store(key: str, img_path: Path, digest: Optional[str] = None) -> None:
+    """Adds an image to the cache along with its digest, evicting the least recently used
+    images if necessary
+
+    Args:
+        key (str): The cache key of the image
+        img_path (Path): The path of the image to cache
+        digest (Optional[str], optional): The sha256 digest of the image, if already known.
+            Defaults to computing it.
+    """
+    cache_dir().mkdir(exist_ok=True, parents=True)
+    cached = cache_dir() / f"{key}.img"
+    digest = file_digest(img_path) if digest is None else digest
+    # Write then rename so that concurrent readers never see a partially written image, and
+    # the digest is always in place before its image
+    for path, write in (
+        (cached.with_suffix(".sha256"), lambda partial: partial.write_text(digest)),
+        (cached, lambda partial: shutil.copyfile(img_path, partial)),
+    ):
+        partial = path.with_name(f"{path.name}.{os.getpid()}.part")
+        write(partial)
+        partial.replace(path)
+    prune_to(config.CACHE_MAX_BYTES)
+
+
+def entries() -> List[CacheEntry]:
+    """Lists the images in the cache, most recently used first
+
+    Returns:
+        List[CacheEntry]: The cached images
+    """
+    if not cache_dir().exists():
+        return []
+    out = []
+    for path in cache_dir().glob("*.img"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        out.append(CacheEntry(path.stem, path, stat.st_size, stat.st_mtime))
+    return sorted(out, key=lambda e: e.last_used, reverse=True)
+
+
+def prune_to(max_bytes: int) -> List[CacheEntry]:
+    """Evicts the least recently used images until the cache fits in the specified size
+
+    Args:
+        max_bytes (int): The maximum total size of the cache in bytes
+
+    Returns:
+        List[CacheEntry]: The evicted images
+    """
+    evicted = []
+    cached = entries()
+    total = sum(e.size for e in cached)
+    while cached and total > max_bytes:
+        entry = cached.pop()
+        evict(entry.path)
+        total -= entry.size
+        evicted.append(entry)
+    return evicted
+
+
+@app.command(name="ls", help="List the cached ignition images")
+def ls() -> None:
+    """Lists the cached ignition images, most recently used first"""
+    cached = entries()
+    for entry in cached:
+        last_used = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry.last_used))
+        typer.echo(f"{entry.key}  {entry.size:>10}  {last_used}")
+    typer.echo(
+        f"{len(cached)} images, {sum(e.size for e in cached)} of "
+        f"{config.CACHE_MAX_BYTES} bytes used"
+    )
+
+
+@app.command(help="Evict cached ignition images")
+def prune(
+    max_bytes: Annotated[
+        Optional[int],
+        typer.Option(
+            "--max-bytes",
+            "-m",
+            help="Evict least recently used images until the cache fits in this many bytes",
+            min=0,
+        ),
+    ] = None,
+    everything: Annotated[
+        bool,
+        typer.Option(
+            "--all",
+            "-a",
+            help="Evict every cached image",
+        ),
+    ] = False,
+) -> None:
+    """Evicts cached ignition images
+
+    Args:
+        max_bytes (Annotated[ Optional[int], typer.Option, optional):
+            The size to shrink the cache to.
+            Defaults to CACHE_MAX_BYTES.
+        everything (Annotated[ bool, typer.Option, optional):
+            Evict every cached image.
+            Defaults to False.
+    """
+    if everything:
+        max_bytes = 0
+    elif max_bytes is None:
+        max_bytes = config.CACHE_MAX_BYTES
+    evicted = prune_to(max_bytes)
+    typer.echo(f"Evicted {len(evicted)} images ({sum(e.size for e in evicted)} bytes)")
+
+
+if __name__ == "__main__":
+    config.update_config("cli")
+    app()
@@ -1,9 +1,13 @@
+from collections import defaultdict
+from contextlib import contextmanager
 from functools import wraps
-import inspect
-from typing import Callable
+from threading import Lock
+from typing import Any, Callable, DefaultDict, Dict, Iterator, List, Tuple
 
-from rich.progress import Progress, SpinnerColumn, TextColumn
+from rich.markup import escape
+from rich.progress import Progress, SpinnerColumn, TaskID, TextColumn
 
+from . import progress
 from .config import config
 from .utils import Singleton
 
@@ -13,34 +17,125 @@ class SingletonProgress(Progress, metaclass=Singleton):
     pass
 
 
+def format_amount(event: progress.Event, seconds: float) -> str:
+    """Formats how far a stage has got for display alongside its description
+
+    Args:
+        event (progress.Event): The latest progress event of the stage
+        seconds (float): How long the stage has been running
+
+    Returns:
+        str: The amount done, the total and the percentage and rate where known
+    """
+    if event.done is None:
+        return ""
+    if event.unit != "bytes":
+        total = f"/{event.total}" if event.total else ""
+        return f"{event.done}{total} {event.unit}"
+    total = f"/{event.total / 2**20:.1f}" if event.total else ""
+    percent = f"{event.fraction:.0%} " if event.fraction is not None else ""
+    rate = event.done / max(seconds, 1e-9)
+    return f"{percent}{event.done / 2**20:.1f}{total} MiB ({rate / 2**20:.1f} MiB/s)"
+
+
+class RichRenderer:
+    """Renders progress events as tasks on the CLI's progress display
+
+    Every running stage gets its own task, indented beneath the stages of the same job
+    that contain it and labelled with its job, so concurrent jobs can be told apart.
+    """
+
+    def __init__(self, display: Progress) -> None:
+        """Initialises the renderer
+
+        Args:
+            display (Progress): The progress display to render to
+        """
+        self.display = display
+        self.lock = Lock()
+        self.tasks: DefaultDict[Tuple[str, str], List[Tuple[TaskID, float]]] = defaultdict(list)
+        self.depths: Dict[str, int] = defaultdict(int)
+
+    def __call__(self, event: progress.Event) -> None:
+        key = (event.job, event.stage)
+        with self.lock:
+            if event.kind == "start":
+                depth = self.depths[event.job]
+                self.depths[event.job] += 1
+                label = f"[{event.job}] " if event.job else ""
+                task_id = self.display.add_task(
+                    escape(f"{label}{event.stage}"),
+                    total=event.total,
+                    indent=f"├{'─' * depth}► ",
+                    amount="",
+                )
+                self.tasks[key].append((task_id, event.time))
+                return
+            if not self.tasks[key]:
+                return
+            task_id, start = self.tasks[key][-1]
+            if event.kind == "update":
+                self.display.update(task_id, amount=format_amount(event, event.time - start))
+            elif event.kind == "end":
+                self.tasks[key].pop()
+                self.depths[event.job] -= 1
+                self.display.remove_task(task_id)
+
+
+live_lock = Lock()
+# The users of the live progress display, and the function to stop it rendering events
+live_state: Dict[str, Any] = {"users": 0, "unsubscribe": None}
+
+
+@contextmanager
+def live_progress() -> Iterator[None]:
+    """Shows the CLI's progress display, rendering progress events, while the context is
+    active. Nested contexts share the outermost context's display."""
+    with live_lock:
+        live_state["users"] += 1
+        if live_state["users"] == 1:
+            display = SingletonProgress(
+                SpinnerColumn(),
+                TextColumn("{task.fields[indent]}[progress.description]{task.description}"),
+                TextColumn("{task.fields[amount]}"),
+                transient=True,
+                expand=True,
+            )
+            live_state["unsubscribe"] = progress.subscribe(RichRenderer(display))
+            display.start()
+    try:
+        yield
+    finally:
+        with live_lock:
+            live_state["users"] -= 1
+            if live_state["users"] == 0:
+                live_state["unsubscribe"]()
+                SingletonProgress().stop()
+
+
 def cli_spinner(*spinner_args, **spinner_kwargs) -> Callable:
-    """A decorator that adds a spinner to the CLI while the decorated function is running
-    
+    """A decorator that publishes the decorated function as a stage of the pipeline, and
+    shows it with a spinner on the CLI while it is running
+
     Args:
-        *spinner_args: The arguments to pass to the rich spinner object
-        **spinner_kwargs: The keyword arguments to pass to the rich spinner object
+        *spinner_args: The description of the stage
+        **spinner_kwargs: The "description" of the stage, and its "total" if known
 
     Returns:
         Callable: The decorated function
     """
+    description = spinner_kwargs.get("description", spinner_args[0] if spinner_args else "")
+    total = spinner_kwargs.get("total")
+
     def decorator(f: Callable) -> Callable:
-        # Indent the spinner to match its nesting level
-        indent = len(inspect.stack()) - 1
-        spinner_kwargs["indent"] = f"├{'─'*indent}► " if indent else "├► "
-        
         @wraps(f)
         def wrapped(*func_args, **func_kwargs):
             if not config.CLI:
+                with progress.task(description, total=total):
+                    return f(*func_args, **func_kwargs)
+            with live_progress(), progress.task(description, total=total):
                 return f(*func_args, **func_kwargs)
-            with SingletonProgress(
-                SpinnerColumn(),
-                TextColumn("{task.fields[indent]}[progress.description]{task.description}"),
-                transient=True,
-                expand=True,
-            ) as progress:
-                task_id = progress.add_task(*spinner_args, **spinner_kwargs)
-                out = f(*func_args, **func_kwargs)
-                progress.stop_task(task_id)
-                return out
+
         return wrapped
+
     return decorator
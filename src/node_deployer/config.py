@@ -1,12 +1,15 @@
+from copy import deepcopy
+from functools import cached_property
+import os
 from pathlib import Path
 from types import SimpleNamespace
+from typing import Any, Tuple
 
-import docker
 import tomllib
 
 
-CLIENT = docker.from_env(version="auto")
 MAX_PORT: int = 65535
+ENV_PREFIX: str = "NODE_DEPLOYER_"
 
 
 def __get_project_root():
@@ -17,9 +20,55 @@ def __get_project_root():
 
 
 PROJECT_ROOT: Path = __get_project_root()
+CONFIG_FILE: Path = PROJECT_ROOT / "config.toml"
 
 type ConfigLabel = str | list[str]
 
+# The parsed config file, and the mtime it had when parsed
+_config_file: Tuple[int, dict] = (-1, {})
+
+
+def load_config_file() -> dict:
+    """Loads config.toml, parsing it again only if it has changed since it was last parsed
+
+    Returns:
+        dict: Every configuration in config.toml, by label
+    """
+    global _config_file
+    mtime = CONFIG_FILE.stat().st_mtime_ns
+    if _config_file[0] != mtime:
+        with open(CONFIG_FILE, "rb") as f:
+            _config_file = (mtime, tomllib.load(f))
+    return _config_file[1]
+
+
+def parse_env_value(value: str) -> Any:
+    """Parses the value of an environment variable override as a TOML value
+
+    Args:
+        value (str): The value of the environment variable
+
+    Returns:
+        Any: The parsed value, or the raw value if it is not a valid TOML value
+    """
+    try:
+        return tomllib.loads(f"value = {value}")["value"]
+    except tomllib.TOMLDecodeError:
+        return value
+
+
+def env_overrides() -> dict:
+    """Gets the configuration overrides set by NODE_DEPLOYER_<VARIABLE> environment variables
+
+    Returns:
+        dict: The overridden variables and their values
+    """
+    return {
+        k.removeprefix(ENV_PREFIX): parse_env_value(v)
+        for k, v in os.environ.items()
+        if k.startswith(ENV_PREFIX) and k != ENV_PREFIX
+    }
+
 
 class Config(SimpleNamespace):
     def __init__(self, config_label: ConfigLabel, **kwargs) -> None:
@@ -32,16 +81,44 @@ class Config(SimpleNamespace):
         self.__dict__.update(self.get_config(config_label))
         self.update_config()
         _kwargs = {
-            "CLIENT": CLIENT,
             "MAX_PORT": MAX_PORT,
             "PROJECT_ROOT": PROJECT_ROOT,
         }
         _kwargs.update(kwargs)
         super().__init__(**_kwargs)
 
+    @cached_property
+    def CLIENT(self):
+        """The docker client, connected on first use so commands that never use docker
+        don't need a docker daemon
+
+        Returns:
+            docker.DockerClient: The docker client
+        """
+        import docker
+
+        return docker.from_env(version="auto")
+
+    @property
+    def CWD_MOUNT(self):
+        """The mount binding the project root to CWD_MOUNTDIR in containers
+
+        Returns:
+            docker.types.Mount: The mount
+        """
+        import docker
+
+        # I really wish docker-py had typeshed stubs
+        return docker.types.Mount(  # type: ignore
+            target=str(self.CWD_MOUNTDIR),
+            source=str(PROJECT_ROOT),
+            type="bind",
+        )
+
     @staticmethod
     def get_config(config_label: ConfigLabel = "default") -> dict:
-        """Gets the specified configuration from config.toml
+        """Gets the specified configuration from config.toml, with any environment
+        variable overrides applied
 
         Args:
             config_label (ConfigLabel, optional):
@@ -53,11 +130,11 @@ class Config(SimpleNamespace):
         """
         if isinstance(config_label, str):
             config_label = [config_label]
-        with open(PROJECT_ROOT / "config.toml", "rb") as f:
-            configs: dict = tomllib.load(f)
+        configs = load_config_file()
         out_config: dict = {}
         for c in config_label:
-            out_config.update(configs[c])
+            out_config.update(deepcopy(configs[c]))
+        out_config.update(env_overrides())
         return out_config
 
     def finalise_config(self, config: dict) -> None:
@@ -76,19 +153,12 @@ class Config(SimpleNamespace):
                     config[k] = Path(v)
         # Then, get required paths from config or globals if not present
         build_dir = Path(config.get("BUILD_DIR", self.BUILD_DIR)).absolute()
-        cwd_mountdir = Path(config.get("CWD_MOUNTDIR", self.CWD_MOUNTDIR))
         src_dir = Path(config.get("SRC_DIR", self.SRC_DIR)).absolute()
         # Finally, construct the secondary parameters
         config["FUELIGNITION_BUILD_DIR"] = build_dir / config.get(
             "FUELIGNITION_BUILD_DIR", self.FUELIGNITION_BUILD_DIR
         )
         config["DOCKERFILE_DIR"] = src_dir / config.get("DOCKERFILE_DIR", self.DOCKERFILE_DIR)
-        # I really wish docker-py had typeshed stubs
-        config["CWD_MOUNT"] = docker.types.Mount(  # type: ignore
-            target=str(cwd_mountdir),
-            source=str(PROJECT_ROOT),
-            type="bind",
-        )
 
     def apply_config(self, config: dict) -> None:
         """Applies the specified configuration to this object's attributes
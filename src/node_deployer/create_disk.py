@@ -1,15 +1,31 @@
+from concurrent.futures import as_completed, ThreadPoolExecutor
+from contextlib import ExitStack
+import fcntl
 from fnmatch import fnmatch
-from typing import Annotated, Optional
+from hashlib import sha256
+import json
+from pathlib import Path
+from typing import Annotated, Dict, List, Optional, Sequence
 
+import docker
 from docker.types import Mount
 import typer
 
+from . import progress
+from .autoignition import container_path
 from .cli import cli_spinner
 from .config import config
 from .create_img import create_img
 from .debug import debug_guard
+from .disk_writer import write_and_verify, write_image_to_targets
+from .fat import read_fat_file
 from .ip_interface import IPAddress
-from .utils import ensure_build_dir
+from .timings import timed_command
+from .utils import ensure_build_dir, file_size
+from .validator import validate_config
+
+
+VALIDATOR_IMAGE: str = "validate"
 
 
 def filter_validation_response(response: str) -> str:
@@ -31,77 +47,370 @@ def filter_validation_response(response: str) -> str:
     ).strip()
 
 
-def validation_result() -> str:
-    """Returns the response resulting from a validation of the ignition image
+def validator_buildargs() -> Dict[str, str]:
+    """Returns the build arguments of the validator docker image
 
     Returns:
-        str: The response from the validation
+        Dict[str, str]: The build arguments
+    """
+    return {
+        "CWD_MOUNTDIR": str(config.CWD_MOUNTDIR),
+        "BUILD_DIR": str(config.BUILD_DIR.relative_to(config.PROJECT_ROOT)),
+    }
+
+
+def validator_tag() -> str:
+    """Returns the tag identifying the validator image by the digest of its build inputs
+
+    Returns:
+        str: The image tag
+    """
+    digest = sha256((config.DOCKERFILE_DIR / "validate.dockerfile").read_bytes())
+    digest.update((config.SRC_DIR / "scripts/validate_installs.sh").read_bytes())
+    digest.update(json.dumps(validator_buildargs(), sort_keys=True).encode())
+    return f"{VALIDATOR_IMAGE}:{digest.hexdigest()[:12]}"
+
+
+def validator_image(tag: str) -> docker.models.images.Image:  # type: ignore
+    """Gets the validator image with the specified tag, building it if it does not exist
+
+    Args:
+        tag (str): The tag of the validator image
+
+    Returns:
+        docker.models.images.Image: The validator image
     """
-    dockerfile = config.DOCKERFILE_DIR / "validate.dockerfile"
+    try:
+        return config.CLIENT.images.get(tag)
+    except docker.errors.ImageNotFound:  # type: ignore
+        pass
     image, _ = config.CLIENT.images.build(
         path=".",
-        dockerfile=str(dockerfile),
-        tag="validate",
-        buildargs={
-            "CWD_MOUNTDIR": str(config.CWD_MOUNTDIR),
-            "BUILD_DIR": str(config.BUILD_DIR.relative_to(config.PROJECT_ROOT)),
-        },
+        dockerfile=str(config.DOCKERFILE_DIR / "validate.dockerfile"),
+        tag=tag,
+        buildargs=validator_buildargs(),
         rm=config.CLEANUP_IMAGES,
         pull=True,
         quiet=True,
     )
+    return image
+
+
+def read_config(img_path: Optional[Path] = None) -> Optional[bytes]:
+    """Reads the ignition config to be validated
+
+    The config is read straight out of the ignition image where there is one, so we do not
+    need a container to get at it.
+
+    Args:
+        img_path (Optional[Path], optional): The ignition image to read the config from.
+            Defaults to the ignition image in the build directory.
+
+    Returns:
+        Optional[bytes]: The raw ignition config, or None if there is no config to validate
+    """
+    img_path = config.BUILD_DIR / "ignition.img" if img_path is None else img_path
+    try:
+        if img_path.exists():
+            return read_fat_file(img_path.read_bytes(), "ignition/config.ign")
+        return (config.BUILD_DIR / "config.ign").read_bytes()
+    except FileNotFoundError:
+        return None
+
+
+def config_digest(img_path: Optional[Path] = None) -> Optional[str]:
+    """Hashes the ignition config that the validator will check
+
+    Args:
+        img_path (Optional[Path], optional): The ignition image holding the config.
+            Defaults to the ignition image in the build directory.
+
+    Returns:
+        Optional[str]: The digest of the config, or None if there is no config to validate
+    """
+    contents = read_config(img_path)
+    if contents is None:
+        return None
+    return sha256(contents).hexdigest()
+
+
+def validation_key(img_path: Optional[Path] = None) -> Optional[str]:
+    """Returns the key under which the validation of a config is remembered
+
+    Args:
+        img_path (Optional[Path], optional): The ignition image holding the config.
+            Defaults to the ignition image in the build directory.
+
+    Returns:
+        Optional[str]: The key, or None if there is no config to validate
+    """
+    digest = config_digest(img_path)
+    if digest is None:
+        return None
+    return f"{validator_tag()}:{digest}"
+
+
+def load_validation_results() -> Dict[str, str]:
+    """Loads the remembered validation responses
+
+    Returns:
+        Dict[str, str]: The validation responses, keyed by validation key
+    """
+    try:
+        with open(config.BUILD_DIR / config.VALIDATION_CACHE_FILE, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_validation_result(key: str, response: str) -> None:
+    """Remembers a validation response
+
+    Args:
+        key (str): The validation key of the validated config
+        response (str): The response from the validation
+    """
+    path = config.BUILD_DIR / config.VALIDATION_CACHE_FILE
+    path.parent.mkdir(exist_ok=True, parents=True)
+    # Batches validate from several threads at once, so updates are made one at a time under
+    # a lock. The file is written then renamed, so readers never see it partially written
+    with open(path.with_name(f"{path.name}.lock"), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            results = load_validation_results()
+            results[key] = response
+            partial = path.with_name(f"{path.name}.part")
+            with open(partial, "w") as f:
+                json.dump(results, f, indent=4)
+            partial.replace(path)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def validation_result(img_path: Optional[Path] = None) -> str:
+    """Returns the response resulting from a validation of the ignition image
+
+    Args:
+        img_path (Optional[Path], optional): The ignition image to validate.
+            Defaults to the ignition image in the build directory.
+
+    Returns:
+        str: The response from the validation
+    """
+    key = validation_key(img_path)
+    if key is not None:
+        response = load_validation_results().get(key)
+        if response is not None:
+            return response
+    command = None
+    if img_path is not None:
+        # The validator's scripts only know the image in the build directory, so other
+        # images have their config extracted where the container can see it
+        contents = read_config(img_path)
+        if contents is None:
+            return "error: no ignition config found to validate\n"
+        config_path = config.BUILD_DIR / "validate" / f"{sha256(contents).hexdigest()}.ign"
+        config_path.parent.mkdir(exist_ok=True, parents=True)
+        config_path.write_bytes(contents)
+        command = ["/usr/local/bin/ignition-validate", str(container_path(config_path))]
+    # Note that the validator's base images are only pulled when its build inputs change
+    image = validator_image(validator_tag())
     response = config.CLIENT.containers.run(
         image,
+        command=command,
         mounts=[
             config.CWD_MOUNT,
         ],
         remove=config.CLEANUP_IMAGES,
-    )
-    if config.CLEANUP_IMAGES:
+    ).decode()
+    if config.CLEANUP_IMAGES and not config.KEEP_VALIDATOR_IMAGE:
         image.remove(force=True)
-    return response.decode()
+    if key is not None:
+        save_validation_result(key, response)
+    return response
+
+
+def native_validation_result(img_path: Optional[Path] = None) -> str:
+    """Returns the response resulting from an in-process validation of the ignition image
+
+    Args:
+        img_path (Optional[Path], optional): The ignition image to validate.
+            Defaults to the ignition image in the build directory.
+
+    Returns:
+        str: The response from the validation
+    """
+    contents = read_config(img_path)
+    if contents is None:
+        return "error: no ignition config found to validate\n"
+    return validate_config(contents)
+
+
+def validation_response(img_path: Optional[Path] = None) -> str:
+    """Validates an ignition image with the configured VALIDATION_BACKEND
+
+    Args:
+        img_path (Optional[Path], optional): The ignition image to validate.
+            Defaults to the ignition image in the build directory.
+
+    Raises:
+        ValueError: If the validation backend is unknown
+
+    Returns:
+        str: The filtered response from the validation, empty if the image is valid
+    """
+    match config.VALIDATION_BACKEND:
+        case "native":
+            response = native_validation_result(img_path)
+        case "docker":
+            response = validation_result(img_path)
+        case _:
+            raise ValueError(f"Unknown validation backend: {config.VALIDATION_BACKEND}")
+    return filter_validation_response(response)
 
 
 @cli_spinner(description="Validating ignition image", total=None)
 def validate() -> tuple[bool, str]:
-    """Validates the ignition image
+    """Validates the ignition image, using the configured VALIDATION_BACKEND
 
     Returns:
         tuple[bool, str]: A tuple containing a boolean indicating whether
         the validation was successful and the response from the validation
     """
-    response = validation_result()
-    response = filter_validation_response(response)
+    response = validation_response()
     return (not bool(response), response)
 
 
-@cli_spinner(description="Writing ignition image to disk", total=None)
-def write_disk(disk: str) -> None:
-    """Writes the ignition image to the specified disk
+def write_disk_dd(disk: str, img_path: Path) -> None:
+    """Writes an ignition image to the specified disk with dd in a privileged container
 
     Args:
         disk (str): The disk to write to
+        img_path (Path): The ignition image to write, which must be inside the project root
     """
+    container_img_path = config.CWD_MOUNTDIR / (config.PROJECT_ROOT / img_path).relative_to(
+        config.PROJECT_ROOT
+    )
     config.CLIENT.containers.run(
         "alpine",
         mounts=[config.CWD_MOUNT, Mount("/ignition_disk", disk, type="bind")],
         privileged=True,
-        command=f"dd if={config.CWD_MOUNTDIR}/build/ignition.img of=/ignition_disk",
+        command=f"dd if={container_img_path} of=/ignition_disk",
         remove=config.CLEANUP_IMAGES,
     )
 
 
+def write_disks(
+    disks: Sequence[str], img_path: Optional[Path] = None
+) -> Dict[str, Optional[Exception]]:
+    """Writes an ignition image to several disks at once, using the configured DISK_WRITER
+
+    The native writer reads the image once and writes every disk concurrently, then reads
+    each disk back to check it holds the image if VERIFY_WRITES is set. It needs write
+    access to the disks, so any disk we can't open falls back to being written with
+    dd in a privileged container. A failure writing one disk does not affect the others.
+
+    Args:
+        disks (Sequence[str]): The disks to write to
+        img_path (Optional[Path], optional): The ignition image to write.
+            Defaults to the ignition image in the build directory.
+
+    Returns:
+        Dict[str, Optional[Exception]]: The error that stopped each failed write, or None
+            for each successful one, by disk
+    """
+    img_path = config.BUILD_DIR / "ignition.img" if img_path is None else img_path
+    results: Dict[str, Optional[Exception]] = {disk: None for disk in disks}
+    fallback = list(disks)
+    if config.DISK_WRITER == "native":
+        write = write_and_verify if config.VERIFY_WRITES else write_image_to_targets
+        with ExitStack() as stack:
+            # Each disk is its own job, so their progress is reported separately
+            updates = {
+                Path(disk): stack.enter_context(progress.task("Writing image", job=disk))
+                for disk in disks
+            }
+            written = write(
+                config.PROJECT_ROOT / img_path,
+                [Path(disk) for disk in disks],
+                direct=config.WRITE_DIRECT,
+                progress=lambda target, done, total: updates[target](done, total),
+            )
+        fallback = []
+        for target, result in written.items():
+            if isinstance(result, PermissionError):
+                fallback.append(str(target))
+            elif isinstance(result, Exception):
+                results[str(target)] = result
+    with ThreadPoolExecutor(max_workers=max(len(fallback), 1)) as executor:
+        futures = {executor.submit(write_disk_dd, disk, img_path): disk for disk in fallback}
+        for future in as_completed(futures):
+            error = future.exception()
+            results[futures[future]] = error if isinstance(error, Exception) else None
+    return results
+
+
+@cli_spinner(description="Writing ignition image to disk", total=None)
+def write_disk(disk: str) -> None:
+    """Writes the ignition image to the specified disk
+
+    Args:
+        disk (str): The disk to write to
+
+    Raises:
+        Exception: The error that stopped the write, if it failed
+    """
+    error = write_disks([disk])[disk]
+    if error is not None:
+        raise error
+
+
+@cli_spinner(description="Writing ignition image to disks", total=None)
+def write_all_disks(disks: Sequence[str], img_path: Optional[Path] = None) -> List[str]:
+    """Writes an ignition image to several disks at once, reporting the outcome for each
+
+    Args:
+        disks (Sequence[str]): The disks to write to
+        img_path (Optional[Path], optional): The ignition image to write.
+            Defaults to the ignition image in the build directory.
+
+    Returns:
+        List[str]: The disks that failed to write
+    """
+    failed = []
+    for disk, error in write_disks(disks, img_path).items():
+        if error is None:
+            typer.echo(f"Wrote ignition image to {disk}")
+        else:
+            typer.echo(f"Failed to write ignition image to {disk}: {error}")
+            failed.append(disk)
+    return failed
+
+
+def prompt_disks(disks: Optional[List[str]]) -> List[str]:
+    """Prompts for a disk if none were given, as click cannot prompt for a repeatable option
+
+    Args:
+        disks (Optional[List[str]]): The disks given on the command line
+
+    Returns:
+        List[str]: The disks to write to
+    """
+    return disks if disks else [typer.prompt("Disk")]
+
+
 @debug_guard
+@timed_command
 @cli_spinner(description="Creating ignition initialisation disk", total=None)
 @ensure_build_dir
 def create_ignition_disk(
     disk: Annotated[
-        Optional[str],
+        Optional[List[str]],
         typer.Option(
             "--disk",
             "-d",
-            help="Path to the disk to write to",
-            prompt=True,
+            help="Path to a disk to write to (repeat to write several disks at once)",
+            callback=prompt_disks,
         ),
     ] = None,
     hostname: Annotated[
@@ -154,6 +463,21 @@ def create_ignition_disk(
             prompt=True,
         ),
     ] = None,
+    timings: Annotated[
+        bool,
+        typer.Option(
+            "--timings",
+            help="Print how long each stage took once finished",
+        ),
+    ] = False,
+    timings_json: Annotated[
+        Optional[Path],
+        typer.Option(
+            "--timings-json",
+            help="File to write how long each stage took to, as JSON",
+            dir_okay=False,
+        ),
+    ] = None,
     debug: Annotated[
         bool,
         typer.Option(
@@ -166,11 +490,11 @@ def create_ignition_disk(
         ),
     ] = False,
 ) -> None:
-    """Creates an ignition image and writes it to the specified disk
+    """Creates an ignition image and writes it to the specified disks
 
     Args:
-        disk (Annotated[ str, typer.Option, optional):
-            The disk to write to.
+        disk (Annotated[ List[str], typer.Option, optional):
+            The disks to write to.
             Defaults to None.
         hostname (Annotated[ str, typer.Option, optional):
             The hostname for the new node.
@@ -187,15 +511,21 @@ def create_ignition_disk(
         swarm_token (Annotated[ str, typer.Option, optional):
             The swarm token for connecting to the swarm.
             Defaults to None.
+        timings (Annotated[ bool, typer.Option, optional):
+            Print how long each stage took once finished.
+            Defaults to False.
+        timings_json (Annotated[ Optional[Path], typer.Option, optional):
+            The file to write how long each stage took to, as JSON.
+            Defaults to None.
         debug (Annotated[ bool, typer.Option, optional):
             Enable debug mode.
             Defaults to False.
 
     Raises:
-        typer.Exit: Exit CLI if the ignition image is invalid
+        typer.Exit: Exit CLI if the ignition image is invalid or any disk failed to write
     """
     # Guard against the user specifying no disk
-    if disk is None:
+    if not disk:
         raise typer.BadParameter("No disk specified")
 
     create_img(
@@ -213,7 +543,12 @@ def create_ignition_disk(
         raise typer.Exit(1)
     else:
         print("Valid ignition image created!")
-    write_disk(disk)
+    with progress.task("Writing disks") as update:
+        failed = write_all_disks(disk)
+        size = file_size(config.BUILD_DIR / "ignition.img")
+        update(None if size is None else size * (len(disk) - len(failed)))
+    if failed:
+        raise typer.Exit(1)
 
 
 if __name__ == "__main__":
@@ -5,22 +5,59 @@ from typing import Annotated, Optional
 import typer
 
 from .autoignition import json_to_img
+from . import passwords, progress, templates
 from .cli import cli_spinner
 from .config import config
 from .debug import debug_guard
 from .ip_interface import IPAddress
-from .utils import ensure_build_dir
+from .timings import timed_command
+from .utils import ensure_build_dir, file_size
 
 
 def load_template() -> dict:
     """Loads the default template for the ignition configuration
 
     Returns:
-        dict: The default ignition configuration
+        dict: The default ignition configuration, which is immutable
     """
-    with open(config.SRC_DIR / "templates/fuelignition.json", "r") as f:
-        out = json.load(f)
-    return out
+    return templates.load_template()
+
+
+def hash_on_host(password: str) -> Optional[str]:
+    """Hashes a password on the host, if the conversion engine accepts hashed passwords
+
+    Args:
+        password (str): The password to hash
+
+    Returns:
+        Optional[str]: The hashed password, or None if it should be left to fuel-ignition
+    """
+    if config.CONVERSION_ENGINE != "native" or not password:
+        return None
+    with progress.task("Hashing password"):
+        return passwords.cached_hash(password)
+
+
+def swarm_configuration(
+    switch_ip: Optional[IPAddress],
+    switch_port: int,
+    swarm_token: Optional[str],
+) -> dict:
+    """Builds the swarm configuration that a node uses to join the swarm
+
+    Args:
+        switch_ip (Optional[IPAddress]): The IP address of the switch to connect to
+        switch_port (int): The port on the switch to connect to
+        swarm_token (Optional[str]): The swarm token for connecting to the swarm
+
+    Returns:
+        dict: The swarm configuration
+    """
+    return {
+        "SWITCH_IP_ADDRESS": str(switch_ip),
+        "SWITCH_PORT": switch_port,
+        "SWARM_TOKEN": swarm_token,
+    }
 
 
 def apply_ignition_settings(
@@ -28,6 +65,7 @@ def apply_ignition_settings(
     hostname: str,
     password: str,
     swarm_config: dict,
+    password_hash: Optional[str] = None,
 ) -> dict:
     """Applies the specified ignition settings to the given template
 
@@ -36,57 +74,23 @@ def apply_ignition_settings(
         hostname (str): The hostname to set
         password (str): The password to set for the root user
         swarm_config (str): The swarm configuration to set
+        password_hash (Optional[str], optional): The password already hashed, to set in
+            place of the password itself. Defaults to None.
+
+    Raises:
+        ValueError: If the template is invalid, or no password is given outside of testing
 
     Returns:
-        dict: The template with the settings applied
+        dict: The template with the settings applied, which is immutable and shares
+            everything the settings don't change with the template
     """
-    ignition_config = template.copy()
-    ignition_config["hostname"] = hostname
-    ignition_config["login"]["users"][0]["passwd"] = password
-    if password:
-        ignition_config["login"]["users"][0]["hash_type"] = "bcrypt"
-    elif not config.TESTING:
-        raise ValueError("Password must be specified")
-
-    # Add files that will define a service to ensure that the node joins the swarm
-    with open(config.SRC_DIR / "templates/join_swarm.sh", "r") as f1, open(
-        config.SRC_DIR / "templates/join_swarm.service", "r"
-    ) as f2:
-        swarm_script, swarm_service = f1.read(), f2.read()
-
-    ignition_config["storage"] = ignition_config.get("storage", {})
-    ignition_config["storage"]["files"] = ignition_config["storage"].get("files", [])
-    ignition_config["storage"]["files"] += [
-        {
-            "path": "/root/join_swarm.json",
-            "source_type": "data",
-            "mode": 420,
-            "overwrite": True,
-            "data_content": json.dumps(swarm_config),
-        },
-        {
-            "path": "/root/join_swarm.sh",
-            "source_type": "data",
-            "mode": 420,
-            "overwrite": True,
-            "data_content": swarm_script,
-        },
-    ]
-
-    ignition_config["systemd"] = ignition_config.get("systemd", {})
-    ignition_config["systemd"]["units"] = ignition_config["systemd"].get("units", [])
-    ignition_config["systemd"]["units"] += [
-        {
-            "name": "join_swarm.service",
-            "enabled": True,
-            "contents": swarm_service,
-        },
-    ]
-
-    return ignition_config
+    return templates.compile_template(templates.freeze(template)).render(
+        hostname, password, swarm_config, password_hash
+    )
 
 
 @debug_guard
+@timed_command
 @cli_spinner(description="Creating ignition image", total=None)
 @ensure_build_dir
 def create_img(
@@ -149,6 +153,21 @@ def create_img(
             dir_okay=False,
         ),
     ] = Path("ignition.img"),
+    timings: Annotated[
+        bool,
+        typer.Option(
+            "--timings",
+            help="Print how long each stage took once finished",
+        ),
+    ] = False,
+    timings_json: Annotated[
+        Optional[Path],
+        typer.Option(
+            "--timings-json",
+            help="File to write how long each stage took to, as JSON",
+            dir_okay=False,
+        ),
+    ] = None,
     debug: Annotated[
         bool,
         typer.Option(
@@ -182,6 +201,12 @@ def create_img(
         img_path (Annotated[ Path, typer.Option, optional):
             The path to which the ignition image should be written.
             Defaults to Path("ignition.img").
+        timings (Annotated[ bool, typer.Option, optional):
+            Print how long each stage took once finished.
+            Defaults to False.
+        timings_json (Annotated[ Optional[Path], typer.Option, optional):
+            The file to write how long each stage took to, as JSON.
+            Defaults to None.
         debug (Annotated[ bool, typer.Option, optional):
             Enable debug mode.
             Defaults to False.
@@ -192,24 +217,23 @@ def create_img(
     elif password is None:
         password = ""
 
-    # get swarm configuration as JSON
-    swarm_config = {
-        "SWITCH_IP_ADDRESS": str(switch_ip),
-        "SWITCH_PORT": switch_port,
-        "SWARM_TOKEN": swarm_token,
-    }
-
-    # Create ignition configuration
-    ignition_config = apply_ignition_settings(
-        load_template(),
-        hostname,
-        password,
-        swarm_config,
-    )
-
-    # export ignition configuration
-    with open(config.BUILD_DIR / "fuelignition.json", "w") as f:
-        json.dump(ignition_config, f, indent=4)
+    with progress.task("Rendering template") as update:
+        # get swarm configuration as JSON
+        swarm_config = swarm_configuration(switch_ip, switch_port, swarm_token)
+
+        # Create ignition configuration
+        ignition_config = apply_ignition_settings(
+            load_template(),
+            hostname,
+            password,
+            swarm_config,
+            hash_on_host(password),
+        )
+
+        # export ignition configuration
+        with open(config.BUILD_DIR / "fuelignition.json", "w") as f:
+            json.dump(ignition_config, f, indent=4)
+        update(file_size(config.BUILD_DIR / "fuelignition.json"))
 
     # convert ignition configuration to image
     json_to_img(
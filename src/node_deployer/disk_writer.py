@@ -0,0 +1,427 @@
+from concurrent.futures import as_completed, ThreadPoolExecutor
+import errno
+import fcntl
+from hashlib import sha256
+import io
+from itertools import zip_longest
+import mmap
+import os
+from pathlib import Path
+from queue import Queue
+import stat
+from threading import Lock, Thread
+import time
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from .config import config
+
+
+# O_DIRECT requires buffers, offsets and lengths aligned to the logical block size of the
+# device, which is at most the page size on any disk we're likely to be flashing
+ALIGNMENT: int = mmap.PAGESIZE
+BUFFERS: int = 2
+
+type Block = Tuple[Optional[mmap.mmap], int | BaseException]
+type Progress = Callable[[Path, int, int], None]
+
+
+class WriteStats(NamedTuple):
+    written: int
+    seconds: float
+
+    @property
+    def rate(self) -> float:
+        """The average write rate in bytes per second"""
+        return self.written / self.seconds if self.seconds else float("inf")
+
+
+def fill(src: io.FileIO, view: memoryview) -> int:
+    """Reads from a file until a buffer is full or the file ends
+
+    Args:
+        src (io.FileIO): The unbuffered file to read from
+        view (memoryview): The buffer to fill
+
+    Returns:
+        int: The number of bytes read
+    """
+    n = 0
+    while n < len(view) and (k := src.readinto(view[n:])):
+        n += k
+    return n
+
+
+def write_blocks(
+    target: Path,
+    blocks: Queue[Block],
+    release: Callable[[mmap.mmap], None],
+    total: int,
+    direct: bool,
+    progress: Optional[Progress],
+    offset: int = 0,
+    regular_file: bool = False,
+) -> WriteStats:
+    """Writes blocks from a queue to a target until a block of length 0 arrives
+
+    Every block is released once this target is done with it, even after a failure, so
+    that one failing target never holds up the others.
+
+    Args:
+        target (Path): The disk or file to write to
+        blocks (Queue[Block]): The blocks to write, in order. A block with no buffer carries
+            the exception that stopped the reader instead of a length.
+        release (Callable[[mmap.mmap], None]): Called with each buffer once it is written
+        total (int): The total number of bytes that will be written
+        direct (bool): Whether to bypass the page cache with O_DIRECT
+        progress (Optional[Progress]): Called with the target, the bytes written so far and
+            the total after every block
+        offset (int, optional): The position in the target to start writing at.
+            Defaults to 0.
+        regular_file (bool, optional): Whether the target is a regular file, created or
+            truncated as needed, rather than an existing block device. Defaults to False.
+
+    Raises:
+        BaseException: The first error hit while opening, writing or syncing the target,
+            or the error that stopped the reader
+
+    Returns:
+        WriteStats: The number of bytes written and how long it took, including the fsync
+    """
+    flags = os.O_WRONLY
+    if regular_file:
+        # When resuming, the part of the target that has already been written must be kept
+        flags |= os.O_CREAT | (0 if offset else os.O_TRUNC)
+    if direct:
+        flags |= getattr(os, "O_DIRECT", 0)
+    error: Optional[BaseException] = None
+    fd: Optional[int] = None
+    written = 0
+    start = time.monotonic()
+    try:
+        fd = os.open(target, flags, 0o644)
+        # Without O_CREAT a mistyped disk fails to open rather than becoming a file in /dev,
+        # and anything that isn't a disk is refused
+        if not regular_file and not stat.S_ISBLK(os.fstat(fd).st_mode):
+            raise OSError(errno.ENOTBLK, f"{target} is not a block device")
+        os.lseek(fd, offset, os.SEEK_SET)
+    except OSError as e:
+        error = e
+    while True:
+        buffer, n = blocks.get()
+        if buffer is None or isinstance(n, BaseException):
+            error = error or n  # type: ignore
+            break
+        try:
+            if fd is not None and error is None and n:
+                if n % ALIGNMENT and direct:
+                    # The unaligned tail of the image can't be written with O_DIRECT
+                    fcntl.fcntl(fd, fcntl.F_SETFL, flags & ~getattr(os, "O_DIRECT", 0))
+                view = memoryview(buffer)[:n]
+                while view:
+                    view = view[os.write(fd, view) :]
+                written += n
+                if progress is not None:
+                    progress(target, offset + written, total)
+        except Exception as e:
+            # Including errors raised by progress (e.g. cancellation), after which we keep
+            # releasing blocks so the reader and the other targets aren't held up
+            error = e
+        finally:
+            release(buffer)
+        if n == 0:
+            break
+    try:
+        if fd is not None and error is None:
+            os.fsync(fd)
+    except OSError as e:
+        error = e
+    finally:
+        if fd is not None:
+            os.close(fd)
+    if error is not None:
+        raise error
+    return WriteStats(written, time.monotonic() - start)
+
+
+def write_image_to_targets(
+    image: Path,
+    targets: Sequence[Path],
+    block_size: Optional[int] = None,
+    direct: bool = False,
+    progress: Optional[Progress] = None,
+    offset: int = 0,
+    regular_files: bool = False,
+) -> Dict[Path, WriteStats | BaseException]:
+    """Writes an image to several disks (or regular files) at once, reading it only once
+
+    The image is read into a pair of buffers in turn, so reading the next block overlaps
+    with writing the current one, and each block is handed to a writer thread per target.
+    A failing target does not affect the others.
+
+    Args:
+        image (Path): The image to write
+        targets (Sequence[Path]): The disks or files to write to
+        block_size (Optional[int], optional): The size of each write in bytes, which must be a
+            multiple of ALIGNMENT. Defaults to WRITE_BLOCK_SIZE.
+        direct (bool, optional): Whether to bypass the page cache with O_DIRECT.
+            Defaults to False.
+        progress (Optional[Progress], optional): Called with the target, the bytes written so
+            far and the total after every block. Defaults to None.
+        offset (int, optional): The position to resume writing from, which must be a multiple
+            of ALIGNMENT. Defaults to 0.
+        regular_files (bool, optional): Whether the targets are regular files, created or
+            truncated as needed, rather than existing block devices. Defaults to False.
+
+    Raises:
+        ValueError: If the block size or offset is not a multiple of ALIGNMENT
+
+    Returns:
+        Dict[Path, WriteStats | BaseException]: The statistics of each successful write,
+            or the error that stopped it, by target
+    """
+    block_size = config.WRITE_BLOCK_SIZE if block_size is None else block_size
+    if block_size <= 0 or block_size % ALIGNMENT:
+        raise ValueError(f"Block size must be a positive multiple of {ALIGNMENT}")
+    if offset < 0 or offset % ALIGNMENT:
+        raise ValueError(f"Offset must be a multiple of {ALIGNMENT}")
+    total = image.stat().st_size
+    # Anonymous maps are page aligned, as O_DIRECT requires
+    free: Queue[mmap.mmap] = Queue()
+    for _ in range(BUFFERS):
+        free.put(mmap.mmap(-1, block_size))
+    # A buffer can only be refilled once every target has written it
+    users: Dict[int, int] = {}
+    lock = Lock()
+
+    def release(buffer: mmap.mmap) -> None:
+        with lock:
+            users[id(buffer)] -= 1
+            if not users[id(buffer)]:
+                free.put(buffer)
+
+    results: Dict[Path, WriteStats | BaseException] = {}
+    queues: Dict[Path, Queue[Block]] = {target: Queue() for target in targets}
+
+    def writer(target: Path) -> None:
+        try:
+            results[target] = write_blocks(
+                target, queues[target], release, total, direct, progress, offset, regular_files
+            )
+        except BaseException as e:
+            results[target] = e
+
+    threads = [Thread(target=writer, args=(target,), daemon=True) for target in queues]
+    for thread in threads:
+        thread.start()
+    try:
+        with open(image, "rb", buffering=0) as src:
+            src.seek(offset)
+            while True:
+                buffer = free.get()
+                n = fill(src, memoryview(buffer))
+                with lock:
+                    users[id(buffer)] = len(queues)
+                for blocks in queues.values():
+                    blocks.put((buffer, n))
+                if n == 0:
+                    break
+    except OSError as e:
+        for blocks in queues.values():
+            blocks.put((None, e))
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def write_image(
+    image: Path,
+    target: Path,
+    block_size: Optional[int] = None,
+    direct: bool = False,
+    progress: Optional[Callable[[int, int], None]] = None,
+    regular_file: bool = False,
+) -> WriteStats:
+    """Writes an image to a disk (or regular file), double buffering reads against writes
+
+    Args:
+        image (Path): The image to write
+        target (Path): The disk or file to write to
+        block_size (Optional[int], optional): The size of each write in bytes, which must be a
+            multiple of ALIGNMENT. Defaults to WRITE_BLOCK_SIZE.
+        direct (bool, optional): Whether to bypass the page cache with O_DIRECT.
+            Defaults to False.
+        progress (Optional[Callable[[int, int], None]], optional): Called with the bytes
+            written so far and the total after every block. Defaults to None.
+        regular_file (bool, optional): Whether the target is a regular file, created or
+            truncated as needed, rather than an existing block device. Defaults to False.
+
+    Raises:
+        ValueError: If the block size is not a positive multiple of ALIGNMENT
+
+    Returns:
+        WriteStats: The number of bytes written and how long it took, including the fsync
+    """
+    result = write_image_to_targets(
+        image,
+        [target],
+        block_size,
+        direct,
+        None if progress is None else lambda _, done, total: progress(done, total),
+        regular_files=regular_file,
+    )[target]
+    if isinstance(result, BaseException):
+        raise result
+    return result
+
+
+def block_digests(path: Path, length: int, block_size: int) -> Iterator[bytes]:
+    """Hashes the start of a file or disk block by block, bypassing cached pages
+
+    Args:
+        path (Path): The file or disk to hash
+        length (int): The number of bytes to hash
+        block_size (int): The size of each block in bytes
+
+    Yields:
+        Iterator[bytes]: The sha256 digest of each block, ending early if the file does
+    """
+    with open(path, "rb", buffering=0) as f:
+        # Make sure we read back what is actually on the disk, not what we just wrote to it
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, length, os.POSIX_FADV_DONTNEED)
+        view = memoryview(mmap.mmap(-1, block_size))
+        remaining = length
+        while remaining > 0:
+            n = fill(f, view[: min(block_size, remaining)])
+            if not n:
+                return
+            # hashlib releases the GIL for large buffers, so targets can be hashed in parallel
+            yield sha256(view[:n]).digest()
+            remaining -= n
+
+
+def first_mismatch(
+    image_digests: List[bytes], target: Path, block_size: int, length: int
+) -> Optional[int]:
+    """Finds the first block of a target that does not match an image
+
+    Args:
+        image_digests (List[bytes]): The digests of the image's blocks
+        target (Path): The disk or file the image was written to
+        block_size (int): The size of each block in bytes
+        length (int): The size of the image in bytes
+
+    Returns:
+        Optional[int]: The offset of the first mismatched block, or None if the target
+            holds the image
+    """
+    # A disk is usually bigger than the image, so only as much of it as the image covers is
+    # compared, with the same short last block
+    target_digests = block_digests(target, length, block_size)
+    for i, (expected, actual) in enumerate(zip_longest(image_digests, target_digests)):
+        if expected != actual:
+            return i * block_size
+    return None
+
+
+def verify_targets(
+    image: Path, targets: Sequence[Path], block_size: Optional[int] = None
+) -> Dict[Path, Optional[int] | BaseException]:
+    """Reads back an image from the targets it was written to, hashing them in parallel
+
+    Args:
+        image (Path): The image that was written
+        targets (Sequence[Path]): The disks or files it was written to
+        block_size (Optional[int], optional): The size of each block to compare in bytes.
+            Defaults to VERIFY_BLOCK_SIZE.
+
+    Returns:
+        Dict[Path, Optional[int] | BaseException]: The offset of the first mismatched block,
+            None if the target holds the image, or the error that stopped the read, by target
+    """
+    block_size = config.VERIFY_BLOCK_SIZE if block_size is None else block_size
+    length = image.stat().st_size
+    image_digests = list(block_digests(image, length, block_size))
+    results: Dict[Path, Optional[int] | BaseException] = {}
+    with ThreadPoolExecutor(max_workers=max(len(targets), 1)) as executor:
+        futures = {
+            executor.submit(first_mismatch, image_digests, target, block_size, length): target
+            for target in targets
+        }
+        for future in as_completed(futures):
+            error = future.exception()
+            results[futures[future]] = error if error is not None else future.result()
+    return results
+
+
+def write_and_verify(
+    image: Path,
+    targets: Sequence[Path],
+    direct: bool = False,
+    progress: Optional[Progress] = None,
+    retries: Optional[int] = None,
+    regular_files: bool = False,
+) -> Dict[Path, Optional[BaseException]]:
+    """Writes an image to several targets, then reads each back and resumes any bad writes
+
+    A target that does not hold the image after writing is rewritten from its first
+    mismatched block, rather than from the start, until it verifies or runs out of retries.
+
+    Args:
+        image (Path): The image to write
+        targets (Sequence[Path]): The disks or files to write to
+        direct (bool, optional): Whether to bypass the page cache with O_DIRECT.
+            Defaults to False.
+        progress (Optional[Progress], optional): Called with the target, the bytes written so
+            far and the total after every block. Defaults to None.
+        retries (Optional[int], optional): The number of times to resume a bad write.
+            Defaults to WRITE_RETRIES.
+        regular_files (bool, optional): Whether the targets are regular files, created or
+            truncated as needed, rather than existing block devices. Defaults to False.
+
+    Returns:
+        Dict[Path, Optional[BaseException]]: The error that made each failed target fail,
+            or None for each target that holds the image, by target
+    """
+    retries = config.WRITE_RETRIES if retries is None else retries
+    errors: Dict[Path, Optional[BaseException]] = {}
+    pending = {target: 0 for target in targets}
+    for _ in range(retries + 1):
+        # Verified offsets fall on block boundaries, so they are valid offsets to resume from
+        by_offset: Dict[int, List[Path]] = {}
+        for target, offset in pending.items():
+            by_offset.setdefault(offset, []).append(target)
+        for offset, group in by_offset.items():
+            written = write_image_to_targets(
+                image,
+                group,
+                direct=direct,
+                progress=progress,
+                offset=offset,
+                regular_files=regular_files,
+            )
+            for target, result in written.items():
+                errors[target] = result if isinstance(result, BaseException) else None
+        # Only I/O errors are worth verifying and resuming after, not e.g. cancellation or a
+        # target that was refused for not being a disk
+        pending = {
+            target: offset
+            for target, offset in pending.items()
+            if (error := errors[target]) is None
+            or (isinstance(error, OSError) and error.errno != errno.ENOTBLK)
+        }
+        verified = verify_targets(image, list(pending))
+        pending = {}
+        for target, mismatch in verified.items():
+            if isinstance(mismatch, BaseException):
+                errors[target] = errors[target] or mismatch
+            elif mismatch is not None:
+                errors[target] = OSError(
+                    errno.EIO, f"{target} does not match the image from byte {mismatch}"
+                )
+                pending[target] = mismatch
+            else:
+                errors[target] = None
+        if not pending:
+            break
+    return errors
@@ -0,0 +1,505 @@
+from hashlib import sha256
+from math import ceil
+from pathlib import Path, PurePosixPath
+import struct
+from typing import Dict, Iterator, Mapping, Optional, Set, Tuple
+
+
+SECTOR_SIZE: int = 512
+RESERVED_SECTORS: int = 1
+NUM_FATS: int = 2
+ROOT_ENTRIES: int = 512
+MIN_SECTORS: int = 2048  # 1 MiB, small enough to flash instantly but large enough for any config
+MAX_FAT12_CLUSTERS: int = 4084
+DIR_ENTRY_SIZE: int = 32
+# Fixed timestamp (1980-01-01 00:00:00) to keep images byte-for-byte reproducible
+FAT_DATE: int = (0 << 9) | (1 << 5) | 1
+FAT_TIME: int = 0
+
+ATTR_DIRECTORY: int = 0x10
+ATTR_ARCHIVE: int = 0x20
+ATTR_VOLUME_ID: int = 0x08
+ATTR_LONG_NAME: int = 0x0F
+# Windows NT flags indicating that the base name and/or extension should be shown in lowercase
+NT_LOWER_BASE: int = 0x08
+NT_LOWER_EXT: int = 0x10
+
+
+type Tree = Dict[str, "Tree | bytes"]
+
+
+SHORT_NAME_CHARS: str = "_-~!#$%&'()@^`{}"
+
+
+def short_name(name: str) -> Optional[Tuple[bytes, int]]:
+    """Converts a filename to a FAT 8.3 short name, if it can be represented as one
+
+    Args:
+        name (str): The filename to convert
+
+    Returns:
+        Optional[Tuple[bytes, int]]: The padded 11 byte short name and its NT case flags,
+            or None if the name requires a long filename entry
+    """
+    base, _, ext = name.partition(".")
+    if not base or len(base) > 8 or len(ext) > 3 or "." in ext or not name.isascii():
+        return None
+    if not all(c.isalnum() or c in SHORT_NAME_CHARS for c in base + ext):
+        return None
+    flags = 0
+    for part, flag in ((base, NT_LOWER_BASE), (ext, NT_LOWER_EXT)):
+        if part == part.lower() and part != part.upper():
+            flags |= flag
+        elif part != part.upper():
+            return None  # Mixed case can only be preserved by a long filename
+    return (base.upper().ljust(8) + ext.upper().ljust(3)).encode("ascii"), flags
+
+
+def generated_short_name(name: str, taken: Set[bytes]) -> bytes:
+    """Generates a unique "BASENA~N.EXT" style short name for a long filename
+
+    Args:
+        name (str): The long filename
+        taken (Set[bytes]): The short names already used in the directory
+
+    Raises:
+        ValueError: If no unique short name can be generated
+
+    Returns:
+        bytes: The padded 11 byte short name
+    """
+
+    def clean(part: str) -> str:
+        return "".join(
+            c if c.isalnum() or c in SHORT_NAME_CHARS else "_"
+            for c in part.upper().replace(" ", "")
+            if c.isascii()
+        )
+
+    base, _, ext = name.rpartition(".") if "." in name.lstrip(".") else (name, "", "")
+    base, ext = clean(base) or "_", clean(ext)[:3]
+    for n in range(1, 1000000):
+        tail = f"~{n}"
+        candidate = (base[: 8 - len(tail)] + tail).ljust(8) + ext.ljust(3)
+        if candidate.encode("ascii") not in taken:
+            return candidate.encode("ascii")
+    raise ValueError(f"Unable to generate a short name for {name!r}")
+
+
+def lfn_checksum(short: bytes) -> int:
+    """Computes the checksum linking long filename entries to their short name
+
+    Args:
+        short (bytes): The 11 byte short name
+
+    Returns:
+        int: The checksum
+    """
+    checksum = 0
+    for c in short:
+        checksum = (((checksum & 1) << 7) + (checksum >> 1) + c) & 0xFF
+    return checksum
+
+
+def lfn_entries(name: str, short: bytes) -> bytes:
+    """Packs the VFAT long filename entries that precede a short name entry
+
+    Args:
+        name (str): The long filename
+        short (bytes): The 11 byte short name the entries belong to
+
+    Raises:
+        ValueError: If the name is too long for a long filename
+
+    Returns:
+        bytes: The packed long filename entries, in on-disk order
+    """
+    if len(name) > 255:
+        raise ValueError(f"{name!r} is too long for a FAT filename")
+    encoded = name.encode("utf-16-le")
+    chunks = [encoded[i : i + 26] for i in range(0, len(encoded), 26)]
+    if len(chunks[-1]) < 26:
+        chunks[-1] = (chunks[-1] + b"\x00\x00").ljust(26, b"\xff")
+    checksum = lfn_checksum(short)
+    entries = []
+    for seq, chunk in enumerate(chunks, start=1):
+        order = seq | (0x40 if seq == len(chunks) else 0)
+        entries.append(
+            struct.pack(
+                "<B10sBBB12sH4s",
+                order,
+                chunk[:10],
+                ATTR_LONG_NAME,
+                0,
+                checksum,
+                chunk[10:22],
+                0,
+                chunk[22:26],
+            )
+        )
+    return b"".join(reversed(entries))
+
+
+def directory_names(directory: "Tree") -> Dict[str, Tuple[bytes, int, bytes]]:
+    """Assigns short names (and long filename entries where needed) to a directory's children
+
+    Args:
+        directory (Tree): The directory to name the children of
+
+    Returns:
+        Dict[str, Tuple[bytes, int, bytes]]: The short name, NT case flags and packed long
+            filename entries for each child
+    """
+    names: Dict[str, Tuple[bytes, int, bytes]] = {}
+    taken: Set[bytes] = set()
+    for name in directory:
+        short = short_name(name)
+        if short is not None and short[0] not in taken:
+            names[name] = (short[0], short[1], b"")
+            taken.add(short[0])
+    for name in directory:
+        if name not in names:
+            generated = generated_short_name(name, taken)
+            names[name] = (generated, 0, lfn_entries(name, generated))
+            taken.add(generated)
+    return names
+
+
+def dir_entry(name: bytes, attr: int, cluster: int, size: int, nt_flags: int = 0) -> bytes:
+    """Packs a single FAT directory entry
+
+    Args:
+        name (bytes): The 11 byte short name of the entry
+        attr (int): The attribute byte of the entry
+        cluster (int): The first cluster of the entry
+        size (int): The size of the entry in bytes (0 for directories)
+        nt_flags (int, optional): The NT case flags. Defaults to 0.
+
+    Returns:
+        bytes: The packed directory entry
+    """
+    return struct.pack(
+        "<11sBBBHHHHHHHI",
+        name,
+        attr,
+        nt_flags,
+        0,
+        FAT_TIME,
+        FAT_DATE,
+        FAT_DATE,
+        0,
+        FAT_TIME,
+        FAT_DATE,
+        cluster,
+        size,
+    )
+
+
+def build_tree(files: Mapping[str, bytes]) -> Tree:
+    """Builds a nested directory tree from a mapping of posix paths to file contents
+
+    Args:
+        files (Mapping[str, bytes]): The files to place in the tree
+
+    Raises:
+        ValueError: If a path is used as both a file and a directory
+
+    Returns:
+        Tree: The nested directory tree
+    """
+    tree: Tree = {}
+    for path, contents in files.items():
+        *parents, filename = PurePosixPath(path).parts
+        node = tree
+        for part in parents:
+            child = node.setdefault(part, {})
+            if isinstance(child, bytes):
+                raise ValueError(f"{part!r} in {path!r} is already a file")
+            node = child
+        if filename in node:
+            raise ValueError(f"{path!r} is defined more than once")
+        node[filename] = contents
+    return tree
+
+
+def walk_tree(
+    tree: Tree, parent: Tuple[str, ...] = ()
+) -> Iterator[Tuple[Tuple[str, ...], "Tree | bytes"]]:
+    """Walks a directory tree depth first, yielding the path and value of each entry
+
+    Args:
+        tree (Tree): The tree to walk
+        parent (Tuple[str, ...], optional): The path of the tree. Defaults to ().
+
+    Yields:
+        Iterator[Tuple[Tuple[str, ...], Tree | bytes]]: The path and value of each entry
+    """
+    for name, value in tree.items():
+        yield (*parent, name), value
+        if isinstance(value, dict):
+            yield from walk_tree(value, (*parent, name))
+
+
+def build_fat_image(files: Mapping[str, bytes], label: str = "ignition") -> bytes:
+    """Builds a FAT12 filesystem image containing the given files
+
+    Args:
+        files (Mapping[str, bytes]): A mapping of posix paths (e.g. "ignition/config.ign")
+            to file contents
+        label (str, optional): The volume label of the filesystem. Defaults to "ignition".
+
+    Raises:
+        ValueError: If the files do not fit in a FAT12 filesystem
+
+    Returns:
+        bytes: The raw filesystem image
+    """
+    tree = build_tree(files)
+    vol_label = label.upper().encode("ascii")[:11].ljust(11)
+
+    names: Dict[Tuple[str, ...], Dict[str, Tuple[bytes, int, bytes]]] = {(): directory_names(tree)}
+    for path, value in walk_tree(tree):
+        if isinstance(value, dict):
+            names[path] = directory_names(value)
+
+    # First, work out the cluster size and the number of clusters each entry needs
+    def entries_size(path: Tuple[str, ...]) -> int:
+        return sum(DIR_ENTRY_SIZE + len(lfn) for _, _, lfn in names[path].values())
+
+    def sizeof(path: Tuple[str, ...], value: "Tree | bytes") -> int:
+        # Subdirectories hold ".", ".." and their children
+        return len(value) if isinstance(value, bytes) else 2 * DIR_ENTRY_SIZE + entries_size(path)
+
+    if DIR_ENTRY_SIZE + entries_size(()) > ROOT_ENTRIES * DIR_ENTRY_SIZE:
+        raise ValueError("Too many entries in root directory")
+    root_sectors = ceil(ROOT_ENTRIES * DIR_ENTRY_SIZE / SECTOR_SIZE)
+    sectors_per_cluster = 1
+    while True:
+        cluster_size = sectors_per_cluster * SECTOR_SIZE
+        needed = sum(ceil(sizeof(path, value) / cluster_size) for path, value in walk_tree(tree))
+        overhead = RESERVED_SECTORS + root_sectors
+        clusters = max(needed, (MIN_SECTORS - overhead) // sectors_per_cluster)
+        if clusters <= MAX_FAT12_CLUSTERS:
+            break
+        if sectors_per_cluster >= 128:
+            raise ValueError("Files are too large for a FAT12 image")
+        sectors_per_cluster *= 2
+    fat_sectors = ceil(ceil((clusters + 2) * 3 / 2) / SECTOR_SIZE)
+    data_start = RESERVED_SECTORS + NUM_FATS * fat_sectors + root_sectors
+    total_sectors = data_start + clusters * sectors_per_cluster
+
+    # Then, allocate clusters for every entry
+    fat = bytearray(fat_sectors * SECTOR_SIZE)
+
+    def set_fat(n: int, v: int) -> None:
+        off = n * 3 // 2
+        if n % 2 == 0:
+            fat[off] = v & 0xFF
+            fat[off + 1] = (fat[off + 1] & 0xF0) | ((v >> 8) & 0x0F)
+        else:
+            fat[off] = (fat[off] & 0x0F) | ((v << 4) & 0xF0)
+            fat[off + 1] = (v >> 4) & 0xFF
+
+    set_fat(0, 0xF00 | 0xF8)
+    set_fat(1, 0xFFF)
+    first_cluster: Dict[Tuple[str, ...], int] = {}
+    next_cluster = 2
+    for path, value in walk_tree(tree):
+        count = ceil(sizeof(path, value) / cluster_size)
+        if count == 0:
+            continue
+        first_cluster[path] = next_cluster
+        for c in range(next_cluster, next_cluster + count - 1):
+            set_fat(c, c + 1)
+        set_fat(next_cluster + count - 1, 0xFFF)
+        next_cluster += count
+
+    # Now, lay out the image itself
+    image = bytearray(total_sectors * SECTOR_SIZE)
+    serial = int.from_bytes(sha256(repr(sorted(files.items())).encode()).digest()[:4], "little")
+    boot = struct.pack(
+        "<3s8sHBHBHHBHHHIIBBBI11s8s",
+        b"\xeb\x3c\x90",
+        b"mkfs.fat",
+        SECTOR_SIZE,
+        sectors_per_cluster,
+        RESERVED_SECTORS,
+        NUM_FATS,
+        ROOT_ENTRIES,
+        total_sectors if total_sectors < 0x10000 else 0,
+        0xF8,
+        fat_sectors,
+        32,
+        64,
+        0,
+        total_sectors if total_sectors >= 0x10000 else 0,
+        0x80,
+        0,
+        0x29,
+        serial,
+        vol_label,
+        b"FAT12   ",
+    )
+    image[: len(boot)] = boot
+    image[510:512] = b"\x55\xaa"
+    for i in range(NUM_FATS):
+        start = (RESERVED_SECTORS + i * fat_sectors) * SECTOR_SIZE
+        image[start : start + len(fat)] = fat
+
+    def cluster_offset(cluster: int) -> int:
+        return (data_start + (cluster - 2) * sectors_per_cluster) * SECTOR_SIZE
+
+    def dir_entries(directory: Tree, path: Tuple[str, ...]) -> bytes:
+        out = bytearray()
+        for name, value in directory.items():
+            short, flags, lfn = names[path][name]
+            cluster = first_cluster.get((*path, name), 0)
+            out += lfn
+            if isinstance(value, bytes):
+                out += dir_entry(short, ATTR_ARCHIVE, cluster, len(value), flags)
+            else:
+                out += dir_entry(short, ATTR_DIRECTORY, cluster, 0, flags)
+        return bytes(out)
+
+    root = dir_entry(vol_label, ATTR_VOLUME_ID, 0, 0) + dir_entries(tree, ())
+    root_start = (RESERVED_SECTORS + NUM_FATS * fat_sectors) * SECTOR_SIZE
+    image[root_start : root_start + len(root)] = root
+    for path, value in walk_tree(tree):
+        if path not in first_cluster:
+            continue
+        offset = cluster_offset(first_cluster[path])
+        if isinstance(value, bytes):
+            image[offset : offset + len(value)] = value
+        else:
+            # ".." points at cluster 0 when the parent is the root directory
+            parent_cluster = first_cluster.get(path[:-1], 0)
+            contents = (
+                dir_entry(b".          ", ATTR_DIRECTORY, first_cluster[path], 0)
+                + dir_entry(b"..         ", ATTR_DIRECTORY, parent_cluster, 0)
+                + dir_entries(value, path)
+            )
+            image[offset : offset + len(contents)] = contents
+    return bytes(image)
+
+
+def write_fat_image(path: Path, files: Mapping[str, bytes], label: str = "ignition") -> None:
+    """Writes a FAT12 filesystem image containing the given files
+
+    Args:
+        path (Path): The path to write the image to
+        files (Mapping[str, bytes]): A mapping of posix paths to file contents
+        label (str, optional): The volume label of the filesystem. Defaults to "ignition".
+    """
+    Path(path).write_bytes(build_fat_image(files, label))
+
+
+def parse_dir_entries(data: bytes) -> Iterator[Tuple[str, int, int, int]]:
+    """Parses the entries of a FAT directory, resolving long filenames
+
+    Args:
+        data (bytes): The raw contents of the directory
+
+    Yields:
+        Iterator[Tuple[str, int, int, int]]: The name, attributes, first cluster and size
+            of each entry
+    """
+    lfn_parts: Dict[int, str] = {}
+    for offset in range(0, len(data) - DIR_ENTRY_SIZE + 1, DIR_ENTRY_SIZE):
+        entry = data[offset : offset + DIR_ENTRY_SIZE]
+        if entry[0] == 0x00:
+            return
+        if entry[0] == 0xE5:
+            lfn_parts.clear()
+            continue
+        attr = entry[11]
+        if attr == ATTR_LONG_NAME:
+            chars = entry[1:11] + entry[14:26] + entry[28:32]
+            lfn_parts[entry[0] & 0x1F] = chars.decode("utf-16-le")
+            continue
+        if attr & ATTR_VOLUME_ID:
+            lfn_parts.clear()
+            continue
+        if lfn_parts:
+            name = "".join(lfn_parts[i] for i in sorted(lfn_parts))
+            name = name.split("\x00")[0]
+            lfn_parts.clear()
+        else:
+            raw = bytes([0xE5]) + entry[1:11] if entry[0] == 0x05 else entry[:11]
+            base = raw[:8].decode("latin-1").rstrip()
+            ext = raw[8:11].decode("latin-1").rstrip()
+            if entry[12] & NT_LOWER_BASE:
+                base = base.lower()
+            if entry[12] & NT_LOWER_EXT:
+                ext = ext.lower()
+            name = f"{base}.{ext}" if ext else base
+        if name in (".", ".."):
+            continue
+        high = struct.unpack_from("<H", entry, 20)[0]
+        low, size = struct.unpack_from("<HI", entry, 26)
+        yield name, attr, high << 16 | low, size
+
+
+def read_fat_file(image: bytes, path: str) -> bytes:
+    """Reads a file from a FAT12, FAT16 or FAT32 filesystem image
+
+    Args:
+        image (bytes): The raw filesystem image
+        path (str): The posix path of the file to read (matched case-insensitively)
+
+    Raises:
+        FileNotFoundError: If the file does not exist in the image
+
+    Returns:
+        bytes: The contents of the file
+    """
+    bytes_per_sector, sectors_per_cluster, reserved, num_fats, root_entries, total_16 = (
+        struct.unpack_from("<HBHBHH", image, 11)
+    )
+    fat_size = struct.unpack_from("<H", image, 22)[0] or struct.unpack_from("<I", image, 36)[0]
+    total_sectors = total_16 or struct.unpack_from("<I", image, 32)[0]
+    root_start = (reserved + num_fats * fat_size) * bytes_per_sector
+    data_start = root_start + ceil(root_entries * DIR_ENTRY_SIZE / bytes_per_sector) * (
+        bytes_per_sector
+    )
+    cluster_size = sectors_per_cluster * bytes_per_sector
+    clusters = (total_sectors * bytes_per_sector - data_start) // cluster_size
+    fat_offset = reserved * bytes_per_sector
+    fat_bits = 12 if clusters <= MAX_FAT12_CLUSTERS else 16 if clusters < 65525 else 32
+
+    def next_cluster(cluster: int) -> int:
+        match fat_bits:
+            case 12:
+                value = struct.unpack_from("<H", image, fat_offset + cluster * 3 // 2)[0]
+                return (value >> 4) if cluster & 1 else (value & 0xFFF)
+            case 16:
+                return struct.unpack_from("<H", image, fat_offset + cluster * 2)[0]
+            case _:
+                return struct.unpack_from("<I", image, fat_offset + cluster * 4)[0] & 0x0FFFFFFF
+
+    def read_chain(cluster: int) -> bytes:
+        end_of_chain = (1 << fat_bits) - 8 if fat_bits < 32 else 0x0FFFFFF8
+        chunks = []
+        seen = set()
+        while 2 <= cluster < end_of_chain and cluster not in seen:
+            seen.add(cluster)
+            offset = data_start + (cluster - 2) * cluster_size
+            chunks.append(image[offset : offset + cluster_size])
+            cluster = next_cluster(cluster)
+        return b"".join(chunks)
+
+    if fat_bits == 32:
+        directory = read_chain(struct.unpack_from("<I", image, 44)[0])
+    else:
+        directory = image[root_start : root_start + root_entries * DIR_ENTRY_SIZE]
+    *parents, filename = PurePosixPath(path).parts
+    for part in parents:
+        for name, attr, cluster, _ in parse_dir_entries(directory):
+            if name.lower() == part.lower() and attr & ATTR_DIRECTORY:
+                directory = read_chain(cluster)
+                break
+        else:
+            raise FileNotFoundError(path)
+    for name, attr, cluster, size in parse_dir_entries(directory):
+        if name.lower() == filename.lower() and not attr & ATTR_DIRECTORY:
+            return read_chain(cluster)[:size]
+    raise FileNotFoundError(path)
@@ -0,0 +1,156 @@
+import json
+from pathlib import Path
+import time
+from typing import Optional
+
+import git
+import typer
+
+from .config import config
+
+
+SOURCE_MODES: tuple[str, ...] = ("track", "pinned", "offline")
+
+
+def state_path() -> Path:
+    """Returns the path of the file recording when the fuel-ignition source was last updated
+
+    Returns:
+        Path: The path to the source state file
+    """
+    return config.BUILD_DIR / "fuelignition_source.json"
+
+
+def load_state() -> dict:
+    """Loads the record of the last update of the fuel-ignition source, if it was updated
+    from the same repository and ref as are configured now
+
+    Returns:
+        dict: When the source was last updated and the commit it was updated to, or an
+            empty dict if it hasn't been updated from the configured repository and ref
+    """
+    try:
+        with open(state_path(), "r") as f:
+            state = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    if state.get("repo") != config.FUELIGNITION_REPO or state.get("ref") != config.FUELIGNITION_REF:
+        return {}
+    return state
+
+
+def record_update(commit: str) -> None:
+    """Records that the fuel-ignition source has just been updated
+
+    Args:
+        commit (str): The SHA of the commit the source was updated to
+    """
+    state_path().parent.mkdir(exist_ok=True, parents=True)
+    with open(state_path(), "w") as f:
+        json.dump(
+            {
+                "repo": config.FUELIGNITION_REPO,
+                "ref": config.FUELIGNITION_REF,
+                "commit": commit,
+                "checked": time.time(),
+            },
+            f,
+        )
+
+
+def local_commit(repo: git.Repo, ref: str) -> Optional[str]:
+    """Resolves a ref to a commit without touching the network
+
+    Args:
+        repo (git.Repo): The local checkout
+        ref (str): The branch, tag or commit to resolve
+
+    Returns:
+        Optional[str]: The commit SHA, or None if the ref isn't in the local checkout
+    """
+    try:
+        return repo.git.rev_parse("--verify", "--quiet", f"{ref}^{{commit}}")
+    except git.GitCommandError:
+        return None
+
+
+def open_checkout() -> git.Repo:
+    """Opens the local fuel-ignition checkout, creating an empty one if there isn't one
+
+    Returns:
+        git.Repo: The local checkout, with its origin set to FUELIGNITION_REPO
+    """
+    build_dir = config.FUELIGNITION_BUILD_DIR
+    if build_dir.exists() and any(build_dir.iterdir()):
+        repo = git.Repo(build_dir)
+    else:
+        repo = git.Repo.init(build_dir)
+    if "origin" not in repo.remotes:
+        repo.create_remote("origin", config.FUELIGNITION_REPO)
+    elif repo.remotes.origin.url != config.FUELIGNITION_REPO:
+        repo.remotes.origin.set_url(config.FUELIGNITION_REPO)
+    return repo
+
+
+def fetch(repo: git.Repo, ref: str) -> None:
+    """Fetches a ref from the fuel-ignition repository and checks it out
+
+    Args:
+        repo (git.Repo): The local checkout
+        ref (str): The branch, tag or commit to fetch
+    """
+    # Only the ref is fetched, and with FUELIGNITION_SHALLOW only its latest commit, which
+    # is all that's needed to build the image
+    repo.git.fetch("origin", ref, depth=1 if config.FUELIGNITION_SHALLOW else None)
+    repo.git.checkout("--force", "--detach", "FETCH_HEAD")
+
+
+def update_source() -> str:
+    """Makes sure the local fuel-ignition checkout is at the configured revision, only going
+    to the network when it has to
+
+    How the checkout is kept up to date depends on FUELIGNITION_SOURCE_MODE:
+
+    - "track" follows the FUELIGNITION_REF branch, fetching it at most once every
+      FUELIGNITION_UPDATE_TTL seconds, and falls back on the local checkout when offline.
+    - "pinned" checks out the FUELIGNITION_REF tag or commit, only fetching it if it isn't
+      in the local checkout already.
+    - "offline" uses the local checkout as it is, and never goes to the network.
+
+    Raises:
+        ValueError: If the source mode is unknown
+        RuntimeError: If there is no local checkout to use offline, or the configured
+            revision can't be fetched and there is no local checkout to fall back on
+
+    Returns:
+        str: The SHA of the checked out commit
+    """
+    mode, ref = config.FUELIGNITION_SOURCE_MODE, config.FUELIGNITION_REF
+    if mode not in SOURCE_MODES:
+        raise ValueError(f"Unknown fuel-ignition source mode: {mode}")
+    build_dir = config.FUELIGNITION_BUILD_DIR
+    if mode == "offline":
+        if not (build_dir / ".git").exists():
+            raise RuntimeError(f"No fuel-ignition checkout at {build_dir} to use offline")
+        return git.Repo(build_dir).head.commit.hexsha
+    repo = open_checkout()
+    head = repo.head.commit.hexsha if repo.head.is_valid() else None
+    state = load_state()
+    if head is not None and state.get("commit") == head:
+        # A pinned ref always names the same commit, so once checked out it never changes
+        if mode == "pinned" or time.time() - state["checked"] < config.FUELIGNITION_UPDATE_TTL:
+            return head
+    if mode == "pinned" and (pinned := local_commit(repo, ref)) is not None:
+        repo.git.checkout("--force", "--detach", pinned)
+    else:
+        try:
+            fetch(repo, ref)
+        except git.GitCommandError as e:
+            if head is None or mode == "pinned":
+                raise RuntimeError(f"Could not fetch fuel-ignition {ref}: {e.stderr.strip()}")
+            typer.echo(
+                f"Could not update fuel-ignition, using the local checkout: {e.stderr.strip()}"
+            )
+            return head
+    record_update(repo.head.commit.hexsha)
+    return repo.head.commit.hexsha
@@ -0,0 +1,42 @@
+import json
+from pathlib import Path
+
+from .config import config
+from .fat import build_fat_image
+from .translator import combustion_script, fuelignition_to_ignition
+
+
+IMAGE_LABEL: str = "ignition"
+CONFIG_PATH: str = "ignition/config.ign"
+COMBUSTION_PATH: str = "combustion/script"
+
+
+def render_image(fuelignition: dict) -> bytes:
+    """Renders a fuel-ignition json configuration to an ignition disk image
+
+    Args:
+        fuelignition (dict): The fuel-ignition configuration
+
+    Returns:
+        bytes: The raw ignition disk image
+    """
+    files = {
+        CONFIG_PATH: json.dumps(fuelignition_to_ignition(fuelignition), indent=2).encode(),
+    }
+    script = combustion_script(fuelignition)
+    if script is not None:
+        files[COMBUSTION_PATH] = script.encode()
+    return build_fat_image(files, label=IMAGE_LABEL)
+
+
+def json_to_img(json_path: Path, img_path: Path) -> None:
+    """Converts a fuel-ignition json file to an ignition disk image file in-process
+
+    Args:
+        json_path (Path): The path to the fuel-ignition json file
+        img_path (Path): The path to the output ignition disk image file
+    """
+    with open(json_path, "r") as f:
+        fuelignition = json.load(f)
+    host_image_path = config.PROJECT_ROOT / img_path
+    host_image_path.write_bytes(render_image(fuelignition))
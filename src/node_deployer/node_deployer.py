@@ -1,28 +1,144 @@
 #!/usr/bin/env python
 
-from typing import Any, Dict
+import ast
+from functools import cache
+from importlib import import_module
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
+import click
 import typer
+from typer.core import TyperGroup
 
-from .autoignition import json_to_img
 from .config import config
-from .create_disk import create_ignition_disk
-from .create_img import create_img
 
 
 cmd_params: Dict[Any, Any] = config.typer
 
+# Commands are registered by the module and attribute defining them rather than imported
+# up front, so a command's module (and everything it imports) only loads when it is run
+COMMANDS: Dict[str, Tuple[str, str]] = {
+    "create-ignition-disk": ("create_disk", "create_ignition_disk"),
+    "create-batch": ("batch", "create_batch"),
+    "create-img": ("create_img", "create_img"),
+    "json-to-img": ("autoignition", "json_to_img"),
+    "json-to-ign": ("translator", "json_to_ign"),
+    "cache": ("cache", "app"),
+    "pool": ("pool", "app"),
+    "serve": ("serve", "serve"),
+}
+
+
+def help_from_doc(doc: Optional[str]) -> str:
+    """Gets a command's help text from its docstring
+
+    Args:
+        doc (Optional[str]): The docstring of the command's function
+
+    Returns:
+        str: The docstring up to its arguments section
+    """
+    return str(doc).split("Args:")[0].strip()
+
+
+@cache
+def command_help(module: str, attr: str) -> str:
+    """Reads a command's help text from the source of its module, without importing it
+
+    Args:
+        module (str): The module defining the command
+        attr (str): The command's function, or the typer app of a command group
+
+    Returns:
+        str: The command's help text
+    """
+    tree = ast.parse((Path(__file__).parent / f"{module}.py").read_text())
+    for node in tree.body:
+        if isinstance(node, ast.FunctionDef) and node.name == attr:
+            return help_from_doc(ast.get_docstring(node))
+        if (
+            isinstance(node, ast.Assign)
+            and any(isinstance(t, ast.Name) and t.id == attr for t in node.targets)
+            and isinstance(node.value, ast.Call)
+        ):
+            for keyword in node.value.keywords:
+                if keyword.arg == "help":
+                    return ast.literal_eval(keyword.value)
+    return ""
+
+
+def debug_by_default(f: Callable) -> None:
+    """Sets the default value of a command's debug flag (its last parameter) to True
+
+    Args:
+        f (Callable): The command function, possibly wrapped by decorators
+    """
+    while hasattr(f, "__wrapped__"):
+        f = f.__wrapped__
+    defaults = list(f.__defaults__)  # type: ignore
+    defaults[-1] = True
+    f.__defaults__ = tuple(defaults)  # type: ignore
+
+
+def load_command(name: str) -> click.Command:
+    """Imports a command's module and builds the click command for it
+
+    Args:
+        name (str): The name of the command
+
+    Returns:
+        click.Command: The command
+    """
+    module, attr = COMMANDS[name]
+    obj = getattr(import_module(f".{module}", __package__), attr)
+    if isinstance(obj, typer.Typer):
+        command: click.Command = typer.main.get_group(obj)
+    else:
+        if config.DEBUG:
+            debug_by_default(obj)
+        command_app = typer.Typer(add_completion=False, **cmd_params)
+        command_app.command(name=name, help=help_from_doc(obj.__doc__), **cmd_params)(obj)
+        command = typer.main.get_command(command_app)
+    command.name = name
+    return command
+
+
+class LazyGroup(TyperGroup):
+    """A command group that loads its commands only when they are run
+
+    Listing the commands (for help or shell completion) only needs their names and help
+    text, so until a command is run it is stood in for by a stub carrying just those.
+    """
+
+    def list_commands(self, ctx: click.Context) -> List[str]:
+        return sorted({*COMMANDS, *self.commands})
+
+    def get_command(self, ctx: click.Context, cmd_name: str) -> Optional[click.Command]:
+        if cmd_name in self.commands or cmd_name not in COMMANDS:
+            return super().get_command(ctx, cmd_name)
+        return click.Command(cmd_name, help=command_help(*COMMANDS[cmd_name]))
+
+    def resolve_command(
+        self, ctx: click.Context, args: List[str]
+    ) -> Tuple[Optional[str], Optional[click.Command], List[str]]:
+        cmd_name = click.utils.make_str(args[0]) if args else None
+        if cmd_name in COMMANDS and cmd_name not in self.commands:
+            self.add_command(load_command(cmd_name))
+        return super().resolve_command(ctx, args)
+
+
 app = typer.Typer(
+    cls=LazyGroup,
     help="A tool for creating ignition images for automated deployment to a swarm",
     **cmd_params,
 )
 
-# Register commands
-app.command(help=str(create_ignition_disk.__doc__).split("Args:")[0].strip(), **cmd_params)(
-    create_ignition_disk
-)
-app.command(help=str(create_img.__doc__).split("Args:")[0].strip(), **cmd_params)(create_img)
-app.command(help=str(json_to_img.__doc__).split("Args:")[0].strip(), **cmd_params)(json_to_img)
+
+@app.callback()
+def callback() -> None:
+    # The commands are all loaded by LazyGroup, so the app needs a callback to be a group
+    pass
+
 
 if __name__ == "__main__":
     config.update_config("cli")
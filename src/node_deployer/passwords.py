@@ -0,0 +1,119 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+from threading import Lock
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import bcrypt
+
+from .config import config
+
+
+SALT_POLICIES: Tuple[str, ...] = ("shared", "unique")
+
+# The hashes of passwords already hashed in this process, by password and cost
+hashes: Dict[Tuple[str, int], str] = {}
+hashes_lock = Lock()
+
+
+def hash_password(password: str, cost: Optional[int] = None) -> str:
+    """Hashes a password with bcrypt and a random salt
+
+    Args:
+        password (str): The password to hash
+        cost (Optional[int], optional): The bcrypt cost factor, the log2 of the number of
+            rounds. Defaults to PASSWORD_HASH_COST.
+
+    Raises:
+        ValueError: If the cost factor is outside of bcrypt's range (4 to 31)
+
+    Returns:
+        str: The hashed password
+    """
+    cost = config.PASSWORD_HASH_COST if cost is None else cost
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=cost)).decode()
+
+
+def salt_policy(policy: Optional[str] = None) -> str:
+    """Checks a salt policy is known, falling back to the configured one
+
+    Args:
+        policy (Optional[str], optional): The salt policy: "shared" to hash each password
+            once and share its hash between nodes, or "unique" to give every node its own
+            salt. Defaults to PASSWORD_SALT_POLICY.
+
+    Raises:
+        ValueError: If the salt policy is unknown
+
+    Returns:
+        str: The salt policy
+    """
+    policy = config.PASSWORD_SALT_POLICY if policy is None else policy
+    if policy not in SALT_POLICIES:
+        raise ValueError(f"Unknown password salt policy: {policy}")
+    return policy
+
+
+def cached_hash(password: str, cost: Optional[int] = None, policy: Optional[str] = None) -> str:
+    """Hashes a password, reusing its earlier hash if the salt policy shares hashes
+
+    Args:
+        password (str): The password to hash
+        cost (Optional[int], optional): The bcrypt cost factor.
+            Defaults to PASSWORD_HASH_COST.
+        policy (Optional[str], optional): The salt policy.
+            Defaults to PASSWORD_SALT_POLICY.
+
+    Returns:
+        str: The hashed password
+    """
+    return hash_passwords([password], cost, policy, workers=1)[0]
+
+
+def hash_passwords(
+    passwords: Sequence[str],
+    cost: Optional[int] = None,
+    policy: Optional[str] = None,
+    workers: Optional[int] = None,
+) -> List[str]:
+    """Hashes many passwords at once, spread across a pool of processes
+
+    Under the "shared" salt policy each distinct password is only hashed once, ever, in
+    this process, so a fleet sharing a password costs a single hash.
+
+    Args:
+        passwords (Sequence[str]): The passwords to hash
+        cost (Optional[int], optional): The bcrypt cost factor.
+            Defaults to PASSWORD_HASH_COST.
+        policy (Optional[str], optional): The salt policy.
+            Defaults to PASSWORD_SALT_POLICY.
+        workers (Optional[int], optional): The most processes to hash with.
+            Defaults to PASSWORD_HASH_WORKERS, or one per CPU if that is 0.
+
+    Returns:
+        List[str]: The hash of each password, in the same order
+    """
+    cost = config.PASSWORD_HASH_COST if cost is None else cost
+    shared = salt_policy(policy) == "shared"
+    workers = workers or config.PASSWORD_HASH_WORKERS or os.cpu_count() or 1
+    with hashes_lock:
+        if shared:
+            pending = list(dict.fromkeys(p for p in passwords if (p, cost) not in hashes))
+        else:
+            pending = list(passwords)
+    if len(pending) > 1 and workers > 1:
+        # bcrypt is CPU bound, so each hash gets its own process. Forking a process with
+        # threads running (e.g. the progress display's) isn't safe, so workers are spawned
+        with ProcessPoolExecutor(
+            max_workers=min(workers, len(pending)),
+            mp_context=multiprocessing.get_context("spawn"),
+        ) as executor:
+            computed = list(executor.map(hash_password, pending, [cost] * len(pending)))
+    else:
+        computed = [hash_password(password, cost) for password in pending]
+    if not shared:
+        return computed
+    with hashes_lock:
+        for password, hashed in zip(pending, computed):
+            hashes.setdefault((password, cost), hashed)
+        return [hashes[(password, cost)] for password in passwords]
@@ -0,0 +1,376 @@
+from contextlib import contextmanager
+import fcntl
+import json
+import os
+from pathlib import Path
+import subprocess
+import sys
+import time
+from typing import Iterator, Optional, Tuple, TypedDict
+
+import docker
+import requests
+from selenium import webdriver
+import typer
+
+from .autoignition import (
+    create_driver,
+    run_fuelignition,
+    run_selenium,
+    selenium_environment,
+    stop_containers,
+)
+from .cli import cli_spinner
+from .config import config
+from .utils import ensure_build_dir, next_free_tcp_port, release_tcp_port
+
+
+# How long the reaper waits before checking again on a pool that is in use, in seconds
+REAP_RETRY_INTERVAL: float = 60
+
+
+class PoolState(TypedDict):
+    selenium_container: str
+    fuelignition_container: str
+    fuelignition_image: str
+    driver_port: int
+    session_id: str
+    max_sessions: int
+    last_used: float
+
+
+class AttachedRemote(webdriver.Remote):
+    """A selenium webdriver that attaches to an existing session instead of creating one"""
+
+    def __init__(self, command_executor: str, session_id: str) -> None:
+        """Initialises the webdriver, attaching it to the specified session
+
+        Args:
+            command_executor (str): The URL of the selenium server
+            session_id (str): The ID of the session to attach to
+        """
+        self._attach_session_id = session_id
+        super().__init__(command_executor, options=webdriver.FirefoxOptions())
+
+    def start_session(self, capabilities: dict) -> None:
+        """Attaches to the existing session rather than starting a new one
+
+        Args:
+            capabilities (dict): The requested capabilities (unused)
+        """
+        self.session_id = self._attach_session_id
+        self.caps = capabilities
+
+
+app = typer.Typer(
+    help="Manage a warm pool of conversion containers shared across invocations",
+    **config.typer,
+)
+
+
+def state_path() -> Path:
+    """Returns the path of the file recording the state of the pool
+
+    Returns:
+        Path: The path to the pool state file
+    """
+    return config.BUILD_DIR / config.POOL_STATE_FILE
+
+
+def load_state() -> Optional[PoolState]:
+    """Loads the state of the pool, if one has been started
+
+    Returns:
+        Optional[PoolState]: The state of the pool, or None if no pool has been started
+    """
+    try:
+        with open(state_path(), "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+@contextmanager
+def lease(blocking: bool = True) -> Iterator[bool]:
+    """Takes the lease on the pool, so that only one invocation uses its browser session and
+    download directories at a time
+
+    Args:
+        blocking (bool, optional): Whether to wait for the lease if another invocation holds
+            it. Defaults to True.
+
+    Yields:
+        Iterator[bool]: Whether the lease was taken, which it always is when blocking
+    """
+    path = config.BUILD_DIR / config.POOL_LOCK_FILE
+    path.parent.mkdir(exist_ok=True, parents=True)
+    with open(path, "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def save_state(state: PoolState) -> None:
+    """Saves the state of the pool
+
+    Args:
+        state (PoolState): The state to save
+    """
+    with open(state_path(), "w") as f:
+        json.dump(state, f, indent=4)
+
+
+def touch() -> None:
+    """Marks the pool as used, resetting its idle timeout"""
+    state = load_state()
+    if state is not None:
+        state["last_used"] = time.time()
+        save_state(state)
+
+
+def idle_time(state: PoolState) -> float:
+    """Returns how long the pool has been idle for
+
+    Args:
+        state (PoolState): The state of the pool
+
+    Returns:
+        float: The number of seconds since the pool was last used
+    """
+    return time.time() - state["last_used"]
+
+
+def healthy(state: PoolState) -> bool:
+    """Checks that the pool's containers are running and its browser session is alive
+
+    Args:
+        state (PoolState): The state of the pool
+
+    Returns:
+        bool: Whether the pool is healthy
+    """
+    try:
+        for container_id in (state["selenium_container"], state["fuelignition_container"]):
+            if config.CLIENT.containers.get(container_id).status != "running":
+                return False
+        response = requests.get(
+            f"http://127.0.0.1:{state['driver_port']}/session/{state['session_id']}/url",
+            timeout=5,
+        )
+        return response.ok
+    except (docker.errors.NotFound, requests.RequestException):  # type: ignore
+        return False
+
+
+def shutdown(state: PoolState) -> None:
+    """Closes the pool's browser session, stops its containers, releases its port and
+    forgets its state
+
+    Args:
+        state (PoolState): The state of the pool
+    """
+    try:
+        requests.delete(
+            f"http://127.0.0.1:{state['driver_port']}/session/{state['session_id']}",
+            timeout=5,
+        )
+    except requests.RequestException:
+        pass
+
+    def get(collection, id):
+        try:
+            return collection.get(id)
+        except docker.errors.NotFound:  # type: ignore
+            return None
+
+    stop_containers(
+        get(config.CLIENT.containers, state["selenium_container"]),
+        get(config.CLIENT.containers, state["fuelignition_container"]),
+        get(config.CLIENT.images, state["fuelignition_image"]),
+    )
+    release_tcp_port(state["driver_port"])
+    state_path().unlink(missing_ok=True)
+
+
+@contextmanager
+def attach() -> Iterator[
+    Optional[Tuple[docker.models.containers.Container, webdriver.Remote, PoolState]]  # type: ignore
+]:
+    """Attaches to the warm pool if one is running, healthy, has not idled out and is not in
+    use by another invocation, holding the lease on it until detached
+
+    Yields:
+        Iterator[Optional[Tuple[docker.models.containers.Container, webdriver.Remote, PoolState]]]:
+            The pool's selenium container, a webdriver attached to its session and its
+            state, or None if no usable pool is available
+    """
+    if load_state() is None:
+        yield None
+        return
+    # An invocation finding the pool busy starts its own containers rather than waiting
+    with lease(blocking=False) as leased:
+        state = load_state() if leased else None
+        if state is not None and (
+            idle_time(state) > config.POOL_IDLE_TIMEOUT or not healthy(state)
+        ):
+            shutdown(state)
+            state = None
+        if state is None:
+            yield None
+            return
+        driver = AttachedRemote(f"http://127.0.0.1:{state['driver_port']}", state["session_id"])
+        try:
+            yield config.CLIENT.containers.get(state["selenium_container"]), driver, state
+        finally:
+            # A failed conversion still used the pool, so it must not be reaped from under
+            # a retry
+            touch()
+
+
+def spawn_reaper(selenium_container: str) -> None:
+    """Starts a process in the background that stops the pool once it has idled out
+
+    Args:
+        selenium_container (str): The ID of the pool's selenium container
+    """
+    subprocess.Popen(
+        [sys.executable, "-m", "node_deployer.pool", "reap", selenium_container],
+        cwd=config.PROJECT_ROOT,
+        env={**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)},
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        # The reaper must outlive the invocation that started the pool
+        start_new_session=True,
+    )
+
+
+@app.command(help="Start a warm pool of conversion containers")
+@cli_spinner(description="Starting conversion pool", total=None)
+@ensure_build_dir
+def start() -> None:
+    """Starts a warm pool of conversion containers with the fuel-ignition page loaded"""
+    # The lease is held until the new pool is saved, so concurrent starts can't both find
+    # no pool and each start one
+    with lease():
+        state = load_state()
+        if state is not None:
+            if healthy(state) and idle_time(state) <= config.POOL_IDLE_TIMEOUT:
+                typer.echo("Conversion pool is already running")
+                return
+            shutdown(state)
+        selenium_container = None
+        fuelignition_container = None
+        fuelignition_image = None
+        driver_port = None
+        try:
+            driver_port = next_free_tcp_port(4444)
+            # The browser session must outlive individual invocations, so we
+            # let it idle for as long as the pool itself is allowed to
+            selenium_container = run_selenium(
+                driver_port,
+                environment={
+                    "SE_NODE_SESSION_TIMEOUT": str(config.POOL_IDLE_TIMEOUT),
+                    **selenium_environment(config.MAX_CONVERSION_SESSIONS),
+                },
+            )
+            fuelignition_container, fuelignition_image = run_fuelignition(selenium_container)
+            driver = create_driver(driver_port)
+            driver.get(config.FUELIGNITION_URL)
+            if driver.session_id is None:
+                raise RuntimeError("The browser session failed to start")
+        except Exception as e:
+            stop_containers(selenium_container, fuelignition_container, fuelignition_image)
+            if driver_port is not None:
+                release_tcp_port(driver_port)
+            raise e
+        save_state(
+            {
+                "selenium_container": selenium_container.id,
+                "fuelignition_container": fuelignition_container.id,
+                "fuelignition_image": fuelignition_image.id,
+                "driver_port": driver_port,
+                "session_id": driver.session_id,
+                "max_sessions": config.MAX_CONVERSION_SESSIONS,
+                "last_used": time.time(),
+            }
+        )
+    spawn_reaper(selenium_container.id)
+    typer.echo(f"Conversion pool started on port {driver_port}")
+
+
+@app.command(help="Stop the warm pool of conversion containers")
+@cli_spinner(description="Stopping conversion pool", total=None)
+def stop() -> None:
+    """Stops the warm pool of conversion containers"""
+    # Wait for any invocation using the pool to finish with it
+    with lease():
+        state = load_state()
+        if state is None:
+            typer.echo("No conversion pool is running")
+            return
+        shutdown(state)
+    typer.echo("Conversion pool stopped")
+
+
+@app.command(help="Show the status of the warm pool of conversion containers")
+def status() -> None:
+    """Shows the status of the warm pool, stopping it if it has idled out or is unhealthy"""
+    state = load_state()
+    if state is None:
+        typer.echo("No conversion pool is running")
+        return
+    with lease(blocking=False) as leased:
+        if not leased:
+            typer.echo(f"Conversion pool running on port {state['driver_port']}, in use")
+            return
+        idle = idle_time(state)
+        if idle > config.POOL_IDLE_TIMEOUT:
+            shutdown(state)
+            typer.echo(f"Conversion pool idled out after {idle:.0f}s and has been stopped")
+        elif not healthy(state):
+            shutdown(state)
+            typer.echo("Conversion pool was unhealthy and has been stopped")
+        else:
+            typer.echo(
+                f"Conversion pool running on port {state['driver_port']}, idle for {idle:.0f}s "
+                f"(timeout {config.POOL_IDLE_TIMEOUT}s)"
+            )
+
+
+@app.command(hidden=True)
+def reap(selenium_container: str) -> None:
+    """Waits for the pool to idle out and stops it, exiting early if the pool is stopped or
+    replaced by another
+
+    Args:
+        selenium_container (str): The ID of the selenium container of the pool to reap
+    """
+    while (state := load_state()) is not None and state["selenium_container"] == (
+        selenium_container
+    ):
+        remaining = config.POOL_IDLE_TIMEOUT - idle_time(state)
+        if remaining <= 0:
+            # A pool in use is not idle, however long ago it was last used
+            with lease(blocking=False) as leased:
+                state = load_state() if leased else None
+                if (
+                    state is not None
+                    and state["selenium_container"] == selenium_container
+                    and idle_time(state) > config.POOL_IDLE_TIMEOUT
+                ):
+                    shutdown(state)
+                    return
+            remaining = REAP_RETRY_INTERVAL
+        time.sleep(remaining)
+
+
+if __name__ == "__main__":
+    config.update_config("cli")
+    app()
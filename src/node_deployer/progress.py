@@ -0,0 +1,188 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+import threading
+import time
+from typing import Callable, Iterator, List, NamedTuple, Optional
+
+
+class Event(NamedTuple):
+    """A progress event published by a stage of the pipeline"""
+
+    kind: str  # "start", "update" or "end"
+    job: str
+    stage: str
+    done: Optional[int] = None
+    total: Optional[int] = None
+    unit: str = "bytes"
+    error: Optional[str] = None
+    time: float = 0.0
+
+    @property
+    def fraction(self) -> Optional[float]:
+        """The fraction of the stage that is complete, if known"""
+        if self.done is None or not self.total:
+            return None
+        return min(self.done / self.total, 1.0)
+
+
+class Cancelled(Exception):
+    """Raised by the stages of a pipeline once it has been cancelled"""
+
+    pass
+
+
+type Subscriber = Callable[[Event], None]
+type Update = Callable[..., None]
+
+
+subscribers: List[Subscriber] = []
+subscribers_lock = threading.Lock()
+# The job stages belong to when no job is given, e.g. the node being provisioned
+current_job: ContextVar[str] = ContextVar("current_job", default="")
+# Set to cancel the stages started in this context
+cancel_event: ContextVar[Optional[threading.Event]] = ContextVar("cancel_event", default=None)
+
+
+def subscribe(subscriber: Subscriber) -> Callable[[], None]:
+    """Subscribes to the progress events published from any thread
+
+    Subscribers are called from the thread that published the event, so must be thread
+    safe and quick to return.
+
+    Args:
+        subscriber (Subscriber): The function to call with each event
+
+    Returns:
+        Callable[[], None]: A function that unsubscribes the subscriber
+    """
+    with subscribers_lock:
+        subscribers.append(subscriber)
+
+    def unsubscribe() -> None:
+        with subscribers_lock:
+            if subscriber in subscribers:
+                subscribers.remove(subscriber)
+
+    return unsubscribe
+
+
+def publish(event: Event) -> None:
+    """Publishes a progress event to every subscriber
+
+    Args:
+        event (Event): The event to publish
+    """
+    with subscribers_lock:
+        current = tuple(subscribers)
+    for subscriber in current:
+        try:
+            subscriber(event)
+        except Exception:
+            pass  # A broken display shouldn't be able to break the pipeline
+
+
+@contextmanager
+def job(name: str) -> Iterator[None]:
+    """Attributes the stages started in this context (and thread) to a job
+
+    Args:
+        name (str): The name of the job
+    """
+    token = current_job.set(name)
+    try:
+        yield
+    finally:
+        current_job.reset(token)
+
+
+@contextmanager
+def cancellable(cancel: threading.Event) -> Iterator[None]:
+    """Makes the stages started in this context (and thread) cancellable
+
+    Stages check for cancellation when they start and whenever they publish how far they
+    have got, including from other threads, raising Cancelled once cancelled.
+
+    Args:
+        cancel (threading.Event): Set to cancel the stages
+    """
+    token = cancel_event.set(cancel)
+    try:
+        yield
+    finally:
+        cancel_event.reset(token)
+
+
+def check_cancelled(cancel: Optional[threading.Event] = None) -> None:
+    """Checks whether the stages started in this context have been cancelled
+
+    Args:
+        cancel (Optional[threading.Event], optional): The event to check.
+            Defaults to the event of the current context.
+
+    Raises:
+        Cancelled: If the stages have been cancelled
+    """
+    cancel = cancel_event.get() if cancel is None else cancel
+    if cancel is not None and cancel.is_set():
+        raise Cancelled("Cancelled")
+
+
+@contextmanager
+def task(
+    stage: str,
+    total: Optional[int] = None,
+    unit: str = "bytes",
+    job: Optional[str] = None,
+) -> Iterator[Update]:
+    """Publishes the start and end of a stage, and lets it publish how far it has got
+
+    Args:
+        stage (str): The name of the stage
+        total (Optional[int], optional): The amount of work in the stage, if known.
+            Defaults to None.
+        unit (str, optional): The unit the stage's work is measured in.
+            Defaults to "bytes".
+        job (Optional[str], optional): The job the stage belongs to.
+            Defaults to the current job.
+
+    Raises:
+        Cancelled: If the stage is cancelled, either before it starts or when it publishes
+            how far it has got
+
+    Yields:
+        Iterator[Update]: A function taking the amount of work done so far and,
+            optionally, an updated total
+    """
+    job = current_job.get() if job is None else job
+    # Updates may be published from worker threads, which don't share our context
+    cancel = cancel_event.get()
+    check_cancelled(cancel)
+    state = {"done": None, "total": total}
+    publish(Event("start", job, stage, total=total, unit=unit, time=time.monotonic()))
+
+    def update(done: Optional[int], total: Optional[int] = None) -> None:
+        check_cancelled(cancel)
+        state["done"] = done
+        if total is not None:
+            state["total"] = total
+        publish(Event("update", job, stage, done, state["total"], unit, time=time.monotonic()))
+
+    error = None
+    try:
+        yield update
+    except BaseException as e:
+        error = str(e) or type(e).__name__
+        raise
+    finally:
+        publish(
+            Event(
+                "end",
+                job,
+                stage,
+                state["done"],
+                state["total"],
+                unit,
+                error,
+                time.monotonic(),
+            )
+        )
@@ -0,0 +1,101 @@
+from threading import Event, Thread
+import time
+from typing import Callable, Dict, Iterator
+
+import docker
+import typer
+
+from . import progress
+from .config import config
+
+
+# The longest a wait goes without checking whether it has been cancelled, in seconds
+CANCEL_POLL_INTERVAL: float = 0.5
+# Seconds each container took to become ready, by container name, for the current process
+ready_times: Dict[str, float] = {}
+
+
+def follow_logs(
+    stream: Iterator[bytes],
+    ready: Callable[[str], bool],
+    done: Event,
+    outcome: Dict[str, bool],
+) -> None:
+    """Reads a log stream incrementally until a line marks the container as ready
+
+    Only the current, incomplete line is kept in memory, so this is linear in the log size.
+
+    Args:
+        stream (Iterator[bytes]): The log stream to follow
+        ready (Callable[[str], bool]): Tests whether a log line marks the container as ready
+        done (Event): Set once the container is ready or the stream has ended
+        outcome (Dict[str, bool]): Receives whether the container became ready under "ready"
+    """
+    partial = b""
+    try:
+        for chunk in stream:
+            *lines, partial = (partial + chunk).split(b"\n")
+            # The partial line is checked too, in case the ready message has no trailing newline
+            if any(ready(line.decode(errors="replace")) for line in (*lines, partial)):
+                outcome["ready"] = True
+                return
+    except Exception:
+        pass  # The stream was closed because we timed out, or the container went away
+    finally:
+        done.set()
+
+
+def wait_for_log(
+    container: docker.models.containers.Container,  # type: ignore
+    ready: Callable[[str], bool],
+    timeout: float,
+) -> float:
+    """Follows a container's logs until a line marks it as ready
+
+    Args:
+        container (docker.models.containers.Container): The container to wait for
+        ready (Callable[[str], bool]): Tests whether a log line marks the container as ready
+        timeout (float): The maximum number of seconds to wait
+
+    Raises:
+        RuntimeError: If the container stops logging (i.e. exits) before becoming ready
+        TimeoutError: If the container does not become ready within the timeout
+        progress.Cancelled: If the pipeline is cancelled while waiting
+
+    Returns:
+        float: The number of seconds the container took to become ready
+    """
+    start = time.monotonic()
+    stream = container.logs(stream=True, follow=True)
+    done = Event()
+    outcome: Dict[str, bool] = {}
+    Thread(target=follow_logs, args=(stream, ready, done, outcome), daemon=True).start()
+    try:
+        # Wait in short steps, so the wait can be cancelled
+        deadline = start + timeout
+        while not done.wait(min(CANCEL_POLL_INTERVAL, max(deadline - time.monotonic(), 0))):
+            progress.check_cancelled()
+            if time.monotonic() >= deadline:
+                break
+    finally:
+        # Closing the stream also unblocks the reader thread if it is still waiting for output
+        stream.close()
+    if not outcome.get("ready"):
+        if done.is_set():
+            raise RuntimeError(f"Container {container.name} exited before becoming ready")
+        raise TimeoutError(f"Container {container.name} was not ready after {timeout}s")
+    elapsed = time.monotonic() - start
+    report(container.name, elapsed)
+    return elapsed
+
+
+def report(name: str, elapsed: float) -> None:
+    """Records how long a container took to become ready, echoing it in debug mode
+
+    Args:
+        name (str): The name of the container
+        elapsed (float): The number of seconds it took to become ready
+    """
+    ready_times[name] = elapsed
+    if config.DEBUG:
+        typer.echo(f"Container {name} ready after {elapsed:.2f}s", err=True)
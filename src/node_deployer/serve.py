@@ -0,0 +1,612 @@
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, suppress
+from http import HTTPStatus
+import json
+from pathlib import Path
+import shutil
+from threading import Event, Lock
+import time
+from typing import Annotated, Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+from urllib.parse import urlsplit
+import uuid
+
+import typer
+
+from . import progress
+from .autoignition import conversion_sessions, convert_json
+from .batch import render_node, resolve_nodes
+from .config import config
+from .create_img import hash_on_host
+from .debug import debug_guard
+from .utils import ensure_build_dir
+
+
+# The upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS: Tuple[float, ...] = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600)
+# How long a client has to send its request, in seconds
+REQUEST_TIMEOUT: float = 30
+CHUNK_SIZE: int = 2**20
+JOB_STATUSES: Tuple[str, ...] = ("queued", "running", "done", "failed", "cancelled")
+
+
+class Response(NamedTuple):
+    """A response to a request to the service"""
+
+    status: HTTPStatus
+    body: bytes = b""
+    content_type: str = "application/json"
+    # A file to send as the body instead, for downloads
+    path: Optional[Path] = None
+    headers: Dict[str, str] = {}
+
+
+def json_response(status: HTTPStatus, body: Any, **headers: str) -> Response:
+    """Builds a JSON response
+
+    Args:
+        status (HTTPStatus): The status of the response
+        body (Any): The body of the response, to be encoded as JSON
+        **headers (str): Any extra headers, with underscores in their names for dashes
+
+    Returns:
+        Response: The response
+    """
+    return Response(
+        status,
+        json.dumps(body).encode(),
+        headers={k.replace("_", "-"): v for k, v in headers.items()},
+    )
+
+
+def error_response(status: HTTPStatus, message: str) -> Response:
+    """Builds a JSON response describing an error
+
+    Args:
+        status (HTTPStatus): The status of the response
+        message (str): The error
+
+    Returns:
+        Response: The response
+    """
+    return json_response(status, {"error": message})
+
+
+class Histogram:
+    """A Prometheus histogram of latencies, in seconds"""
+
+    def __init__(self) -> None:
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float) -> None:
+        """Records a latency
+
+        Args:
+            seconds (float): The latency
+        """
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def samples(self, name: str, labels: str = "") -> Iterable[str]:
+        """Formats the histogram's samples in the Prometheus text format
+
+        Args:
+            name (str): The name of the metric
+            labels (str, optional): The labels of the histogram, formatted and followed by a
+                comma. Defaults to "".
+
+        Yields:
+            Iterable[str]: The lines of the samples
+        """
+        for bound, count in zip(LATENCY_BUCKETS, self.buckets):
+            yield f'{name}_bucket{{{labels}le="{bound}"}} {count}'
+        yield f'{name}_bucket{{{labels}le="+Inf"}} {self.count}'
+        labels = f"{{{labels.rstrip(',')}}}" if labels else ""
+        yield f"{name}_sum{labels} {self.sum}"
+        yield f"{name}_count{labels} {self.count}"
+
+
+def label(value: str) -> str:
+    """Escapes a value for use as a Prometheus label
+
+    Args:
+        value (str): The value of the label
+
+    Returns:
+        str: The escaped value
+    """
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Job:
+    """An ignition image build for a node, submitted to the service"""
+
+    def __init__(self, node: dict) -> None:
+        """Initialises the job, ready to be queued
+
+        Args:
+            node (dict): The resolved node to build the image for
+        """
+        self.id = uuid.uuid4().hex[:12]
+        self.node = node
+        self.status = "queued"
+        self.error: Optional[str] = None
+        self.cancel = Event()
+        self.submitted = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        # The stages running now by name, and those that have finished, in order
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        self.timings: List[Dict[str, Any]] = []
+
+    @property
+    def directory(self) -> Path:
+        """The directory the job builds its image in"""
+        return config.BUILD_DIR / "serve" / self.id
+
+    @property
+    def json_path(self) -> Path:
+        """The path of the job's fuel-ignition configuration"""
+        # Files are named after the job rather than anything the client sent
+        return self.directory / f"{self.id}.json"
+
+    @property
+    def img_path(self) -> Path:
+        """The path of the job's image, once it is done"""
+        return self.directory / f"{self.id}.img"
+
+    def summary(self) -> dict:
+        """Summarises the job for clients, leaving out the node's secrets
+
+        Returns:
+            dict: The job's status, progress and timings
+        """
+        return {
+            "id": self.id,
+            "hostname": self.node["hostname"],
+            "status": self.status,
+            "error": self.error,
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+            "stages": [
+                {k: v for k, v in stage.items() if k != "start"} for stage in self.stages.values()
+            ],
+            "timings": self.timings,
+            "image": f"/jobs/{self.id}/image" if self.status == "done" else None,
+        }
+
+
+class Service:
+    """A provisioning service, building ignition images for the nodes submitted to it over
+    HTTP on a bounded pool of workers
+
+    Endpoints:
+        POST /jobs: Queues a build for the node given as a JSON object
+        GET /jobs: Lists the jobs
+        GET /jobs/{id}: Reports a job's status, progress and stage timings
+        DELETE /jobs/{id}: Cancels a job
+        GET /jobs/{id}/image: Downloads a finished job's ignition image
+        GET /metrics: Reports the queue depth, jobs and latencies in Prometheus text format
+    """
+
+    def __init__(self, workers: int = 1) -> None:
+        """Initialises the service
+
+        Args:
+            workers (int, optional): The most images to build at once. Defaults to 1.
+        """
+        self.workers = workers
+        self.jobs: Dict[str, Job] = {}
+        self.lock = Lock()
+        # The jobs waiting for a worker, and a count of the jobs added to it for the workers
+        # to wait on. Cancelled jobs are taken out of the queue, leaving the count ahead
+        self.queue: deque[Job] = deque()
+        self.queued = asyncio.Semaphore(0)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="serve")
+        self.finished: Dict[str, int] = {status: 0 for status in JOB_STATUSES[2:]}
+        self.stage_latency: Dict[str, Histogram] = {}
+        self.job_latency = Histogram()
+
+    def on_event(self, event: progress.Event) -> None:
+        """Records the progress and timing of the stages of the service's jobs
+
+        Args:
+            event (progress.Event): The progress event
+        """
+        with self.lock:
+            job = self.jobs.get(event.job)
+            if job is None:
+                return
+            if event.kind == "start":
+                job.stages[event.stage] = {
+                    "stage": event.stage,
+                    "done": None,
+                    "total": event.total,
+                    "unit": event.unit,
+                    "start": event.time,
+                }
+            elif event.stage in job.stages:
+                stage = job.stages[event.stage]
+                stage.update(done=event.done, total=event.total)
+                if event.kind == "end":
+                    del job.stages[event.stage]
+                    seconds = event.time - stage["start"]
+                    job.timings.append(
+                        {"stage": event.stage, "seconds": seconds, "error": event.error}
+                    )
+                    self.stage_latency.setdefault(event.stage, Histogram()).observe(seconds)
+
+    def submit(self, spec: Any) -> Response:
+        """Queues a build for a node
+
+        Args:
+            spec (Any): The node, as decoded from the request
+
+        Returns:
+            Response: The queued job, or why it couldn't be queued
+        """
+        if not isinstance(spec, dict):
+            return error_response(HTTPStatus.BAD_REQUEST, "Node must be a JSON object")
+        if spec.get("disk"):
+            return error_response(HTTPStatus.BAD_REQUEST, "The service doesn't write disks")
+        try:
+            node = resolve_nodes([spec], {"switch_port": 4789})[0]
+        except (ValueError, TypeError) as e:
+            return error_response(HTTPStatus.BAD_REQUEST, str(e))
+        job = Job(node)
+        with self.lock:
+            if len(self.queue) >= config.SERVE_QUEUE_SIZE:
+                return error_response(HTTPStatus.SERVICE_UNAVAILABLE, "The job queue is full")
+            self.queue.append(job)
+            self.jobs[job.id] = job
+            summary = job.summary()
+        self.queued.release()
+        return json_response(HTTPStatus.ACCEPTED, summary, Location=f"/jobs/{job.id}")
+
+    def cancel(self, job: Job) -> Response:
+        """Cancels a job, before or while it runs
+
+        Args:
+            job (Job): The job to cancel
+
+        Returns:
+            Response: The job
+        """
+        with self.lock:
+            if job.status == "queued":
+                self.queue.remove(job)
+                self.finish(job, "cancelled")
+            elif job.status == "running":
+                # The job stops at its next stage, or the next time it reports progress
+                job.cancel.set()
+            return json_response(HTTPStatus.OK, job.summary())
+
+    def finish(self, job: Job, status: str, error: Optional[str] = None) -> None:
+        """Records that a job has finished, forgetting the oldest finished jobs beyond
+        SERVE_JOB_HISTORY. Must be called with the lock held
+
+        Args:
+            job (Job): The job
+            status (str): How the job finished
+            error (Optional[str], optional): Why the job failed. Defaults to None.
+        """
+        job.status, job.error, job.finished = status, error, time.time()
+        self.finished[status] += 1
+        if job.started is not None:
+            self.job_latency.observe(job.finished - job.started)
+        done = [j for j in self.jobs.values() if j.finished is not None]
+        for old in done[: max(len(done) - config.SERVE_JOB_HISTORY, 0)]:
+            del self.jobs[old.id]
+            shutil.rmtree(old.directory, ignore_errors=True)
+
+    def run_job(
+        self,
+        job: Job,
+        session: Optional[Tuple[Any, Any, str]] = None,
+    ) -> None:
+        """Builds a job's image, from the worker pool
+
+        Args:
+            job (Job): The job to run, as taken from the queue by dequeue
+            session (Optional[Tuple[Any, Any, str]], optional): The browser session to convert
+                with, if the conversion engine needs one. Defaults to None.
+        """
+        status, error = "done", None
+        try:
+            with progress.job(job.id), progress.cancellable(job.cancel):
+                job.directory.mkdir(parents=True, exist_ok=True)
+                with progress.task("Rendering template"):
+                    rendered = render_node(job.node, hash_on_host(job.node["password"]))
+                    with open(job.json_path, "w") as f:
+                        json.dump(rendered, f, indent=4)
+                convert_json(job.json_path, job.img_path, session)
+        except progress.Cancelled:
+            status = "cancelled"
+        except Exception as e:
+            status, error = "failed", str(e) or type(e).__name__
+        with self.lock:
+            self.finish(job, status, error)
+
+    def dequeue(self) -> Optional[Job]:
+        """Takes the next job from the queue, marking it as running
+
+        The job is marked in the same critical section as it leaves the queue, so a job that
+        is cancelled meanwhile is either still queued or already running, never in between.
+
+        Returns:
+            Optional[Job]: The job, or None if the queue is empty
+        """
+        with self.lock:
+            if not self.queue:
+                return None
+            job = self.queue.popleft()
+            job.status, job.started = "running", time.time()
+            return job
+
+    async def worker(self, session: Optional[Tuple[Any, Any, str]] = None) -> None:
+        """Runs the queued jobs one at a time, for as long as the service runs
+
+        Args:
+            session (Optional[Tuple[Any, Any, str]], optional): The browser session this
+                worker converts with, if the conversion engine needs one. Defaults to None.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.queued.acquire()
+            job = self.dequeue()
+            if job is None:
+                continue  # The job was cancelled
+            await loop.run_in_executor(self.executor, self.run_job, job, session)
+
+    def metrics(self) -> str:
+        """Reports the service's metrics in the Prometheus text format
+
+        Returns:
+            str: The metrics
+        """
+        with self.lock:
+            jobs = {status: 0 for status in JOB_STATUSES[:2]}
+            for job in self.jobs.values():
+                if job.status in jobs:
+                    jobs[job.status] += 1
+            lines = [
+                "# HELP node_deployer_queue_depth Jobs waiting for a worker",
+                "# TYPE node_deployer_queue_depth gauge",
+                f"node_deployer_queue_depth {len(self.queue)}",
+                "# HELP node_deployer_jobs Jobs queued or running",
+                "# TYPE node_deployer_jobs gauge",
+                *(f'node_deployer_jobs{{status="{s}"}} {n}' for s, n in jobs.items()),
+                "# HELP node_deployer_jobs_finished_total Jobs finished, by how they finished",
+                "# TYPE node_deployer_jobs_finished_total counter",
+                *(
+                    f'node_deployer_jobs_finished_total{{status="{s}"}} {n}'
+                    for s, n in self.finished.items()
+                ),
+                "# HELP node_deployer_job_seconds How long jobs took to run",
+                "# TYPE node_deployer_job_seconds histogram",
+                *self.job_latency.samples("node_deployer_job_seconds"),
+                "# HELP node_deployer_stage_seconds How long each stage of the jobs took",
+                "# TYPE node_deployer_stage_seconds histogram",
+            ]
+            for stage, histogram in sorted(self.stage_latency.items()):
+                lines.extend(
+                    histogram.samples("node_deployer_stage_seconds", f'stage="{label(stage)}",')
+                )
+        return "\n".join(lines) + "\n"
+
+    def route(self, method: str, path: str, body: bytes) -> Response:
+        """Responds to a request
+
+        Args:
+            method (str): The request's method
+            path (str): The request's path
+            body (bytes): The request's body
+
+        Returns:
+            Response: The response
+        """
+        parts = path.strip("/").split("/")
+        if parts == ["metrics"] and method == "GET":
+            return Response(
+                HTTPStatus.OK, self.metrics().encode(), "text/plain; version=0.0.4; charset=utf-8"
+            )
+        if parts == ["jobs"] and method == "GET":
+            with self.lock:
+                return json_response(HTTPStatus.OK, [j.summary() for j in self.jobs.values()])
+        if parts == ["jobs"] and method == "POST":
+            try:
+                spec = json.loads(body)
+            except ValueError:
+                return error_response(HTTPStatus.BAD_REQUEST, "Request body must be JSON")
+            return self.submit(spec)
+        if len(parts) not in (2, 3) or parts[0] != "jobs" or parts[2:] not in ([], ["image"]):
+            return error_response(HTTPStatus.NOT_FOUND, f"No such endpoint: {path}")
+        with self.lock:
+            job = self.jobs.get(parts[1])
+        if job is None:
+            return error_response(HTTPStatus.NOT_FOUND, f"No such job: {parts[1]}")
+        if len(parts) == 2 and method == "GET":
+            with self.lock:
+                return json_response(HTTPStatus.OK, job.summary())
+        if len(parts) == 2 and method == "DELETE":
+            return self.cancel(job)
+        if len(parts) == 3 and method == "GET":
+            if job.status != "done":
+                return error_response(HTTPStatus.CONFLICT, f"Job {job.id} is {job.status}")
+            return Response(
+                HTTPStatus.OK,
+                content_type="application/octet-stream",
+                path=job.img_path,
+                # Hostnames are checked to be RFC 1123 labels, so are safe in a header
+                headers={
+                    "Content-Disposition": f'attachment; filename="{job.node["hostname"]}.img"'
+                },
+            )
+        return error_response(HTTPStatus.METHOD_NOT_ALLOWED, f"{method} not allowed on {path}")
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Handles a connection, serving a single request
+
+        Args:
+            reader (asyncio.StreamReader): The connection's reader
+            writer (asyncio.StreamWriter): The connection's writer
+        """
+        try:
+            async with asyncio.timeout(REQUEST_TIMEOUT):
+                request_line = (await reader.readline()).decode("latin-1")
+                headers = {}
+                while (line := (await reader.readline()).decode("latin-1").strip()) != "":
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    method, target, _ = request_line.split()
+                    length = int(headers.get("content-length", 0))
+                except ValueError:
+                    response = error_response(HTTPStatus.BAD_REQUEST, "Malformed request")
+                else:
+                    if length > config.SERVE_MAX_BODY:
+                        response = error_response(
+                            HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Request body is too large"
+                        )
+                    else:
+                        body = await reader.readexactly(length)
+                        response = self.route(method.upper(), urlsplit(target).path, body)
+            await self.respond(writer, response)
+        except (asyncio.IncompleteReadError, ConnectionError, TimeoutError):
+            pass  # The client went away, so there's no one to respond to
+        finally:
+            writer.close()
+            with suppress(ConnectionError):
+                await writer.wait_closed()
+
+    async def respond(self, writer: asyncio.StreamWriter, response: Response) -> None:
+        """Sends a response, closing the connection after it
+
+        Args:
+            writer (asyncio.StreamWriter): The connection's writer
+            response (Response): The response to send
+        """
+        length = response.path.stat().st_size if response.path else len(response.body)
+        head = [
+            f"HTTP/1.1 {response.status.value} {response.status.phrase}",
+            f"Content-Type: {response.content_type}",
+            f"Content-Length: {length}",
+            "Connection: close",
+            *(f"{k}: {v}" for k, v in response.headers.items()),
+        ]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+        if response.path is None:
+            writer.write(response.body)
+        else:
+            with open(response.path, "rb") as f:
+                while chunk := f.read(CHUNK_SIZE):
+                    writer.write(chunk)
+                    await writer.drain()
+        await writer.drain()
+
+    async def run(self, host: str, port: int) -> None:
+        """Serves requests until cancelled
+
+        Args:
+            host (str): The address to listen on
+            port (int): The port to listen on
+        """
+        loop = asyncio.get_running_loop()
+        with ExitStack() as stack:
+            stack.callback(progress.subscribe(self.on_event))
+            stack.callback(self.executor.shutdown, wait=False, cancel_futures=True)
+            server = await asyncio.start_server(self.handle, host, port)
+            # Jobs can be queued while the browser sessions start, which may take a while
+            sessions: List[Optional[Tuple[Any, Any, str]]] = [None] * self.workers
+            if config.CONVERSION_ENGINE != "native":
+                container, drivers = await loop.run_in_executor(
+                    self.executor, stack.enter_context, conversion_sessions(self.workers)
+                )
+                sessions = [(container, driver, downloads) for driver, downloads in drivers]
+            workers = [asyncio.create_task(self.worker(session)) for session in sessions]
+            try:
+                async with server:
+                    await server.serve_forever()
+            finally:
+                for task in workers:
+                    task.cancel()
+                # Stop the running jobs, so the browser sessions can be closed
+                with self.lock:
+                    for job in self.jobs.values():
+                        job.cancel.set()
+
+
+@debug_guard
+@ensure_build_dir
+def serve(
+    host: Annotated[
+        str,
+        typer.Option(
+            "--host",
+            help="Address to listen on",
+        ),
+    ] = config.SERVE_HOST,
+    port: Annotated[
+        int,
+        typer.Option(
+            "--port",
+            "-p",
+            help="Port to listen on",
+            min=1,
+            max=config.MAX_PORT,
+        ),
+    ] = config.SERVE_PORT,
+    workers: Annotated[
+        int,
+        typer.Option(
+            "--workers",
+            "-j",
+            help="Number of images to build concurrently",
+            min=1,
+            max=config.MAX_CONVERSION_SESSIONS,
+        ),
+    ] = 1,
+    debug: Annotated[
+        bool,
+        typer.Option(
+            "--debug",
+            help="Enable debug mode",
+            is_eager=True,
+            is_flag=True,
+            flag_value=True,
+            hidden=not config.DEBUG,
+        ),
+    ] = False,
+) -> None:
+    """Serves an HTTP API that queues ignition image builds for nodes, keeping the
+    conversion engine warm between them
+
+    Args:
+        host (Annotated[ str, typer.Option, optional):
+            The address to listen on.
+            Defaults to SERVE_HOST.
+        port (Annotated[ int, typer.Option, optional):
+            The port to listen on.
+            Defaults to SERVE_PORT.
+        workers (Annotated[ int, typer.Option, optional):
+            The number of images to build concurrently.
+            Defaults to 1.
+        debug (Annotated[ bool, typer.Option, optional):
+            Enable debug mode.
+            Defaults to False.
+    """
+    typer.echo(f"Serving on http://{host}:{port} (press Ctrl+C to stop)")
+    with suppress(KeyboardInterrupt):
+        asyncio.run(Service(workers).run(host, port))
+
+
+if __name__ == "__main__":
+    config.update_config("cli")
+    typer.run(serve)
@@ -0,0 +1,269 @@
+from functools import cache, lru_cache
+import json
+from pathlib import Path
+from typing import Any, Iterable, NamedTuple, NoReturn, Optional, Sequence
+
+from .config import config
+
+
+class FrozenDict(dict):
+    """An immutable dict, which can be shared between configurations without copying
+
+    Being a dict, it can be used anywhere a dict is read, including by json.
+    """
+
+    def _immutable(self, *args, **kwargs) -> NoReturn:
+        raise TypeError(f"{type(self).__name__} is immutable")
+
+    __setitem__ = __delitem__ = __ior__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable  # type: ignore
+
+    def __hash__(self) -> int:  # type: ignore
+        # Templates are looked up by hash to find their compiled form, so it is only computed once
+        if "_hash" not in self.__dict__:
+            self.__dict__["_hash"] = hash(frozenset(self.items()))
+        return self.__dict__["_hash"]
+
+    def __reduce__(self):
+        # The default would rebuild the dict one item at a time
+        return type(self), (dict(self),)
+
+
+class FrozenList(list):
+    """An immutable list, which can be shared between configurations without copying
+
+    Being a list, it can be used anywhere a list is read, including by json.
+    """
+
+    def _immutable(self, *args, **kwargs) -> NoReturn:
+        raise TypeError(f"{type(self).__name__} is immutable")
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _immutable  # type: ignore
+    append = extend = insert = pop = remove = clear = sort = reverse = _immutable  # type: ignore
+
+    def __hash__(self) -> int:  # type: ignore
+        return hash(tuple(self))
+
+    def __reduce__(self):
+        return type(self), (list(self),)
+
+
+def freeze(value: Any) -> Any:
+    """Makes an immutable copy of a JSON-like value, reusing any parts already immutable
+
+    Args:
+        value (Any): The value to freeze
+
+    Returns:
+        Any: The value, with its dicts and lists replaced by FrozenDicts and FrozenLists
+    """
+    if isinstance(value, (FrozenDict, FrozenList)):
+        return value
+    if isinstance(value, dict):
+        return FrozenDict((k, freeze(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return FrozenList(freeze(v) for v in value)
+    return value
+
+
+def assoc_in(tree: Any, path: Sequence[str | int], value: Any) -> Any:
+    """Sets a value deep within a frozen tree, copying only the dicts and lists along the
+    path to it so the rest of the tree is shared with the original
+
+    Args:
+        tree (Any): The tree to set the value in, which is left unchanged
+        path (Sequence[str | int]): The keys and indices leading to the value
+        value (Any): The value to set, which should already be frozen
+
+    Returns:
+        Any: The new tree
+    """
+    if not path:
+        return value
+    key, rest = path[0], path[1:]
+    if isinstance(tree, list):
+        items = list(tree)
+        items[key] = assoc_in(tree[key], rest, value)  # type: ignore
+        return FrozenList(items)
+    return FrozenDict({**tree, key: assoc_in(tree[key], rest, value)})
+
+
+def validate_template(template: Any) -> None:
+    """Checks that a template has the structure the node settings are applied to
+
+    Args:
+        template (Any): The template to check
+
+    Raises:
+        ValueError: If the template is not a JSON object with a user to log in as, or its
+            files or units are not lists
+    """
+    if not isinstance(template, dict):
+        raise ValueError("Template must be a JSON object")
+    users = template.get("login", {}).get("users")
+    if not isinstance(users, list) or not users or not isinstance(users[0], dict):
+        raise ValueError("Template must define at least one user in login.users")
+    for section, key in (("storage", "files"), ("systemd", "units")):
+        if not isinstance(template.get(section, {}), dict):
+            raise ValueError(f"Template {section} must be a JSON object")
+        if not isinstance(template.get(section, {}).get(key, []), list):
+            raise ValueError(f"Template {section}.{key} must be a list")
+
+
+@cache
+def read_template(path: Path) -> FrozenDict:
+    """Reads, validates and freezes a template, once per process
+
+    Args:
+        path (Path): The template file
+
+    Returns:
+        FrozenDict: The template
+    """
+    with open(path, "r") as f:
+        template = json.load(f)
+    validate_template(template)
+    return freeze(template)
+
+
+@cache
+def read_file(path: Path) -> str:
+    """Reads a file to be added to the configurations, once per process
+
+    Args:
+        path (Path): The file
+
+    Returns:
+        str: The contents of the file
+    """
+    with open(path, "r") as f:
+        return f.read()
+
+
+def load_template() -> FrozenDict:
+    """Loads the default template for the ignition configuration
+
+    Returns:
+        FrozenDict: The default ignition configuration
+    """
+    return read_template(config.SRC_DIR / "templates/fuelignition.json")
+
+
+def file_entry(path: str, contents: str) -> dict:
+    """Builds the fuel-ignition entry for a file written to the node
+
+    Args:
+        path (str): Where to write the file on the node
+        contents (str): The contents of the file
+
+    Returns:
+        dict: The file entry
+    """
+    return {
+        "path": path,
+        "source_type": "data",
+        "mode": 420,
+        "overwrite": True,
+        "data_content": contents,
+    }
+
+
+class CompiledTemplate(NamedTuple):
+    """A template with everything shared between nodes already applied"""
+
+    base: FrozenDict
+    # Where the node's swarm configuration goes in the list of files
+    swarm_config_index: int
+
+    def render(
+        self,
+        hostname: str,
+        password: str,
+        swarm_config: dict,
+        password_hash: Optional[str] = None,
+    ) -> FrozenDict:
+        """Renders the configuration of a node, sharing everything it doesn't change with the
+        compiled template
+
+        Args:
+            hostname (str): The hostname to set
+            password (str): The password to set for the root user
+            swarm_config (dict): The swarm configuration to set
+            password_hash (Optional[str], optional): The password already hashed, to set in
+                place of the password itself. Defaults to None.
+
+        Raises:
+            ValueError: If no password is given outside of testing
+
+        Returns:
+            FrozenDict: The node's configuration
+        """
+        if not password and not config.TESTING:
+            raise ValueError("Password must be specified")
+        user = {**self.base["login"]["users"][0]}
+        if password_hash:
+            # Only the native conversion engine understands hashes; fuel-ignition hashes the
+            # plaintext password itself
+            user["password_hash"] = password_hash
+        else:
+            user["passwd"] = password
+            if password:
+                user["hash_type"] = "bcrypt"
+        ignition_config = assoc_in(self.base, ("hostname",), hostname)
+        ignition_config = assoc_in(ignition_config, ("login", "users", 0), FrozenDict(user))
+        return assoc_in(
+            ignition_config,
+            ("storage", "files", self.swarm_config_index, "data_content"),
+            json.dumps(swarm_config),
+        )
+
+
+def with_items(section: Any, key: str, items: Iterable[dict]) -> dict:
+    """Appends items to a list in a section of a template, creating either if missing
+
+    Args:
+        section (Any): The section of the template, or None if it is missing
+        key (str): The list to append to
+        items (Iterable[dict]): The items to append
+
+    Returns:
+        dict: The updated section
+    """
+    section = section or {}
+    return {**section, key: [*section.get(key, []), *items]}
+
+
+@lru_cache(maxsize=16)
+def compile_template(template: FrozenDict) -> CompiledTemplate:
+    """Compiles a template, applying everything that is the same for every node once
+
+    Args:
+        template (FrozenDict): The template to compile
+
+    Returns:
+        CompiledTemplate: The compiled template
+    """
+    validate_template(template)
+    # Add files that will define a service to ensure that the node joins the swarm
+    swarm_script = read_file(config.SRC_DIR / "templates/join_swarm.sh")
+    swarm_service = read_file(config.SRC_DIR / "templates/join_swarm.service")
+    files = template.get("storage", {}).get("files", [])
+    base = {
+        **template,
+        # The hostname is set per node, but keeps its place before the added sections
+        "hostname": template.get("hostname", ""),
+        "storage": with_items(
+            template.get("storage"),
+            "files",
+            [
+                file_entry("/root/join_swarm.json", ""),
+                file_entry("/root/join_swarm.sh", swarm_script),
+            ],
+        ),
+        "systemd": with_items(
+            template.get("systemd"),
+            "units",
+            [{"name": "join_swarm.service", "enabled": True, "contents": swarm_service}],
+        ),
+    }
+    return CompiledTemplate(freeze(base), len(files))
@@ -0,0 +1,144 @@
+from contextlib import contextmanager
+from functools import partial, wraps
+import json
+from pathlib import Path
+from threading import Lock
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import typer
+
+from . import progress
+from .config import config
+
+
+type Stage = Dict[str, Any]
+
+
+stages_lock = Lock()
+
+
+def record_event(
+    event: progress.Event,
+    stages: List[Stage],
+    open_stages: Dict[Tuple[str, str], List[Stage]],
+) -> None:
+    """Records the timing of each stage from the progress events it publishes
+
+    Args:
+        event (progress.Event): The progress event
+        stages (List[Stage]): The stages timed so far, in the order they finished
+        open_stages (Dict[Tuple[str, str], List[Stage]]): The stages that have started but
+            not yet finished, by job and stage name
+    """
+    key = (event.job, event.stage)
+    with stages_lock:
+        if event.kind == "start":
+            record: Stage = {"job": event.job, "stage": event.stage, "start": event.time}
+            open_stages.setdefault(key, []).append(record)
+            return
+        if not open_stages.get(key):
+            return
+        record = open_stages[key][-1]
+        if event.unit == "bytes":
+            record["bytes"] = event.done
+        if event.kind == "end":
+            open_stages[key].pop()
+            record["seconds"] = event.time - record["start"]
+            record["error"] = event.error
+            stages.append(record)
+
+
+def summarise(run: List[Stage], start: float, seconds: float) -> dict:
+    """Summarises the stages of a run for the JSON timing report
+
+    Args:
+        run (List[Stage]): The stages timed during the run
+        start (float): The monotonic time the run started at
+        seconds (float): How long the whole run took
+
+    Returns:
+        dict: The report, with each stage's start given relative to the start of the run
+    """
+    return {
+        "seconds": seconds,
+        "stages": [
+            {"bytes": None, **record, "start": record["start"] - start}
+            for record in sorted(run, key=lambda record: record["start"])
+        ],
+    }
+
+
+def format_report(report: dict) -> str:
+    """Formats a timing report as a table, with nested stages indented under their parents
+
+    Args:
+        report (dict): The report to format
+
+    Returns:
+        str: The formatted table
+    """
+    lines = [f"{'Stage':<40} {'Start':>8} {'Seconds':>8} {'MiB':>8}"]
+    open_ends: Dict[str, List[float]] = {}
+    for record in report["stages"]:
+        # Stages of the same job that haven't ended by the time this one starts contain it
+        ends = [end for end in open_ends.get(record["job"], []) if end > record["start"]]
+        job = f"[{record['job']}] " if record["job"] else ""
+        name = f"{'  ' * len(ends)}{job}{record['stage']}"
+        size = "" if record["bytes"] is None else f"{record['bytes'] / 2**20:.2f}"
+        lines.append(f"{name:<40} {record['start']:>8.2f} {record['seconds']:>8.2f} {size:>8}")
+        open_ends[record["job"]] = [*ends, record["start"] + record["seconds"]]
+    lines.append(f"{'Total':<40} {'':>8} {report['seconds']:>8.2f}")
+    return "\n".join(lines)
+
+
+@contextmanager
+def timing_report(show: bool = False, json_path: Optional[Path] = None) -> Iterator[None]:
+    """Reports the stages timed while the context is active, once it exits
+
+    Args:
+        show (bool, optional): Whether to print the report as a table to stderr.
+            Defaults to False.
+        json_path (Optional[Path], optional): A file to write the report to as JSON.
+            Defaults to None.
+    """
+    stages: List[Stage] = []
+    open_stages: Dict[Tuple[str, str], List[Stage]] = {}
+    start = time.monotonic()
+    # Stages are only recorded while a report is being made, so long running processes such
+    # as serve and the GUI don't accumulate them
+    unsubscribe = progress.subscribe(partial(record_event, stages=stages, open_stages=open_stages))
+    try:
+        yield
+    finally:
+        unsubscribe()
+        with stages_lock:
+            run = list(stages)
+        report = summarise(run, start, time.monotonic() - start)
+        if show:
+            typer.echo(format_report(report), err=True)
+        if json_path is not None:
+            with open(config.PROJECT_ROOT / json_path, "w") as f:
+                json.dump(report, f, indent=4)
+
+
+def timed_command(f: Callable) -> Callable:
+    """A decorator that reports the stages timed while a command runs, as requested by its
+    "timings" and "timings_json" arguments
+
+    Args:
+        f (Callable): The command to decorate
+
+    Returns:
+        Callable: The decorated command
+    """
+
+    @wraps(f)
+    def wrapped(*args, **kwargs):
+        show, json_path = kwargs.get("timings", False), kwargs.get("timings_json")
+        if not show and json_path is None:
+            return f(*args, **kwargs)
+        with timing_report(show, json_path):
+            return f(*args, **kwargs)
+
+    return wrapped
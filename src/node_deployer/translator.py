@@ -0,0 +1,299 @@
+from base64 import b64encode
+import json
+from pathlib import Path
+import re
+from typing import Annotated, Optional
+from urllib.parse import quote
+
+import typer
+
+from . import passwords
+from .cli import cli_spinner
+from .config import config
+from .debug import debug_guard
+from .utils import ensure_build_dir
+
+
+IGNITION_VERSION: str = "3.2.0"
+NM_CONNECTIONS_DIR: str = "/etc/NetworkManager/system-connections"
+NM_NOAUTO_CONF: str = (
+    "[main]\n"
+    "# Do not do automatic (DHCP/SLAAC) configuration on ethernet devices\n"
+    "# with no other matching connections.\n"
+    "no-auto-default=*\n"
+)
+COMBUSTION_HEADER: str = (
+    "#!/bin/bash\n"
+    "# combustion: network\n"
+    "# Redirect output to the console\n"
+    "exec > >(exec tee -a /dev/tty0) 2>&1\n"
+)
+
+
+def data_url(contents: str, base64: bool = True) -> str:
+    """Encodes file contents as a data URL, as fuel-ignition does
+
+    Args:
+        contents (str): The contents to encode
+        base64 (bool, optional): Whether to base64 encode the contents rather than
+            percent-encoding them. Defaults to True.
+
+    Returns:
+        str: The encoded data URL
+    """
+    if base64:
+        return f"data:text/plain;charset=utf-8;base64,{b64encode(contents.encode()).decode()}"
+    return f"data:,{quote(contents, safe='')}"
+
+
+def hash_password(password: str, hash_type: str = "bcrypt") -> str:
+    """Hashes a password for use as an ignition passwordHash, with the configured cost and
+    salt policy
+
+    Args:
+        password (str): The password to hash
+        hash_type (str, optional): The hashing algorithm to use. Defaults to "bcrypt".
+
+    Raises:
+        ValueError: If the hash type is not supported
+
+    Returns:
+        str: The hashed password
+    """
+    if hash_type != "bcrypt":
+        raise ValueError(f"Unsupported password hash type: {hash_type}")
+    return passwords.cached_hash(password)
+
+
+def translate_users(fuelignition: dict) -> list[dict]:
+    """Translates fuel-ignition login users to ignition passwd users
+
+    Args:
+        fuelignition (dict): The fuel-ignition configuration
+
+    Returns:
+        list[dict]: The ignition passwd users
+    """
+    users = []
+    for user in fuelignition.get("login", {}).get("users", []):
+        ign_user = {"name": user["name"]}
+        # Passwords hashed on the host when the configuration was rendered are used as is
+        if user.get("password_hash"):
+            ign_user["passwordHash"] = user["password_hash"]
+        elif user.get("passwd"):
+            ign_user["passwordHash"] = hash_password(
+                user["passwd"], user.get("hash_type", "bcrypt")
+            )
+        users.append(ign_user)
+    return users
+
+
+def translate_file(file: dict) -> dict:
+    """Translates a fuel-ignition storage file to an ignition storage file
+
+    Args:
+        file (dict): The fuel-ignition file
+
+    Raises:
+        ValueError: If the file has an unsupported source type
+
+    Returns:
+        dict: The ignition file
+    """
+    source_type = file.get("source_type", "data")
+    if source_type != "data":
+        raise ValueError(f"Unsupported source type for {file['path']}: {source_type}")
+    return {
+        "path": file["path"],
+        "mode": file.get("mode", 420),
+        "overwrite": file.get("overwrite", False),
+        "contents": {"source": data_url(file.get("data_content", ""))},
+    }
+
+
+def nmconnection(interface: dict) -> str:
+    """Renders a NetworkManager connection profile for a fuel-ignition network interface
+
+    Args:
+        interface (dict): The fuel-ignition network interface
+
+    Raises:
+        ValueError: If the interface uses an unsupported network type
+
+    Returns:
+        str: The NetworkManager connection profile
+    """
+    name = interface["name"]
+    profile = f"\n[connection]\nid={name}\ntype=ethernet\ninterface-name={name}\n"
+    for ip in ("ipv4", "ipv6"):
+        network_type = interface.get(ip, {}).get("network_type", "DHCP")
+        if network_type != "DHCP":
+            raise ValueError(f"Unsupported {ip} network type for {name}: {network_type}")
+        addr_gen = "addr-gen-mode=eui64\n" if ip == "ipv6" else ""
+        profile += f"\n[{ip}]\ndns-search=\n{addr_gen}method=auto\n"
+    return profile
+
+
+def translate_network(fuelignition: dict) -> list[dict]:
+    """Translates fuel-ignition network interfaces to NetworkManager ignition files
+
+    Args:
+        fuelignition (dict): The fuel-ignition configuration
+
+    Returns:
+        list[dict]: The ignition files configuring the network
+    """
+    interfaces = fuelignition.get("network", {}).get("interfaces", [])
+    if not interfaces:
+        return []
+    files = [
+        {
+            "path": f"{NM_CONNECTIONS_DIR}/{interface['name']}.nmconnection",
+            "mode": 384,
+            "overwrite": True,
+            "contents": {"source": data_url(nmconnection(interface))},
+        }
+        for interface in interfaces
+    ]
+    files.append(
+        {
+            "path": "/etc/NetworkManager/conf.d/noauto.conf",
+            "mode": 420,
+            "overwrite": True,
+            "contents": {"source": data_url(NM_NOAUTO_CONF)},
+        }
+    )
+    return files
+
+
+def translate_units(fuelignition: dict) -> list[dict]:
+    """Translates fuel-ignition systemd units to ignition systemd units
+
+    Args:
+        fuelignition (dict): The fuel-ignition configuration
+
+    Returns:
+        list[dict]: The ignition systemd units
+    """
+    units = []
+    for unit in fuelignition.get("systemd", {}).get("units", []):
+        # fuel-ignition only enables units set to "yes" in its editor, and leaves units our
+        # templates enable with a boolean disabled. Its output is matched, so the native
+        # engine builds the same images as fuel-ignition does
+        ign_unit = {"name": unit["name"], "enabled": unit.get("enabled") == "yes"}
+        if unit.get("contents"):
+            ign_unit["contents"] = unit["contents"]
+        units.append(ign_unit)
+    return units
+
+
+def fuelignition_to_ignition(fuelignition: dict) -> dict:
+    """Translates a fuel-ignition json configuration to an ignition configuration
+
+    Args:
+        fuelignition (dict): The fuel-ignition configuration
+
+    Returns:
+        dict: The equivalent ignition configuration
+    """
+    files = [translate_file(f) for f in fuelignition.get("storage", {}).get("files", [])]
+    if fuelignition.get("hostname"):
+        files.append(
+            {
+                "path": "/etc/hostname",
+                "mode": 420,
+                "overwrite": True,
+                "contents": {"source": data_url(fuelignition["hostname"], base64=False)},
+            }
+        )
+    files += translate_network(fuelignition)
+    return {
+        "ignition": {"version": IGNITION_VERSION},
+        "passwd": {"users": translate_users(fuelignition)},
+        "storage": {"files": files},
+        "systemd": {"units": translate_units(fuelignition)},
+    }
+
+
+def combustion_script(fuelignition: dict) -> Optional[str]:
+    """Renders the combustion script installing the packages requested by fuel-ignition
+
+    Args:
+        fuelignition (dict): The fuel-ignition configuration
+
+    Returns:
+        Optional[str]: The combustion script, or None if no packages are requested
+    """
+    packages = [
+        package
+        for entry in fuelignition.get("package", {}).get("install", [])
+        for package in re.split(r"[,\s]+", entry)
+        if package
+    ]
+    if not packages:
+        return None
+    return COMBUSTION_HEADER + f"\nzypper --non-interactive install {' '.join(packages)}\n"
+
+
+@debug_guard
+@cli_spinner(description="Converting json to ign", total=None)
+@ensure_build_dir
+def json_to_ign(
+    json_path: Annotated[
+        Path,
+        typer.Option(
+            "--json-path",
+            "-i",
+            help="The fuel-ignition json to translate",
+            prompt=True,
+            exists=True,
+            dir_okay=False,
+        ),
+    ] = Path("fuelignition.json"),
+    ign_path: Annotated[
+        Path,
+        typer.Option(
+            "--ign-path",
+            "-o",
+            help="The file to output the ignition config to",
+            prompt=True,
+            dir_okay=False,
+            writable=True,
+            readable=False,
+        ),
+    ] = Path("config.ign"),
+    debug: Annotated[
+        bool,
+        typer.Option(
+            "--debug",
+            help="Enable debug mode",
+            is_eager=True,
+            is_flag=True,
+            flag_value=True,
+            expose_value=config.DEBUG,
+            hidden=not config.DEBUG,
+        ),
+    ] = False,
+) -> None:
+    """Translates a fuel-ignition json file to an ignition config file
+
+    Args:
+        json_path (Annotated[ Path, typer.Option, optional):
+            The path to the fuel-ignition json file.
+            Defaults to Path("fuelignition.json").
+        ign_path (Annotated[ Path, typer.Option, optional):
+            The path to the output ignition config file.
+            Defaults to Path("config.ign").
+        debug (Annotated[ bool, typer.Option, optional):
+            Enable debug mode.
+            Defaults to False.
+    """
+    with open(json_path, "r") as f:
+        fuelignition = json.load(f)
+    with open(config.PROJECT_ROOT / ign_path, "w") as f:
+        json.dump(fuelignition_to_ignition(fuelignition), f, indent=2)
+
+
+if __name__ == "__main__":
+    config.update_config("cli")
+    typer.run(json_to_ign)
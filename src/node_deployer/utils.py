@@ -1,7 +1,14 @@
-from functools import wraps
+from contextlib import contextmanager
+import fcntl
+from functools import cache, wraps
+import io
+import json
+import os
 from pathlib import Path
-from typing import Callable, List
-import docker
+import re
+import socket
+import time
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple
 
 from .config import config
 
@@ -24,6 +31,21 @@ def ensure_build_dir(f: Callable) -> Callable:
     return wrapper
 
 
+def file_size(path: Path) -> Optional[int]:
+    """Returns the size of a file, e.g. for reporting the bytes a stage produced
+
+    Args:
+        path (Path): The file, absolute or relative to the project root
+
+    Returns:
+        Optional[int]: The size of the file in bytes, or None if it doesn't exist
+    """
+    try:
+        return (config.PROJECT_ROOT / path).stat().st_size
+    except FileNotFoundError:
+        return None
+
+
 class Singleton(type):
     """A singleton metaclass"""
 
@@ -40,8 +62,120 @@ class Singleton(type):
         return cls._instance
 
 
+class ChunkReader(io.RawIOBase):
+    """A read-only binary file object over an iterable of byte chunks"""
+
+    def __init__(self, chunks: Iterable[bytes]) -> None:
+        """Initialises the reader
+
+        Args:
+            chunks (Iterable[bytes]): The chunks to read, e.g. a docker archive stream
+        """
+        self._chunks = iter(chunks)
+        self._pending = memoryview(b"")
+
+    def readable(self) -> bool:
+        """Returns whether the reader is readable, which it always is
+
+        Returns:
+            bool: True
+        """
+        return True
+
+    def readinto(self, buffer) -> int:  # type: ignore
+        """Reads up to len(buffer) bytes into buffer, fetching the next chunk if needed
+
+        Args:
+            buffer (bytearray | memoryview): The buffer to read into
+
+        Returns:
+            int: The number of bytes read, or 0 once the chunks are exhausted
+        """
+        while not self._pending:
+            try:
+                self._pending = memoryview(next(self._chunks))
+            except StopIteration:
+                return 0
+        n = min(len(buffer), len(self._pending))
+        buffer[:n] = self._pending[:n]
+        # Slicing a memoryview does not copy, so a large chunk is never copied more than once
+        self._pending = self._pending[n:]
+        return n
+
+
+@contextmanager
+def port_registry() -> Iterator[Dict[str, dict]]:
+    """Opens the registry of reserved ports, holding an exclusive lock on it until closed
+
+    Changes made to the registry while it is open are saved when it is closed.
+
+    Yields:
+        Iterator[Dict[str, dict]]: The reservations, with the owning pid and reservation
+            time of each, by port
+    """
+    path = Path(config.BUILD_DIR) / config.PORT_REGISTRY_FILE
+    path.parent.mkdir(exist_ok=True, parents=True)
+    with open(path, "a+") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            f.seek(0)
+            try:
+                registry = json.loads(f.read() or "{}")
+            except json.JSONDecodeError:
+                registry = {}
+            yield registry
+            f.seek(0)
+            f.truncate()
+            json.dump(registry, f)
+            # Other processes must see the changes as soon as the lock is released
+            f.flush()
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def reservation_live(reservation: dict) -> bool:
+    """Checks whether a port reservation is still held by a running process
+
+    Args:
+        reservation (dict): The reservation to check
+
+    Returns:
+        bool: Whether the reservation is still live
+    """
+    if time.time() - reservation["reserved"] > config.PORT_RESERVATION_TTL:
+        return False
+    try:
+        os.kill(reservation["pid"], 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # The process exists, it just isn't ours
+    return True
+
+
+def port_bindable(port: int) -> bool:
+    """Checks whether a TCP port can currently be bound on the host
+
+    Args:
+        port (int): The port to check
+
+    Returns:
+        bool: Whether the port can be bound
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        try:
+            s.bind(("", port))
+        except OSError:
+            return False
+    return True
+
+
 def next_free_tcp_port(port: int) -> int:
-    """Finds the next free port after the specified port
+    """Finds and reserves the next free port after the specified port
+
+    A port is free if it can be bound on the host and no other live process has reserved
+    it. Reservations expire when their process exits or after PORT_RESERVATION_TTL seconds,
+    by which point whatever it was reserved for should have bound it.
 
     Args:
         port (int): The port to start searching from
@@ -52,25 +186,51 @@ def next_free_tcp_port(port: int) -> int:
     Returns:
         int: The next free port
     """
-    ports: List[int] = []
-    try:
-        containers = config.CLIENT.containers.list(all=True)
-        ports = []
-        for container in containers:
-            port_values = container.ports.values()
-            if not port_values:
-                continue
-            for x in list(container.ports.values())[0]:
-                ports.append(int(x["HostPort"]))
-    except docker.errors.NotFound:  # type: ignore
-        # * This error is raised if container list changes between getting the list and
-        # * getting the ports. If this happens, just try again
-        return next_free_tcp_port(port)
-    if not ports:
-        return port
-    unique_ports = set(ports)
-    while port in unique_ports:
-        port += 1
-        if port > 65535:
-            raise ValueError("No free ports")
+    with port_registry() as registry:
+        for stale in [p for p, r in registry.items() if not reservation_live(r)]:
+            del registry[stale]
+        while str(port) in registry or not port_bindable(port):
+            port += 1
+            if port > config.MAX_PORT:
+                raise ValueError("No free ports")
+        registry[str(port)] = {"pid": os.getpid(), "reserved": time.time()}
     return port
+
+
+def release_tcp_port(port: int) -> None:
+    """Releases a port reserved by next_free_tcp_port
+
+    Args:
+        port (int): The port to release
+    """
+    with port_registry() as registry:
+        registry.pop(str(port), None)
+
+
+@cache
+def docker_engine_version() -> Tuple[int, ...]:
+    """Gets the version of the docker engine, caching it in the build directory
+
+    The cached version is reused for DOCKER_VERSION_TTL seconds, so that most runs never
+    need to query the engine for it.
+
+    Returns:
+        Tuple[int, ...]: The major, minor and patch version of the docker engine
+    """
+    cache_file = Path(config.BUILD_DIR) / "docker_engine.json"
+    host = config.CLIENT.api.base_url
+    try:
+        with open(cache_file, "r") as f:
+            cached = json.load(f)
+        if cached["host"] == host and time.time() - cached["checked"] < config.DOCKER_VERSION_TTL:
+            return tuple(cached["version"])
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        pass
+    components = config.CLIENT.version()["Components"]
+    version_str = next(filter(lambda x: x.get("Name") == "Engine", components))["Version"]
+    # Distro builds often carry suffixes (e.g. "24.0.7-ce"), so only take the numeric parts
+    version = tuple(int(x) for x in re.findall(r"\d+", version_str)[:3])
+    cache_file.parent.mkdir(exist_ok=True, parents=True)
+    with open(cache_file, "w") as f:
+        json.dump({"host": host, "checked": time.time(), "version": version}, f)
+    return version
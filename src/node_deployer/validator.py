@@ -0,0 +1,265 @@
+from base64 import b64decode
+import binascii
+from collections import Counter
+from functools import cache
+import json
+from pathlib import PurePosixPath
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+from .config import config
+
+
+type Report = Tuple[str, str, str]
+type Check = Callable[[Any, str], Iterator[Report]]
+
+
+SUPPORTED_VERSIONS: Tuple[str, ...] = ("3.0.0", "3.1.0", "3.2.0", "3.3.0", "3.4.0")
+# The schema covers every supported version, so fields added to the spec after v3.0.0 are
+# only used from the version that added them. Fields are keyed by the json path of the
+# objects holding them, where "*" stands for every item of an array. The fields of a section
+# that came with it (e.g. the options, clevis and wipeVolume of luks) are covered by it
+FIELD_VERSIONS: Dict[Tuple[str, str], str] = {
+    ("$.ignition", "proxy"): "3.1.0",
+    ("$.ignition.config.merge.*", "compression"): "3.1.0",
+    ("$.ignition.config.merge.*", "httpHeaders"): "3.1.0",
+    ("$.ignition.config.replace", "compression"): "3.1.0",
+    ("$.ignition.config.replace", "httpHeaders"): "3.1.0",
+    ("$.ignition.security.tls.certificateAuthorities.*", "compression"): "3.1.0",
+    ("$.ignition.security.tls.certificateAuthorities.*", "httpHeaders"): "3.1.0",
+    ("$.storage.files.*.contents", "httpHeaders"): "3.1.0",
+    ("$.storage.files.*.append.*", "httpHeaders"): "3.1.0",
+    ("$.storage.filesystems.*", "mountOptions"): "3.1.0",
+    ("$.passwd.users.*", "shouldExist"): "3.2.0",
+    ("$.passwd.groups.*", "shouldExist"): "3.2.0",
+    ("$.storage.disks.*.partitions.*", "resize"): "3.2.0",
+    ("$.storage", "luks"): "3.2.0",
+    ("$", "kernelArguments"): "3.3.0",
+    ("$.storage.luks.*", "discard"): "3.4.0",
+    ("$.storage.luks.*", "openOptions"): "3.4.0",
+    ("$.storage.luks.*.clevis.tang.*", "advertisement"): "3.4.0",
+}
+URL_SCHEMES: Tuple[str, ...] = ("", "data", "gs", "http", "https", "s3", "tftp")
+UNIT_EXTENSIONS: Tuple[str, ...] = (
+    ".automount",
+    ".device",
+    ".mount",
+    ".path",
+    ".scope",
+    ".service",
+    ".slice",
+    ".socket",
+    ".swap",
+    ".target",
+    ".timer",
+)
+JSON_TYPES: Dict[str, type] = {
+    "array": list,
+    "boolean": bool,
+    "integer": int,
+    "object": dict,
+    "string": str,
+}
+
+
+def compile_schema(
+    schema: dict, definitions: dict, compiled: Optional[Dict[str, Check]] = None
+) -> Check:
+    """Compiles a JSON schema (the subset of it used by the ignition spec) into a check function
+
+    Args:
+        schema (dict): The schema to compile
+        definitions (dict): The definitions that "$ref"s in the schema refer to
+        compiled (Optional[Dict[str, Check]], optional): The definitions compiled so far.
+            Defaults to None.
+
+    Returns:
+        Check: A function yielding a report for each problem with a value at a json path
+    """
+    compiled = {} if compiled is None else compiled
+    if "$ref" in schema:
+        name = schema["$ref"].split("/")[-1]
+        if name not in compiled:
+            # Placeholder in case the definition refers to itself while being compiled
+            compiled[name] = lambda value, path: iter(())
+            compiled[name] = compile_schema(definitions[name], definitions, compiled)
+
+        def check_ref(value: Any, path: str) -> Iterator[Report]:
+            yield from compiled[name](value, path)
+
+        return check_ref
+
+    expected = schema.get("type")
+    expected_type = JSON_TYPES.get(expected, object) if expected else object
+    enum = schema.get("enum")
+    required = tuple(schema.get("required", ()))
+    properties = {
+        key: compile_schema(subschema, definitions, compiled)
+        for key, subschema in schema.get("properties", {}).items()
+    }
+    items = compile_schema(schema["items"], definitions, compiled) if "items" in schema else None
+
+    def check(value: Any, path: str) -> Iterator[Report]:
+        # Ignition treats null the same as an unset field
+        if value is None:
+            return
+        if not isinstance(value, expected_type) or (
+            expected == "integer" and isinstance(value, bool)
+        ):
+            yield "error", path, f"expected {expected}"
+            return
+        if enum is not None and value not in enum:
+            yield "error", path, f"must be one of {', '.join(map(repr, enum))}"
+        if isinstance(value, dict):
+            for key in required:
+                if value.get(key) is None:
+                    yield "error", f"{path}.{key}", "field is required"
+            for key, child in value.items():
+                if key in properties:
+                    yield from properties[key](child, f"{path}.{key}")
+                else:
+                    yield "warning", f"{path}.{key}", f"Unused key {key}"
+        if isinstance(value, list) and items is not None:
+            for i, child in enumerate(value):
+                yield from items(child, f"{path}.{i}")
+
+    return check
+
+
+@cache
+def schema_check() -> Check:
+    """Loads and compiles the ignition config schema, once per process
+
+    Returns:
+        Check: The compiled schema
+    """
+    with open(config.SRC_DIR / "schemas/ignition.json", "r") as f:
+        schema = json.load(f)
+    return compile_schema(schema, schema.get("$defs", {}))
+
+
+def check_source(source: str, path: str) -> Iterator[Report]:
+    """Checks that a resource source is a URL ignition can fetch
+
+    Args:
+        source (str): The source URL
+        path (str): The json path of the source
+
+    Yields:
+        Iterator[Report]: A report for each problem with the source
+    """
+    scheme = urlparse(source).scheme
+    if scheme not in URL_SCHEMES:
+        yield "error", path, f"invalid url scheme {scheme}"
+    elif scheme == "data":
+        header, sep, data = source.removeprefix("data:").partition(",")
+        try:
+            if not sep:
+                raise ValueError
+            if header.endswith(";base64"):
+                b64decode(unquote(data), validate=True)
+        except (ValueError, binascii.Error):
+            yield "error", path, "invalid data url"
+
+
+def find_objects(ign: dict, pattern: str) -> Iterator[Tuple[str, dict]]:
+    """Finds the objects in a config at a json path, where "*" stands for every item of an array
+
+    Args:
+        ign (dict): An ignition config that conforms to the schema
+        pattern (str): The json path of the objects
+
+    Yields:
+        Iterator[Tuple[str, dict]]: The json path of each object found, and the object
+    """
+    found: List[Tuple[str, Any]] = [("$", ign)]
+    for part in pattern.split(".")[1:]:
+        if part == "*":
+            found = [
+                (f"{path}.{i}", item)
+                for path, value in found
+                for i, item in enumerate(value if isinstance(value, list) else [])
+            ]
+        else:
+            found = [
+                (f"{path}.{part}", value[part])
+                for path, value in found
+                if isinstance(value, dict) and value.get(part) is not None
+            ]
+    for path, value in found:
+        if isinstance(value, dict):
+            yield path, value
+
+
+def semantic_checks(ign: dict) -> Iterator[Report]:
+    """Performs the checks ignition makes beyond the structure of the config
+
+    Args:
+        ign (dict): An ignition config that conforms to the schema
+
+    Yields:
+        Iterator[Report]: A report for each problem with the config
+    """
+    version = ign["ignition"]["version"]
+    if version not in SUPPORTED_VERSIONS:
+        yield "error", "$.ignition.version", f"unsupported config version {version}"
+    else:
+        for (parent, key), introduced in FIELD_VERSIONS.items():
+            if SUPPORTED_VERSIONS.index(version) >= SUPPORTED_VERSIONS.index(introduced):
+                continue
+            for path, fields in find_objects(ign, parent):
+                if key in fields:
+                    yield "warning", f"{path}.{key}", f"Unused key {key}"
+
+    storage = ign.get("storage") or {}
+    nodes = [
+        (f"$.storage.{kind}.{i}", node)
+        for kind in ("files", "directories", "links")
+        for i, node in enumerate(storage.get(kind) or [])
+    ]
+    path_counts = Counter(node["path"] for _, node in nodes)
+    for node_path, node in nodes:
+        if not PurePosixPath(node["path"]).is_absolute():
+            yield "error", f"{node_path}.path", "path not absolute"
+        if path_counts[node["path"]] > 1:
+            yield "error", f"{node_path}.path", "duplicate entry defined"
+        mode = node.get("mode")
+        if mode is not None and not 0 <= mode <= 0o7777:
+            yield "error", f"{node_path}.mode", "illegal file mode"
+        if (node.get("contents") or {}).get("source") is not None:
+            yield from check_source(node["contents"]["source"], f"{node_path}.contents.source")
+        for i, resource in enumerate(node.get("append") or []):
+            if resource.get("source") is not None:
+                yield from check_source(resource["source"], f"{node_path}.append.{i}.source")
+
+    for section, entries in (
+        ("passwd.users", (ign.get("passwd") or {}).get("users") or []),
+        ("passwd.groups", (ign.get("passwd") or {}).get("groups") or []),
+        ("systemd.units", (ign.get("systemd") or {}).get("units") or []),
+    ):
+        name_counts = Counter(entry["name"] for entry in entries)
+        for i, entry in enumerate(entries):
+            if name_counts[entry["name"]] > 1:
+                yield "error", f"$.{section}.{i}.name", "duplicate entry defined"
+            if section == "systemd.units" and not entry["name"].endswith(UNIT_EXTENSIONS):
+                yield "error", f"$.{section}.{i}.name", "invalid systemd unit extension"
+
+
+def validate_config(contents: bytes) -> str:
+    """Validates an ignition config in-process, reporting problems as ignition-validate does
+
+    Args:
+        contents (bytes): The raw ignition config
+
+    Returns:
+        str: The validation response, one "<level> at <path>: <message>" line per problem
+    """
+    try:
+        ign = json.loads(contents)
+    except json.JSONDecodeError as e:
+        return f"error at line {e.lineno} col {e.colno}: {e.msg}\n"
+    reports: List[Report] = list(schema_check()(ign, "$"))
+    # The semantic checks assume the config is well formed, so only run them if it is
+    if not any(level == "error" for level, _, _ in reports):
+        reports += semantic_checks(ign)
+    return "".join(f"{level} at {path}: {message}\n" for level, path, message in reports)
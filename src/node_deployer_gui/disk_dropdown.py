@@ -1,34 +1,35 @@
 import flet as ft
-import psutil
-from typing import Tuple
+from node_deployer.block_devices import BlockDevice, block_devices, watch
+from typing import List, Tuple
 
 
-def get_disk_options() -> list[ft.dropdown.Option]:
-    physical_disks = list(filter(lambda x: "loop" not in x.device, psutil.disk_partitions()))
-    disks = [
-        ft.dropdown.Option(
-            key=disk.device,
-            text=f"{disk.device} ({disk.mountpoint})",
-        )
-        for disk in physical_disks
-    ]
+def get_disk_options(devices: List[BlockDevice]) -> list[ft.dropdown.Option]:
+    disks = [ft.dropdown.Option(key=disk.path, text=disk.label) for disk in devices]
     return disks
 
 
 def disk_dropdown(**kwargs) -> Tuple[ft.Dropdown, ft.Row]:
     dropdown = ft.Dropdown(
-        options=get_disk_options(),
+        options=get_disk_options(block_devices()),
         **kwargs,
     )
 
-    def refresh_dropdown(*_) -> None:
-        dropdown.options = get_disk_options()
-        dropdown.update()
+    def refresh_dropdown(devices: List[BlockDevice]) -> None:
+        dropdown.options = get_disk_options(devices)
+        # Don't leave a disk selected once it has been unplugged
+        if dropdown.value not in {disk.path for disk in devices}:
+            dropdown.value = None
+        # The watcher may find a change before the dropdown has been added to the page
+        if dropdown.page is not None:
+            dropdown.update()
 
+    # The list is kept up to date as disks are plugged in and unplugged, but can still be
+    # refreshed by hand
+    watch(refresh_dropdown)
     refresh_button = ft.IconButton(
         icon="refresh",
         tooltip="Refresh disk list",
-        on_click=refresh_dropdown,
+        on_click=lambda _: refresh_dropdown(block_devices()),
     )
     element = ft.Row(
         controls=[dropdown, refresh_button],
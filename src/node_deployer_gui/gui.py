@@ -8,6 +8,7 @@ from node_deployer.create_disk import create_ignition_disk
 from node_deployer.ip_interface import IPAddress
 
 from .disk_dropdown import disk_dropdown
+from .job_list import job_list
 from .types import CreateDiskArgs
 
 
@@ -34,8 +35,9 @@ HOTKEY_MAP: DefaultDict[str, Callable[[ft.KeyboardEvent], None]] = defaultdict(_
 def main(page: ft.Page) -> None:
     page.title = "I-Form Server Node Deployer"
     page.vertical_alignment = ft.MainAxisAlignment.CENTER
+    # The list of disks being created grows as jobs are queued
+    page.scroll = ft.ScrollMode.AUTO
 
-    # TODO: Add a progress bar
     # TODO: Add save/load functionality?
 
     # Lets start with the easiest part: a logo in the top left
@@ -51,6 +53,9 @@ def main(page: ft.Page) -> None:
     )
     page.add(logo_container)
 
+    # Disk creation jobs run in the background, and are listed beneath the fields
+    jobs, submit_job = job_list(width=400, horizontal_alignment=ft.CrossAxisAlignment.CENTER)
+
     # These fields are used to get the parameters for the disk creation
     disk, dd_element = disk_dropdown(tooltip="Select the disk to write to", label="Disk")
     hostname = ft.TextField(
@@ -207,30 +212,20 @@ def main(page: ft.Page) -> None:
             page.update()
 
         # This closure is called when the confirm disk creation button is pressed
+        # The disk is created in the background, so the next node can be set up meanwhile
         def trigger_disk_creation(*_) -> None:
-            dlg.title = None
-            dlg.content = ft.Row(
-                controls=[
-                    ft.Text("Creating disk..."),
-                    ft.ProgressRing(),
-                ],
-                alignment=ft.MainAxisAlignment.CENTER,
-            )
-            dlg.actions = []
-            page.update()
-            create_ignition_disk(
-                disk=disk_val,
-                hostname=hostname_val,
-                password=password_val,
-                switch_ip=switch_ip_val,
-                switch_port=switch_port_val,
-                swarm_token=swarm_token_val,
+            close_dlg()
+            submit_job(
+                f"{hostname_val} → {disk_val}",
+                lambda: create_ignition_disk(
+                    disk=[disk_val],
+                    hostname=hostname_val,
+                    password=password_val,
+                    switch_ip=switch_ip_val,
+                    switch_port=switch_port_val,
+                    swarm_token=swarm_token_val,
+                ),
             )
-            dlg.content = ft.Text("Ignition disk created!")
-            dlg.actions = [
-                ft.TextButton("OK", on_click=close_dlg),
-            ]
-            page.update()
 
         dlg = ft.AlertDialog(
             modal=True,
@@ -296,8 +291,10 @@ def main(page: ft.Page) -> None:
         alignment=ft.MainAxisAlignment.CENTER,
     )
 
-    # Finally, we finish constructing the UI by adding the rows to the page
+    # Finally, we finish constructing the UI by adding the rows to the page, followed by
+    # the disks being created
     page.add(stacked_rows)
+    page.add(jobs)
 
     # As a final task, we define the opening screen hotkey events
     HOTKEY_MAP["Enter"] = confirm_disk_creation
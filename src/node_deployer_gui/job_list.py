@@ -0,0 +1,88 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+from typing import Callable, Tuple
+
+import flet as ft
+from node_deployer import progress
+
+from .progress_panel import progress_panel
+
+
+type Submit = Callable[[str, Callable[[], None]], None]
+
+
+def job_list(**kwargs) -> Tuple[ft.Column, Submit]:
+    # A column with a card for each job submitted, showing its progress while it runs
+    column = ft.Column(**kwargs)
+    # Every job builds its image at the same paths in the build directory, so the jobs have
+    # to run one at a time. Queueing them still lets the next node be set up meanwhile
+    worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="node-deployer-job")
+
+    def submit(title: str, run: Callable[[], None]) -> None:
+        cancel = Event()
+        status = ft.Text("Queued")
+        panel = ft.Column(tight=True)
+        button = ft.TextButton("Cancel")
+        card = ft.Card(
+            content=ft.Container(
+                content=ft.Column(
+                    controls=[
+                        ft.Row(
+                            controls=[ft.Text(title, weight=ft.FontWeight.BOLD), status, button],
+                            alignment=ft.MainAxisAlignment.SPACE_BETWEEN,
+                        ),
+                        panel,
+                    ],
+                    tight=True,
+                ),
+                padding=10,
+            ),
+            width=kwargs.get("width"),
+        )
+
+        def cancel_job(*_) -> None:
+            cancel.set()
+            status.value = "Cancelling..."
+            button.disabled = True
+            card.update()
+
+        def dismiss(*_) -> None:
+            column.controls.remove(card)
+            column.update()
+
+        def finish(message: str) -> None:
+            status.value = message
+            panel.controls.clear()
+            button.text = "Dismiss"
+            button.disabled = False
+            button.on_click = dismiss
+            card.update()
+
+        def run_job() -> None:
+            if cancel.is_set():
+                finish("Cancelled")
+                return
+            status.value = "Running"
+            stages, unsubscribe = progress_panel(width=kwargs.get("width"), tight=True)
+            panel.controls.append(stages)
+            card.update()
+            message = "Done"
+            try:
+                # The job's stages are labelled with its title, and stop once it's cancelled
+                with progress.job(title), progress.cancellable(cancel):
+                    run()
+            except progress.Cancelled:
+                message = "Cancelled"
+            except BaseException as e:  # typer.Exit isn't an Exception
+                message = f"Failed: {e}" if str(e) else "Failed"
+            finally:
+                unsubscribe()
+            finish(message)
+
+        button.on_click = cancel_job
+        column.controls.append(card)
+        column.update()
+        worker.submit(run_job)
+
+    # The caller must add the column to the page before submitting any jobs
+    return column, submit
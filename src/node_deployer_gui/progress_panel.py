@@ -0,0 +1,47 @@
+from threading import Lock
+import time
+from typing import Callable, Dict, List, Tuple
+
+import flet as ft
+from node_deployer import progress
+from node_deployer.cli import format_amount
+
+
+# Updates arrive for every chunk written, far faster than is worth redrawing the page
+REDRAW_INTERVAL: float = 0.1
+
+
+def progress_panel(**kwargs) -> Tuple[ft.Column, Callable[[], None]]:
+    # A column with a label and progress bar for each running stage of the pipeline
+    column = ft.Column(**kwargs)
+    rows: Dict[Tuple[str, str], List[Tuple[ft.Column, ft.ProgressBar, ft.Text, float]]] = {}
+    lock = Lock()
+    last_redraw = [0.0]
+
+    def on_event(event: progress.Event) -> None:
+        key = (event.job, event.stage)
+        with lock:
+            if event.kind == "start":
+                label = ft.Text(f"[{event.job}] {event.stage}" if event.job else event.stage)
+                # A value of None makes the bar indeterminate until we know how far along it is
+                bar = ft.ProgressBar(value=None, width=kwargs.get("width"))
+                row = ft.Column(controls=[label, bar], spacing=2)
+                rows.setdefault(key, []).append((row, bar, label, event.time))
+                column.controls.append(row)
+            elif rows.get(key):
+                row, bar, label, start = rows[key][-1]
+                if event.kind == "update":
+                    bar.value = event.fraction
+                    stage = f"[{event.job}] {event.stage}" if event.job else event.stage
+                    label.value = f"{stage}  {format_amount(event, event.time - start)}"
+                    if time.monotonic() - last_redraw[0] < REDRAW_INTERVAL:
+                        return
+                else:
+                    rows[key].pop()
+                    column.controls.remove(row)
+            last_redraw[0] = time.monotonic()
+            column.update()
+
+    # The caller must add the column to the page before any events arrive, and unsubscribe
+    # once it's done with it
+    return column, progress.subscribe(on_event)
@@ -1,14 +1,28 @@
+import asyncio
 import atexit
+import errno
 import filecmp
+from hashlib import sha256
+import io
 from ipaddress import IPv4Address, IPv6Address
+import json
 import os
 from pathlib import Path
 import pickle
+import re
 import shutil
+import socket
+import subprocess
+import tarfile
+import threading
+import time
 
+import bcrypt
 from hypothesis import given
 from hypothesis import strategies as st
+from importtime import import_times
 from node_deployer.config import config
+import pytest
 import tomllib
 
 
@@ -36,7 +50,32 @@ def cleanup():
 
 atexit.register(cleanup)
 
-from node_deployer import autoignition, create_disk, create_img, ip_interface  # noqa: E402
+from node_deployer import (  # noqa: E402
+    autoignition,
+    batch,
+    block_devices,
+    cache,
+    cli,
+    config as config_module,
+    create_disk,
+    create_img,
+    disk_writer,
+    fat,
+    fuelignition_source,
+    ip_interface,
+    native,
+    node_deployer,
+    passwords,
+    pool,
+    progress,
+    readiness,
+    serve,
+    templates,
+    timings,
+    translator,
+    utils,
+    validator,
+)
 
 
 with open(config.PROJECT_ROOT / "tests/data/node_deployer/test_args.toml", "rb") as f:
@@ -44,6 +83,40 @@ with open(config.PROJECT_ROOT / "tests/data/node_deployer/test_args.toml", "rb")
 
 TEST_DATA_DIR = config.PROJECT_ROOT / "tests/data/node_deployer"
 
+# Modules too slow to import for commands that don't need them
+HEAVY_MODULES = ("docker", "selenium", "git", "flet", "node_deployer_gui")
+
+
+class TestConfig:
+    def test_docker_client_lazy(self):
+        fresh = config_module.Config("default")
+        assert "CLIENT" not in fresh.__dict__
+
+    def test_env_overrides(self, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.setenv("NODE_DEPLOYER_WRITE_RETRIES", "7")
+        monkeypatch.setenv("NODE_DEPLOYER_FUELIGNITION_URL", "http://example.com/edit")
+        fresh = config_module.Config("default")
+        assert fresh.WRITE_RETRIES == 7
+        assert fresh.FUELIGNITION_URL == "http://example.com/edit"
+
+    def test_config_file_parsed_once(self):
+        assert config_module.load_config_file() is config_module.load_config_file()
+
+
+class TestNodeDeployer:
+    def test_help_imports(self):
+        times = import_times(["--help"])
+        slowest = sorted(times.items(), key=lambda t: t[1], reverse=True)[:10]
+        # Only top level imports are checked, as the heavy modules have many submodules
+        assert not set(HEAVY_MODULES) & set(times), f"Slowest imports (us): {slowest}"
+        assert "node_deployer.node_deployer" in times
+
+    @pytest.mark.parametrize("name", node_deployer.COMMANDS)
+    def test_lazy_command(self, name: str):
+        command = node_deployer.load_command(name)
+        assert command.name == name
+        assert command.help == node_deployer.command_help(*node_deployer.COMMANDS[name])
+
 
 class TestIPInterface:
     TEST_ATTRS = (
@@ -98,6 +171,45 @@ class TestIPInterface:
 
 
 class TestAutoignition:
+    def test_download_dir(self):
+        dirs = {autoignition.download_dir(i) for i in range(4)}
+        assert len(dirs) == 4
+        assert autoignition.download_dir(0) == autoignition.DOWNLOADS_DIR
+
+    def test_selenium_environment(self):
+        environment = autoignition.selenium_environment(3)
+        assert environment["SE_NODE_MAX_SESSIONS"] == "3"
+
+    def test_container_path(self):
+        assert autoignition.container_path(Path("build/x.json")) == (
+            config.CWD_MOUNTDIR / "build/x.json"
+        )
+        assert autoignition.container_path(config.PROJECT_ROOT / "build/x.json") == (
+            config.CWD_MOUNTDIR / "build/x.json"
+        )
+
+    def test_fuelignition_image_tag(self, tmp_path: Path):
+        dockerfile = tmp_path / "Dockerfile"
+        dockerfile.write_text("FROM scratch\n")
+        tag = autoignition.fuelignition_image_tag("0123456789abcdef", dockerfile)
+        assert tag.startswith(f"{autoignition.FUELIGNITION_IMAGE}:0123456789ab-")
+        assert tag == autoignition.fuelignition_image_tag("0123456789abcdef", dockerfile)
+        dockerfile.write_text("FROM scratch\nUSER 1000\n")
+        assert tag != autoignition.fuelignition_image_tag("0123456789abcdef", dockerfile)
+
+    def test_extract_archive(self, tmp_path: Path):
+        contents = os.urandom(3 * autoignition.CHUNK_SIZE + 1)
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode="w") as tar:
+            info = tarfile.TarInfo("ignition.img")
+            info.size = len(contents)
+            tar.addfile(info, io.BytesIO(contents))
+        raw = archive.getvalue()
+        chunks = (raw[i : i + 65536] for i in range(0, len(raw), 65536))
+        digest = autoignition.extract_archive(chunks, tmp_path / "ignition.img")
+        assert (tmp_path / "ignition.img").read_bytes() == contents
+        assert digest == sha256(contents).hexdigest()
+
     def test_json_to_img(self, tmp_path: Path):
         tmp_path.mkdir(parents=True, exist_ok=True)
         autoignition.json_to_img(
@@ -167,7 +279,880 @@ class TestCreateDisk:
             expected = pickle.load(f)
         assert test_result == expected
 
+    def test_write_disks(self, tmp_path: Path):
+        (tmp_path / "ignition.img").write_bytes(fat.build_fat_image({"ignition/config.ign": b"{}"}))
+        (tmp_path / "disk0").write_bytes(b"")
+        disks = [str(tmp_path / "disk0"), str(tmp_path / "disk1")]
+        results = create_disk.write_disks(disks, tmp_path / "ignition.img")
+        # Only existing block devices are written, so neither a file nor a mistyped disk is
+        assert isinstance(results[disks[0]], OSError)
+        assert results[disks[0]].errno == errno.ENOTBLK
+        assert (tmp_path / "disk0").read_bytes() == b""
+        assert isinstance(results[disks[1]], FileNotFoundError)
+        assert not (tmp_path / "disk1").exists()
+
     def test_validate(self):
         self.init_buildfile("config.ign")
         test_result = create_disk.validate()
         assert test_result == (True, "")
+
+    def test_validation_result_memoised(self):
+        self.init_buildfile("config.ign")
+        key = create_disk.validation_key()
+        assert key is not None
+        create_disk.save_validation_result(key, "remembered")
+        try:
+            assert create_disk.validation_result() == "remembered"
+        finally:
+            (config.BUILD_DIR / config.VALIDATION_CACHE_FILE).unlink()
+
+    def test_save_validation_results_concurrently(
+        self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+    ):
+        monkeypatch.setattr(config, "BUILD_DIR", tmp_path)
+        # Each thread reads, updates and writes the whole file, so none may lose another's result
+        threads = [
+            threading.Thread(target=create_disk.save_validation_result, args=(str(i), str(i)))
+            for i in range(16)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert create_disk.load_validation_results() == {str(i): str(i) for i in range(16)}
+
+
+class TestUtils:
+    def test_next_free_tcp_port(self):
+        first = utils.next_free_tcp_port(45000)
+        second = utils.next_free_tcp_port(45000)
+        try:
+            # The first port is still reserved, so the second call must skip it
+            assert second > first >= 45000
+        finally:
+            utils.release_tcp_port(first)
+            utils.release_tcp_port(second)
+        with utils.port_registry() as registry:
+            assert str(first) not in registry
+
+    def test_next_free_tcp_port_bound(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.bind(("", 0))
+            s.listen()
+            port = s.getsockname()[1]
+            free = utils.next_free_tcp_port(port)
+            utils.release_tcp_port(free)
+            assert free != port
+
+
+class TestValidator:
+    def test_validate_config(self):
+        contents = (TEST_DATA_DIR / "config.ign").read_bytes()
+        test_result = validator.validate_config(contents)
+        with open(TEST_DATA_DIR / "create_disk/validation_result.pkl", "rb") as f:
+            expected = pickle.load(f)
+        # ignition-validate also reports line and column numbers, which we do not track
+        assert test_result == re.sub(r", line \d+ col \d+", "", expected)
+
+    def test_validate_config_errors(self):
+        ign = json.loads((TEST_DATA_DIR / "config.ign").read_text())
+        ign["storage"]["files"][0]["path"] = "root/join_swarm.json"
+        ign["storage"]["files"][1]["contents"]["source"] = "ftp://example.com/join_swarm.sh"
+        ign["systemd"]["units"][1]["name"] = "docker"
+        test_result = validator.validate_config(json.dumps(ign).encode())
+        assert "error at $.storage.files.0.path: path not absolute" in test_result
+        assert "error at $.storage.files.1.contents.source: invalid url scheme ftp" in test_result
+        assert "error at $.systemd.units.1.name: invalid systemd unit extension" in test_result
+
+    def test_validate_config_schema(self):
+        test_result = validator.validate_config(b'{"ignition": {"version": 3}}')
+        assert test_result == "error at $.ignition.version: expected string\n"
+        test_result = validator.validate_config(
+            b'{"ignition": {"version": "2.2.0"}, "kernelArguments": {}}'
+        )
+        assert test_result == "error at $.ignition.version: unsupported config version 2.2.0\n"
+        assert validator.validate_config(b"{").startswith("error at line 1")
+
+    def test_validate_config_full_spec(self):
+        ign = json.loads((TEST_DATA_DIR / "config.ign").read_text())
+        ign["ignition"]["version"] = "3.3.0"
+        ign["kernelArguments"] = {"shouldExist": ["quiet"], "shouldNotExist": ["rhgb"]}
+        ign["storage"]["disks"] = [{"device": "/dev/sda", "partitions": [{"label": "data"}]}]
+        ign["storage"]["filesystems"] = [
+            {"device": "/dev/disk/by-partlabel/data", "format": "xfs", "path": "/var/data"}
+        ]
+        test_result = validator.validate_config(json.dumps(ign).encode())
+        assert create_disk.filter_validation_response(test_result) == ""
+        # Fields are only known to the versions of the spec that define them
+        ign["ignition"]["version"] = "3.2.0"
+        test_result = validator.validate_config(json.dumps(ign).encode())
+        assert create_disk.filter_validation_response(test_result) == (
+            "warning at $.kernelArguments: Unused key kernelArguments"
+        )
+
+    def test_validate_config_field_versions(self):
+        ign = json.loads((TEST_DATA_DIR / "config.ign").read_text())
+        ign["ignition"]["version"] = "3.1.0"
+        ign["passwd"]["users"][0]["shouldExist"] = True
+        ign["storage"]["files"][0]["contents"]["httpHeaders"] = [{"name": "a", "value": "b"}]
+        test_result = validator.validate_config(json.dumps(ign).encode())
+        # Fields nested in arrays are too new for the config version as well as sections are
+        assert create_disk.filter_validation_response(test_result) == (
+            "warning at $.passwd.users.0.shouldExist: Unused key shouldExist"
+        )
+        ign["ignition"]["version"] = "3.0.0"
+        test_result = validator.validate_config(json.dumps(ign).encode())
+        assert create_disk.filter_validation_response(test_result).splitlines() == [
+            "warning at $.storage.files.0.contents.httpHeaders: Unused key httpHeaders",
+            "warning at $.passwd.users.0.shouldExist: Unused key shouldExist",
+        ]
+        ign["ignition"]["version"] = "3.2.0"
+        test_result = validator.validate_config(json.dumps(ign).encode())
+        assert create_disk.filter_validation_response(test_result) == ""
+
+
+class TestDiskWriter:
+    def test_write_image(self, tmp_path: Path):
+        contents = os.urandom(3 * disk_writer.ALIGNMENT * 4 + 123)
+        (tmp_path / "ignition.img").write_bytes(contents)
+        (tmp_path / "disk").write_bytes(b"\xff" * len(contents) * 2)
+        reports = []
+        stats = disk_writer.write_image(
+            tmp_path / "ignition.img",
+            tmp_path / "disk",
+            block_size=disk_writer.ALIGNMENT * 4,
+            progress=lambda done, total: reports.append((done, total)),
+            regular_file=True,
+        )
+        assert (tmp_path / "disk").read_bytes() == contents
+        assert stats.written == len(contents)
+        assert reports[-1] == (len(contents), len(contents))
+        assert len(reports) == 4
+
+    def test_write_image_to_targets(self, tmp_path: Path):
+        contents = os.urandom(5 * disk_writer.ALIGNMENT + 1)
+        (tmp_path / "ignition.img").write_bytes(contents)
+        targets = [tmp_path / f"disk{i}" for i in range(4)] + [tmp_path / "missing/disk"]
+        results = disk_writer.write_image_to_targets(
+            tmp_path / "ignition.img",
+            targets,
+            block_size=disk_writer.ALIGNMENT,
+            regular_files=True,
+        )
+        # A failed target must not stop the others from being written
+        assert isinstance(results[targets[-1]], FileNotFoundError)
+        for target in targets[:-1]:
+            assert target.read_bytes() == contents
+
+    def test_verify_and_resume(self, tmp_path: Path):
+        block_size = disk_writer.ALIGNMENT
+        contents = os.urandom(8 * block_size + 7)
+        (tmp_path / "ignition.img").write_bytes(contents)
+        disk = tmp_path / "disk"
+        disk.write_bytes(contents[: 5 * block_size + 1] + b"\0" + contents[5 * block_size + 2 :])
+        verified = disk_writer.verify_targets(tmp_path / "ignition.img", [disk], block_size)
+        assert verified[disk] == 5 * block_size
+        disk_writer.write_image_to_targets(
+            tmp_path / "ignition.img", [disk], block_size, offset=5 * block_size, regular_files=True
+        )
+        assert disk.read_bytes() == contents
+        verified = disk_writer.verify_targets(tmp_path / "ignition.img", [disk], block_size)
+        assert verified[disk] is None
+
+    def test_verify_target_longer_than_image(self, tmp_path: Path):
+        block_size = disk_writer.ALIGNMENT
+        contents = os.urandom(3 * block_size + 5)
+        (tmp_path / "ignition.img").write_bytes(contents)
+        # A disk holds more than the image, so anything past its end must not be compared
+        disk = tmp_path / "disk"
+        disk.write_bytes(contents + os.urandom(2 * block_size))
+        verified = disk_writer.verify_targets(tmp_path / "ignition.img", [disk], block_size)
+        assert verified[disk] is None
+        disk.write_bytes(contents[:-1] + b"\0" + os.urandom(block_size))
+        verified = disk_writer.verify_targets(tmp_path / "ignition.img", [disk], block_size)
+        assert verified[disk] == 3 * block_size
+
+    def test_write_and_verify(self, tmp_path: Path):
+        (tmp_path / "ignition.img").write_bytes(os.urandom(3 * disk_writer.ALIGNMENT))
+        targets = [tmp_path / "disk0", tmp_path / "disk1"]
+        errors = disk_writer.write_and_verify(
+            tmp_path / "ignition.img", targets, regular_files=True
+        )
+        assert errors == {target: None for target in targets}
+
+    def test_write_image_not_block_device(self, tmp_path: Path):
+        (tmp_path / "ignition.img").write_bytes(os.urandom(disk_writer.ALIGNMENT))
+        (tmp_path / "disk0").write_bytes(b"")
+        targets = [tmp_path / "disk0", tmp_path / "disk1"]
+        errors = disk_writer.write_and_verify(tmp_path / "ignition.img", targets)
+        # Unless regular files are asked for, targets must already exist as block devices
+        assert isinstance(errors[targets[0]], OSError)
+        assert errors[targets[0]].errno == errno.ENOTBLK
+        assert (tmp_path / "disk0").read_bytes() == b""
+        assert isinstance(errors[targets[1]], FileNotFoundError)
+        assert not targets[1].exists()
+
+    def test_write_image_to_targets_cancelled(self, tmp_path: Path):
+        (tmp_path / "ignition.img").write_bytes(os.urandom(4 * disk_writer.ALIGNMENT))
+        targets = [tmp_path / "disk0", tmp_path / "disk1"]
+        cancel = threading.Event()
+        cancel.set()
+
+        def report(target: Path, done: int, total: int) -> None:
+            progress.check_cancelled(cancel)
+
+        # A target that fails outside of an OSError mustn't leave the others waiting forever
+        results = disk_writer.write_image_to_targets(
+            tmp_path / "ignition.img",
+            targets,
+            disk_writer.ALIGNMENT,
+            progress=report,
+            regular_files=True,
+        )
+        assert all(isinstance(results[target], progress.Cancelled) for target in targets)
+
+    def test_write_image_unaligned_block_size(self, tmp_path: Path):
+        (tmp_path / "ignition.img").write_bytes(b"\0")
+        with pytest.raises(ValueError):
+            disk_writer.write_image(tmp_path / "ignition.img", tmp_path / "disk", block_size=1000)
+
+
+class TestFat:
+    def test_build_fat_image(self):
+        image = fat.build_fat_image({"ignition/config.ign": b"{}"})
+        assert len(image) >= fat.MIN_SECTORS * fat.SECTOR_SIZE
+        assert image[510:512] == b"\x55\xaa"
+        assert image[43:54] == b"IGNITION   "
+        assert image[54:62] == b"FAT12   "
+
+    def test_build_fat_image_reproducible(self):
+        files = {"ignition/config.ign": b"{}", "combustion/script": b"#!/bin/bash"}
+        assert fat.build_fat_image(files) == fat.build_fat_image(files)
+
+    def test_short_name(self):
+        assert fat.short_name("config.ign") == (
+            b"CONFIG  IGN",
+            fat.NT_LOWER_BASE | fat.NT_LOWER_EXT,
+        )
+        assert fat.short_name("combustion") is None
+        assert fat.short_name("Mixed.txt") is None
+
+    def test_read_fat_file(self):
+        files = {"ignition/config.ign": b"{}" * 4096, "combustion/script": b"#!/bin/bash"}
+        image = fat.build_fat_image(files)
+        for path, contents in files.items():
+            assert fat.read_fat_file(image, path) == contents
+        with pytest.raises(FileNotFoundError):
+            fat.read_fat_file(image, "ignition/missing.ign")
+
+    def test_generated_short_name(self):
+        taken = {b"COMBUS~1   "}
+        assert fat.generated_short_name("combustion", taken) == b"COMBUS~2   "
+
+
+class TestTranslator:
+    def test_fuelignition_to_ignition(self):
+        with open(TEST_DATA_DIR / "fuelignition.json", "r") as f:
+            fuelignition = json.load(f)
+        with open(TEST_DATA_DIR / "config.ign", "r") as f:
+            expected = json.load(f)
+        # fuel-ignition adds a non-spec "human_read" key
+        for file in expected["storage"]["files"]:
+            file["contents"].pop("human_read", None)
+        test_result = translator.fuelignition_to_ignition(fuelignition)
+        assert test_result == expected
+
+    def test_data_url(self):
+        assert translator.data_url("a b", base64=False) == "data:,a%20b"
+        assert translator.data_url("abc") == "data:text/plain;charset=utf-8;base64,YWJj"
+
+    def test_hash_password(self):
+        hashed = translator.hash_password("password")
+        assert hashed.startswith("$2b$")
+
+    def test_translate_prehashed_users(self):
+        fuelignition = {"login": {"users": [{"name": "root", "password_hash": "$2b$04$abc"}]}}
+        assert translator.translate_users(fuelignition) == [
+            {"name": "root", "passwordHash": "$2b$04$abc"}
+        ]
+
+    def test_combustion_script(self):
+        script = translator.combustion_script({"package": {"install": ["docker, jq"]}})
+        assert script is not None
+        assert script.endswith("zypper --non-interactive install docker jq\n")
+        assert translator.combustion_script({}) is None
+
+
+class TestNative:
+    def test_render_image(self):
+        with open(TEST_DATA_DIR / "fuelignition.json", "r") as f:
+            fuelignition = json.load(f)
+        image = native.render_image(fuelignition)
+        assert image[43:54] == b"IGNITION   "
+        assert b'"version": "3.2.0"' in image
+        assert b"zypper --non-interactive install" in image
+
+
+class TestPool:
+    def test_state_roundtrip(self):
+        config.BUILD_DIR.mkdir(parents=True, exist_ok=True)
+        state: pool.PoolState = {
+            "selenium_container": "selenium",
+            "fuelignition_container": "fuelignition",
+            "fuelignition_image": "image",
+            "driver_port": 4444,
+            "session_id": "session",
+            "max_sessions": 1,
+            "last_used": 0.0,
+        }
+        pool.save_state(state)
+        assert pool.load_state() == state
+        pool.touch()
+        touched = pool.load_state()
+        assert touched is not None
+        assert pool.idle_time(touched) < 60
+        pool.state_path().unlink()
+        assert pool.load_state() is None
+
+    def test_idle_time(self):
+        state = {"last_used": time.time() - 10}
+        assert pool.idle_time(state) >= 10  # type: ignore
+
+    def test_lease(self):
+        with pool.lease() as leased:
+            assert leased
+            # Another invocation can't use the pool while it is leased
+            with pool.lease(blocking=False) as other:
+                assert not other
+        with pool.lease(blocking=False) as leased:
+            assert leased
+
+    def test_reap(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.setattr(config, "BUILD_DIR", tmp_path)
+        monkeypatch.setattr(pool, "REAP_RETRY_INTERVAL", 0)
+        stopped = []
+        monkeypatch.setattr(
+            pool, "shutdown", lambda state: stopped.append(state) or pool.state_path().unlink()
+        )
+        state: pool.PoolState = {
+            "selenium_container": "selenium",
+            "fuelignition_container": "fuelignition",
+            "fuelignition_image": "image",
+            "driver_port": 4444,
+            "session_id": "session",
+            "max_sessions": 1,
+            "last_used": time.time() - config.POOL_IDLE_TIMEOUT - 1,
+        }
+        pool.save_state(state)
+        # A reaper left over from a pool that has since been replaced just exits
+        pool.reap("replaced")
+        assert not stopped
+        pool.reap("selenium")
+        assert stopped == [state]
+
+
+class TestBatch:
+    @pytest.mark.parametrize("suffix", ["toml", "csv", "jsonl"])
+    def test_load_inventory(self, suffix: str):
+        nodes = batch.load_inventory(TEST_DATA_DIR / f"batch/inventory.{suffix}")
+        assert [n["hostname"] for n in nodes] == ["node01", "node02"]
+        assert int(nodes[0]["switch_port"]) == 42
+        assert set(nodes[1].keys()) == {"hostname"}
+
+    def test_load_inventory_unsupported(self, tmp_path: Path):
+        with pytest.raises(ValueError):
+            batch.load_inventory(tmp_path / "inventory.yaml")
+
+    def test_resolve_nodes(self):
+        nodes = batch.resolve_nodes(
+            batch.load_inventory(TEST_DATA_DIR / "batch/inventory.toml"),
+            {"password": "default", "switch_ip": "10.0.0.1", "switch_port": 4789},
+        )
+        assert nodes[0]["password"] == "password01"
+        assert nodes[1]["password"] == "default"
+        assert str(nodes[1]["switch_ip"]) == "10.0.0.1"
+        assert nodes[1]["switch_port"] == 4789
+
+    def test_resolve_nodes_invalid(self):
+        with pytest.raises(ValueError):
+            batch.resolve_nodes([{"hostname": "a"}, {"hostname": "a"}], {})
+        with pytest.raises(ValueError):
+            batch.resolve_nodes([{"password": "a"}], {})
+        with pytest.raises(ValueError):
+            batch.resolve_nodes([{"hostname": "a", "colour": "blue"}], {})
+        with pytest.raises(ValueError):
+            batch.resolve_nodes(
+                [{"hostname": "a", "disk": "/dev/sdb"}, {"hostname": "b", "disk": "/dev/sdb"}], {}
+            )
+
+    @pytest.mark.parametrize(
+        "hostname", ["../../tmp/evil", "node/01", "-node", "node\r\nX: y", "", 1, "n" * 64]
+    )
+    def test_resolve_nodes_invalid_hostname(self, hostname):
+        with pytest.raises(ValueError):
+            batch.resolve_nodes([{"hostname": hostname}], {})
+
+    def test_write_node_disks_invalid(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+        # Batch writes validate with the configured backend, as single node writes do
+        (tmp_path / "ignition.img").write_bytes(fat.build_fat_image({"ignition/config.ign": b"{}"}))
+        monkeypatch.setattr(config, "VALIDATION_BACKEND", "unknown")
+        disk = str(tmp_path / "disk")
+        with pytest.raises(ValueError, match="Unknown validation backend"):
+            batch.write_node_disks([(disk, tmp_path / "ignition.img")])
+        monkeypatch.setattr(config, "VALIDATION_BACKEND", "native")
+        assert batch.write_node_disks([(disk, tmp_path / "ignition.img")]) == [disk]
+        assert not Path(disk).exists()
+
+    def test_render_node(self):
+        params = TEST_PARAMS["create_img"]["create_img"]
+        # The expected config was rendered for a hostname resolve_nodes would refuse, which
+        # render_node itself doesn't check
+        node = {**batch.resolve_nodes([{**params, "hostname": "node01"}], {})[0]}
+        node["hostname"] = params["hostname"]
+        with open(TEST_DATA_DIR / "create_img/apply_ignition_settings.pkl", "rb") as f:
+            expected = pickle.load(f)
+        assert batch.render_node(node) == expected
+
+
+class LogContainer:
+    """Stands in for a docker container whose log stream ends after the given chunks"""
+
+    name = "log_container"
+
+    def __init__(self, *chunks: bytes):
+        self.chunks = chunks
+
+    def logs(self, stream: bool, follow: bool):
+        class Stream:
+            def __iter__(inner):
+                return iter(self.chunks)
+
+            def close(inner):
+                pass
+
+        return Stream()
+
+
+class TestReadiness:
+    def test_wait_for_log(self):
+        container = LogContainer(b"starting\nStarted Sel", b"enium Standalone\n")
+        elapsed = readiness.wait_for_log(container, lambda x: "Started Selenium" in x, 5)
+        assert readiness.ready_times[container.name] == elapsed
+
+    def test_wait_for_log_exited(self):
+        container = LogContainer(b"starting\n", b"error\n")
+        with pytest.raises(RuntimeError):
+            readiness.wait_for_log(container, lambda x: "Started Selenium" in x, 5)
+
+
+class TestProgress:
+    def test_task_events(self):
+        events = []
+        unsubscribe = progress.subscribe(events.append)
+        try:
+            with progress.job("node1"):
+                with progress.task("Writing", total=4) as update:
+                    update(2)
+            with pytest.raises(ValueError):
+                with progress.task("Failing", job="node2"):
+                    raise ValueError("broken")
+        finally:
+            unsubscribe()
+        assert [(e.kind, e.job, e.stage) for e in events] == [
+            ("start", "node1", "Writing"),
+            ("update", "node1", "Writing"),
+            ("end", "node1", "Writing"),
+            ("start", "node2", "Failing"),
+            ("end", "node2", "Failing"),
+        ]
+        assert events[1].fraction == 0.5
+        assert events[-1].error == "broken"
+
+    def test_cancellable(self):
+        cancel = threading.Event()
+        with progress.cancellable(cancel):
+            with progress.task("Writing") as update:
+                update(1)
+                cancel.set()
+                with pytest.raises(progress.Cancelled):
+                    update(2)
+            with pytest.raises(progress.Cancelled):
+                with progress.task("Next"):
+                    pass
+        # Stages outside the context aren't cancelled
+        with progress.task("Other") as update:
+            update(1)
+
+    def test_rich_renderer(self):
+        display = cli.Progress()
+        renderer = cli.RichRenderer(display)
+        unsubscribe = progress.subscribe(renderer)
+        try:
+            with progress.task("Outer", job="node1"):
+                with progress.task("Inner", total=2**20, job="node1") as update:
+                    update(2**19)
+                    descriptions = [t.description for t in display.tasks]
+                    assert descriptions == ["\\[node1] Outer", "\\[node1] Inner"]
+                    assert display.tasks[1].fields["indent"] == "├─► "
+                    assert display.tasks[1].fields["amount"].startswith("50% 0.5/1.0 MiB")
+        finally:
+            unsubscribe()
+        assert not display.tasks
+
+
+class TestTimings:
+    def test_timing_report(self, tmp_path: Path):
+        with timings.timing_report(json_path=tmp_path / "timings.json"):
+            with progress.task("outer"):
+                with progress.task("inner") as update:
+                    update(2**20)
+        with open(tmp_path / "timings.json", "r") as f:
+            report = json.load(f)
+        assert [s["stage"] for s in report["stages"]] == ["outer", "inner"]
+        assert report["stages"][1]["bytes"] == 2**20
+        assert 0 <= report["stages"][0]["start"] <= report["stages"][1]["start"]
+        assert report["seconds"] >= report["stages"][0]["seconds"]
+        table = timings.format_report(report).splitlines()
+        assert table[2].startswith("  inner") and table[2].endswith("1.00")
+
+    def test_timing_report_unsubscribes(self):
+        subscribers = len(progress.subscribers)
+        with timings.timing_report():
+            assert len(progress.subscribers) == subscribers + 1
+        # Nothing is recorded between reports, so long running processes don't accumulate stages
+        assert len(progress.subscribers) == subscribers
+
+    def test_json_to_img_timings(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.setattr(config, "CONVERSION_ENGINE", "native")
+        monkeypatch.setattr(config, "CACHE_IMAGES", False)
+        autoignition.json_to_img(
+            json_path=TEST_DATA_DIR / "fuelignition.json",
+            img_path=tmp_path / "ignition.img",
+            timings_json=tmp_path / "timings.json",
+        )
+        with open(tmp_path / "timings.json", "r") as f:
+            report = json.load(f)
+        stages = {s["stage"]: s for s in report["stages"]}
+        assert stages["Converting natively"]["bytes"] == (tmp_path / "ignition.img").stat().st_size
+
+
+class TestCache:
+    def test_cache_key(self):
+        key = cache.cache_key({"a": 1, "b": [1, 2]}, "rev")
+        assert key == cache.cache_key({"b": [1, 2], "a": 1}, "rev")
+        assert cache.cache_key({"a": 1}, "rev") != cache.cache_key({"a": 2}, "rev")
+        assert key != cache.cache_key({"a": 1, "b": [1, 2]}, "other")
+
+    def test_engine_revision_updates_source(self, monkeypatch: pytest.MonkeyPatch):
+        # The key must name the revision the image is built from, not the one before updating
+        monkeypatch.setattr(config, "CONVERSION_ENGINE", "fuelignition")
+        monkeypatch.setattr(cache, "update_source", lambda: "updated")
+        assert cache.engine_revision() == "fuelignition-updated"
+        monkeypatch.setattr(config, "CONVERSION_ENGINE", "native")
+        native = cache.engine_revision()
+        monkeypatch.setattr(config, "PASSWORD_HASH_COST", config.PASSWORD_HASH_COST + 1)
+        assert cache.engine_revision() != native
+
+    def test_store_fetch(self, tmp_path: Path):
+        source = tmp_path / "source.img"
+        source.write_bytes(b"image")
+        cache.store("test_store_fetch", source)
+        assert cache.fetch("test_store_fetch", tmp_path / "fetched.img")
+        assert (tmp_path / "fetched.img").read_bytes() == b"image"
+        assert not cache.fetch("test_store_fetch_missing", tmp_path / "missing.img")
+
+    def test_fetch_corrupt(self, tmp_path: Path):
+        source = tmp_path / "source.img"
+        source.write_bytes(b"image")
+        cache.store("test_fetch_corrupt", source, sha256(b"image").hexdigest())
+        (cache.cache_dir() / "test_fetch_corrupt.img").write_bytes(b"imagf")
+        # A corrupt image is a miss, and is evicted so that it is cached again
+        assert not cache.fetch("test_fetch_corrupt", tmp_path / "fetched.img")
+        assert not (tmp_path / "fetched.img").exists()
+        assert not (cache.cache_dir() / "test_fetch_corrupt.img").exists()
+        assert not (cache.cache_dir() / "test_fetch_corrupt.sha256").exists()
+
+    def test_prune_to(self, tmp_path: Path):
+        cache.prune_to(0)
+        for i in range(3):
+            source = tmp_path / f"{i}.img"
+            source.write_bytes(b"x" * 10)
+            cache.store(f"test_prune_{i}", source)
+            os.utime(cache.cache_dir() / f"test_prune_{i}.img", (i, i))
+        evicted = cache.prune_to(20)
+        assert [e.key for e in evicted] == ["test_prune_0"]
+        assert [e.key for e in cache.entries()] == ["test_prune_2", "test_prune_1"]
+
+
+class TestBlockDevices:
+    @staticmethod
+    def fake_disk(sys_block: Path, name: str, sectors: int, **attributes: str) -> None:
+        (sys_block / name / "device").mkdir(parents=True)
+        (sys_block / name / "size").write_text(f"{sectors}\n")
+        for attribute, value in attributes.items():
+            path = sys_block / name / attribute.replace("__", "/")
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(f"{value}\n")
+
+    def test_read_devices(self, tmp_path: Path):
+        sys_block = tmp_path / "block"
+        self.fake_disk(sys_block, "sda", 2000, device__model="SSD", sda1__partition="1")
+        self.fake_disk(sys_block, "sdb", 4000000, removable="1", device__vendor="USB")
+        self.fake_disk(sys_block, "sdc", 0, removable="1")  # A card reader with no card
+        self.fake_disk(sys_block, "sr0", 2000, ro="1")
+        (sys_block / "loop0").mkdir()
+        (sys_block / "loop0" / "size").write_text("2000\n")
+        mounts = tmp_path / "mounts"
+        mounts.write_text("/dev/sda1 / ext4 rw 0 0\nproc /proc proc rw 0 0\n")
+        devices = block_devices.read_devices(sys_block, mounts)
+        assert devices == [
+            block_devices.BlockDevice("sda", 2000 * 512, False, "SSD", ("/",)),
+            block_devices.BlockDevice("sdb", 4000000 * 512, True, "USB"),
+        ]
+        assert devices[0].system and not devices[1].system
+        assert devices[1].label == "/dev/sdb (2.0 GB, USB, removable)"
+
+    def test_block_devices_cache(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+        sys_block = tmp_path / "block"
+        sys_block.mkdir()
+        (tmp_path / "mounts").write_text("")
+        monkeypatch.setattr(block_devices, "SYS_BLOCK", sys_block)
+        monkeypatch.setattr(block_devices, "MOUNTS", tmp_path / "mounts")
+        read_devices = block_devices.read_devices
+        reads = []
+        monkeypatch.setattr(
+            block_devices, "read_devices", lambda *args: reads.append(args) or read_devices(*args)
+        )
+        assert block_devices.block_devices() == []
+        assert block_devices.block_devices() == []
+        assert len(reads) == 1
+        self.fake_disk(sys_block, "sda", 2000)
+        assert [disk.name for disk in block_devices.block_devices()] == ["sda"]
+        assert len(reads) == 2
+
+    def test_watch(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+        sys_block = tmp_path / "block"
+        sys_block.mkdir()
+        (tmp_path / "mounts").write_text("")
+        monkeypatch.setattr(block_devices, "SYS_BLOCK", sys_block)
+        monkeypatch.setattr(block_devices, "MOUNTS", tmp_path / "mounts")
+        changes = []
+        changed = threading.Event()
+        stop = block_devices.watch(lambda devices: changes.append(devices) or changed.set(), 0.01)
+        try:
+            time.sleep(0.05)
+            self.fake_disk(sys_block, "sdb", 2000, removable="1")
+            assert changed.wait(5)
+        finally:
+            stop()
+        assert [[disk.name for disk in devices] for devices in changes] == [["sdb"]]
+
+
+class TestTemplates:
+    def test_render_shares_template(self):
+        template = create_img.load_template()
+        before = pickle.dumps(template)
+        first = create_img.apply_ignition_settings(template, "first", "a", {})
+        second = create_img.apply_ignition_settings(template, "second", "b", {})
+        # Rendering must neither change the template nor leak settings between nodes
+        assert pickle.dumps(template) == before
+        assert first["login"]["users"][0]["passwd"] == "a"
+        assert second["login"]["users"][0]["passwd"] == "b"
+        assert first["network"] is second["network"]
+        assert first["systemd"] is second["systemd"]
+        with pytest.raises(TypeError):
+            first["storage"]["files"].append({})
+        with pytest.raises(TypeError):
+            first["hostname"] = "third"
+
+    def test_freeze(self):
+        frozen = templates.freeze({"a": [1, {"b": 2}]})
+        assert frozen == {"a": [1, {"b": 2}]}
+        assert isinstance(frozen["a"][1], templates.FrozenDict)
+        assert templates.freeze(frozen) is frozen
+        assert pickle.loads(pickle.dumps(frozen)) == frozen
+        assert json.loads(json.dumps(frozen)) == frozen
+        updated = templates.assoc_in(frozen, ("a", 1, "b"), 3)
+        assert updated == {"a": [1, {"b": 3}]} and frozen == {"a": [1, {"b": 2}]}
+
+    def test_validate_template(self):
+        with pytest.raises(ValueError):
+            templates.validate_template([])
+        with pytest.raises(ValueError):
+            templates.validate_template({"login": {"users": []}})
+        with pytest.raises(ValueError):
+            templates.validate_template({"login": {"users": [{}]}, "storage": {"files": {}}})
+
+
+class TestPasswords:
+    def test_shared_salt_policy(self):
+        hashed = passwords.hash_passwords(["shared", "shared", "other"], cost=4, policy="shared")
+        assert hashed[0] == hashed[1] != hashed[2]
+        assert passwords.cached_hash("shared", cost=4, policy="shared") == hashed[0]
+        assert bcrypt.checkpw(b"shared", hashed[0].encode())
+        assert hashed[0].startswith("$2b$04$")
+
+    def test_unique_salt_policy(self):
+        # Spread across processes, with every node getting its own salt
+        hashed = passwords.hash_passwords(["unique"] * 3, cost=4, policy="unique", workers=2)
+        assert len(set(hashed)) == 3
+        assert all(bcrypt.checkpw(b"unique", h.encode()) for h in hashed)
+
+    def test_unknown_salt_policy(self):
+        with pytest.raises(ValueError):
+            passwords.hash_passwords(["password"], cost=4, policy="pepper")
+
+    def test_render_hashed(self):
+        template = create_img.load_template()
+        rendered = create_img.apply_ignition_settings(template, "node", "pw", {}, "$2b$04$abc")
+        assert rendered["login"]["users"][0] == {"name": "root", "password_hash": "$2b$04$abc"}
+
+
+class TestServe:
+    NODE = {"hostname": "node01", "password": "password", "switch_ip": "10.0.0.1"}
+
+    def test_job(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.setattr(config, "BUILD_DIR", tmp_path)
+        monkeypatch.setattr(config, "CONVERSION_ENGINE", "native")
+        monkeypatch.setattr(config, "CACHE_IMAGES", False)
+        service = serve.Service()
+        response = service.route("POST", "/jobs", json.dumps(self.NODE).encode())
+        assert response.status == 202
+        job = json.loads(response.body)
+        assert job["status"] == "queued" and "password" not in job
+        assert service.route("GET", f"/jobs/{job['id']}/image", b"").status == 409
+        assert len(service.queue) == 1
+        unsubscribe = progress.subscribe(service.on_event)
+        try:
+            service.run_job(service.dequeue())
+        finally:
+            unsubscribe()
+        job = json.loads(service.route("GET", f"/jobs/{job['id']}", b"").body)
+        assert job["status"] == "done", job["error"]
+        assert "Converting natively" in [t["stage"] for t in job["timings"]]
+        image = service.route("GET", job["image"], b"")
+        assert image.path is not None and image.path.read_bytes()[43:54] == b"IGNITION   "
+        assert image.path.parent.parent == tmp_path / "serve"
+        assert image.headers["Content-Disposition"] == 'attachment; filename="node01.img"'
+        metrics = service.metrics()
+        assert 'node_deployer_jobs_finished_total{status="done"} 1' in metrics
+        assert 'node_deployer_stage_seconds_count{stage="Converting natively"} 1' in metrics
+
+    def test_invalid_requests(self, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.setattr(config, "SERVE_QUEUE_SIZE", 1)
+        service = serve.Service()
+        assert service.route("POST", "/jobs", b"{").status == 400
+        assert service.route("POST", "/jobs", b'{"colour": "blue"}').status == 400
+        node = json.dumps({**self.NODE, "disk": "/dev/sdb"}).encode()
+        assert service.route("POST", "/jobs", node).status == 400
+        assert service.route("GET", "/jobs/missing", b"").status == 404
+        assert service.route("PUT", "/jobs", b"").status == 404
+        # Hostnames name the job's download, so only valid ones are accepted
+        for hostname in ("../../../../tmp/evil", "node01\r\nSet-Cookie: x=y"):
+            node = json.dumps({**self.NODE, "hostname": hostname}).encode()
+            assert service.route("POST", "/jobs", node).status == 400
+        assert service.route("POST", "/jobs", json.dumps(self.NODE).encode()).status == 202
+        # The queue is bounded, so clients are told to back off rather than piling jobs up
+        assert service.route("POST", "/jobs", json.dumps(self.NODE).encode()).status == 503
+
+    def test_cancel_queued(self):
+        service = serve.Service()
+        job = json.loads(service.route("POST", "/jobs", json.dumps(self.NODE).encode()).body)
+        cancelled = json.loads(service.route("DELETE", f"/jobs/{job['id']}", b"").body)
+        assert cancelled["status"] == "cancelled"
+        assert service.jobs[job["id"]].started is None
+        # Cancelled jobs leave the queue, so they don't hold up new jobs
+        assert "node_deployer_queue_depth 0" in service.metrics()
+        for _ in range(config.SERVE_QUEUE_SIZE):
+            assert service.route("POST", "/jobs", json.dumps(self.NODE).encode()).status == 202
+
+    def test_cancel_dequeued(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.setattr(config, "BUILD_DIR", tmp_path)
+        service = serve.Service()
+        job = json.loads(service.route("POST", "/jobs", json.dumps(self.NODE).encode()).body)
+        # A job taken by a worker but not yet started is cancelled as a running job is
+        dequeued = service.dequeue()
+        response = service.route("DELETE", f"/jobs/{job['id']}", b"")
+        assert response.status == 200
+        assert dequeued is not None and dequeued.cancel.is_set()
+        service.run_job(dequeued)
+        assert dequeued.status == "cancelled"
+
+    def test_http(self):
+        async def get_metrics() -> bytes:
+            server = await asyncio.start_server(serve.Service().handle, "127.0.0.1", 0)
+            async with server:
+                port = server.sockets[0].getsockname()[1]
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+                response = await reader.read()
+                writer.close()
+                return response
+
+        response = asyncio.run(get_metrics())
+        assert response.startswith(b"HTTP/1.1 200 OK\r\n")
+        assert b"\r\n\r\n# HELP node_deployer_queue_depth" in response
+
+
+class TestFuelignitionSource:
+    @staticmethod
+    def commit(upstream: Path, contents: str) -> str:
+        (upstream / "Dockerfile").write_text(contents)
+        git = ["git", "-C", str(upstream), "-c", "user.name=test", "-c", "user.email=test@test"]
+        subprocess.run([*git, "add", "Dockerfile"], check=True, capture_output=True)
+        subprocess.run([*git, "commit", "-m", contents], check=True, capture_output=True)
+        return subprocess.run(
+            [*git, "rev-parse", "HEAD"], check=True, capture_output=True, text=True
+        ).stdout.strip()
+
+    @pytest.fixture
+    def upstream(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+        upstream = tmp_path / "upstream"
+        init = ["git", "init", "-b", "main", str(upstream)]
+        subprocess.run(init, check=True, capture_output=True)
+        monkeypatch.setattr(config, "FUELIGNITION_REPO", upstream.as_uri())
+        monkeypatch.setattr(config, "FUELIGNITION_REF", "main")
+        monkeypatch.setattr(config, "FUELIGNITION_SHALLOW", True)
+        monkeypatch.setattr(config, "FUELIGNITION_UPDATE_TTL", 3600)
+        monkeypatch.setattr(config, "FUELIGNITION_BUILD_DIR", tmp_path / "fuel-ignition")
+        monkeypatch.setattr(config, "BUILD_DIR", tmp_path / "build")
+        return upstream
+
+    def test_track(self, upstream: Path, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.setattr(config, "FUELIGNITION_SOURCE_MODE", "track")
+        self.commit(upstream, "first")
+        first = self.commit(upstream, "second")
+        assert fuelignition_source.update_source() == first
+        assert (config.FUELIGNITION_BUILD_DIR / ".git/shallow").exists()
+        # Within the TTL, the checkout is used as is
+        second = self.commit(upstream, "third")
+        assert fuelignition_source.update_source() == first
+        monkeypatch.setattr(config, "FUELIGNITION_UPDATE_TTL", 0)
+        assert fuelignition_source.update_source() == second
+        # If the repository can't be reached, the local checkout is used instead
+        monkeypatch.setattr(config, "FUELIGNITION_REPO", (upstream.parent / "missing").as_uri())
+        assert fuelignition_source.update_source() == second
+
+    def test_pinned(self, upstream: Path, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.setattr(config, "FUELIGNITION_SOURCE_MODE", "pinned")
+        pinned = self.commit(upstream, "first")
+        self.commit(upstream, "second")
+        monkeypatch.setattr(config, "FUELIGNITION_REF", pinned)
+        assert fuelignition_source.update_source() == pinned
+        assert (config.FUELIGNITION_BUILD_DIR / "Dockerfile").read_text() == "first"
+        # Once checked out, a pinned revision never needs the network again
+        monkeypatch.setattr(config, "FUELIGNITION_REPO", (upstream.parent / "missing").as_uri())
+        shutil.rmtree(upstream)
+        assert fuelignition_source.update_source() == pinned
+
+    def test_offline(self, upstream: Path, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.setattr(config, "FUELIGNITION_SOURCE_MODE", "offline")
+        with pytest.raises(RuntimeError):
+            fuelignition_source.update_source()
+        monkeypatch.setattr(config, "FUELIGNITION_SOURCE_MODE", "track")
+        first = self.commit(upstream, "first")
+        fuelignition_source.update_source()
+        self.commit(upstream, "second")
+        monkeypatch.setattr(config, "FUELIGNITION_SOURCE_MODE", "offline")
+        monkeypatch.setattr(config, "FUELIGNITION_UPDATE_TTL", 0)
+        assert fuelignition_source.update_source() == first